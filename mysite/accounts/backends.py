@@ -0,0 +1,94 @@
+"""
+Кэш прав пользователей между запросами.
+
+``ModelBackend`` запоминает права только на объекте пользователя, то есть
+на один запрос. ``CachedPermissionBackend`` хранит множества прав в кэше
+под ключом с двумя версиями: общей (меняется при изменении прав групп,
+удалении групп и прав) и версией пользователя (меняется при изменении его
+групп и личных прав). Версии увеличиваются обработчиками ``m2m_changed``
+в ``accounts.models`` и сервисом ``accounts.rbac``, который пишет в
+промежуточные таблицы напрямую, без сигналов.
+
+Версии увеличиваются в кэше процесса, который изменил права, поэтому
+кэшировать права можно только при общем для всех воркеров кэше. С кэшем
+в памяти процесса (``LocMemCache``) бэкенд работает как ``ModelBackend``:
+иначе другой воркер до истечения таймаута пропускал бы отозванное право.
+"""
+
+import time
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db import transaction
+
+from mysite.caches import is_shared_cache
+
+PERMISSIONS_VERSION_KEY = "accounts:permissions-version"
+USER_VERSION_KEY = "accounts:permissions-version:{}"
+
+
+def _get_versions(user_pk) -> tuple:
+    keys = [PERMISSIONS_VERSION_KEY, USER_VERSION_KEY.format(user_pk)]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # как и у каталога: после вытеснения начинаем с нового числа
+            cache.add(key, int(time.time() * 1000), None)
+            versions[key] = cache.get(key)
+    return tuple(versions[key] for key in keys)
+
+
+def _bump(key: str) -> None:
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass  # ключа нет — его создаст следующее чтение с новым числом
+
+
+def _bump_twice(key: str) -> None:
+    # и после коммита: права могли прочитать и закэшировать до него
+    _bump(key)
+    transaction.on_commit(lambda: _bump(key))
+
+
+def invalidate_permissions(user_pks=None) -> None:
+    """Сбрасывает права указанных пользователей или (без аргумента) всех."""
+    if user_pks is None:
+        _bump_twice(PERMISSIONS_VERSION_KEY)
+        return
+    for pk in user_pks:
+        _bump_twice(USER_VERSION_KEY.format(pk))
+
+
+def permissions_cache_key(user_obj, from_name: str) -> str:
+    version, user_version = _get_versions(user_obj.pk)
+    return (
+        f"accounts:permissions:{version}:{user_version}:"
+        f"{user_obj.pk}:{int(user_obj.is_superuser)}:{from_name}"
+    )
+
+
+class CachedPermissionBackend(ModelBackend):
+    cache_timeout = getattr(settings, "PERMISSIONS_CACHE_TIMEOUT", 600)
+
+    def _cached(self, user_obj, obj, from_name: str, load):
+        attr = f"_{from_name}_perm_cache"
+        if obj is not None or not user_obj.is_active or user_obj.is_anonymous or hasattr(user_obj, attr):
+            return load(user_obj, obj)
+        if not is_shared_cache(cache):
+            return load(user_obj, obj)
+        key = permissions_cache_key(user_obj, from_name)
+        perms = cache.get(key)
+        if perms is None:
+            perms = load(user_obj, obj)
+            cache.set(key, perms, self.cache_timeout)
+        else:
+            setattr(user_obj, attr, perms)
+        return perms
+
+    def get_user_permissions(self, user_obj, obj=None):
+        return self._cached(user_obj, obj, "user", super().get_user_permissions)
+
+    def get_group_permissions(self, user_obj, obj=None):
+        return self._cached(user_obj, obj, "group", super().get_group_permissions)
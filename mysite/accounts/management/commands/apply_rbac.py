@@ -0,0 +1,33 @@
+import json
+from pathlib import Path
+
+from django.core.management import BaseCommand, CommandError
+
+from accounts.rbac import RBACError, apply_rbac
+
+
+class Command(BaseCommand):
+    """
+    Назначает группы и права по JSON-описанию (формат — в accounts.rbac).
+    """
+    help = "Assign groups and permissions to users in bulk from a JSON file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", type=Path)
+        parser.add_argument(
+            "--replace",
+            action="store_true",
+            help="Remove memberships and permissions of listed users/groups that are not in the file",
+        )
+
+    def handle(self, *args, path, replace, **options):
+        try:
+            mapping = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as exc:
+            raise CommandError(f"Cannot read {path}: {exc}")
+        try:
+            report = apply_rbac(mapping, replace=replace)
+        except RBACError as exc:
+            raise CommandError("\n".join(exc.errors))
+        self.stdout.write(json.dumps(report, indent=2))
+        self.stdout.write(self.style.SUCCESS("RBAC mapping applied"))
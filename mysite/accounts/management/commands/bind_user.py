@@ -1,25 +1,27 @@
-from django.contrib.auth.models import User, Group, Permission
-from django.core.management import BaseCommand
+from django.core.management import BaseCommand, CommandError
 
+from accounts.rbac import RBACError, apply_rbac
 
-class Command(BaseCommand):
-    def handle(self, *args, **options):
-        user = User.objects.get(pk=4)
-        group, created = Group.objects.get_or_create(
-            name="profile_manager",
-        )
-        permission_profile = Permission.objects.get(
-            codename="view_profile",
-        )
-        permission_logentry = Permission.objects.get(
-            codename="view_logentry",
-        )
-
-        group.permissions.add(permission_profile)
 
-        user.groups.add(group)
+class Command(BaseCommand):
+    """
+    Добавляет пользователя в группу profile_manager и даёт право просмотра журнала действий.
+    """
 
-        user.user_permissions.add(permission_logentry)
+    def add_arguments(self, parser):
+        parser.add_argument("username")
 
-        group.save()
-        user.save()
+    def handle(self, *args, username, **options):
+        try:
+            apply_rbac({
+                "groups": {"profile_manager": ["accounts.view_profile"]},
+                "users": {
+                    username: {
+                        "groups": ["profile_manager"],
+                        "permissions": ["admin.view_logentry"],
+                    },
+                },
+            })
+        except RBACError as exc:
+            raise CommandError("\n".join(exc.errors))
+        self.stdout.write(self.style.SUCCESS(f"User {username} bound to profile_manager"))
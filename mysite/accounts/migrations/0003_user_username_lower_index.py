@@ -0,0 +1,17 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_profile_avatar'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    # поиск пользователей по началу имени без учёта регистра (myapiapp.views.UserAutocompleteView)
+    operations = [
+        migrations.RunSQL(
+            "CREATE INDEX accounts_user_username_lower ON auth_user (LOWER(username))",
+            "DROP INDEX accounts_user_username_lower",
+        ),
+    ]
@@ -0,0 +1,23 @@
+class ObjectPermissionMixin:
+    """
+    Для ``SingleObjectMixin``-представлений с проверкой прав на объект.
+
+    ``get_object()`` обращается к базе один раз за запрос: проверка прав
+    (``test_func``/``has_permission``), ``get``/``post`` и контекст получают
+    один и тот же объект. ``object_select_related`` подгружает связи, нужные
+    проверке и шаблону, тем же запросом.
+    """
+    object_select_related = ()
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.object_select_related:
+            queryset = queryset.select_related(*self.object_select_related)
+        return queryset
+
+    def get_object(self, queryset=None):
+        if queryset is not None:
+            return super().get_object(queryset)
+        if not hasattr(self, "_permission_object"):
+            self._permission_object = super().get_object()
+        return self._permission_object
@@ -1,10 +1,12 @@
 import os
 
-from django.contrib.auth.models import User
+from django.contrib.auth.models import Group, Permission, User
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save
 from django.dispatch import receiver
 
+from .backends import invalidate_permissions
+
 
 def avatar_upload_path(instance, filename):
 
@@ -25,3 +27,38 @@ class Profile(models.Model):
 def create_profile(sender, instance, created, **kwargs):
     if created:
         Profile.objects.create(user=instance)
+
+
+@receiver(post_save, sender=User)
+def reset_new_user_permissions(sender, instance, created, **kwargs):
+    # id мог достаться от удалённого пользователя (или от отката транзакции)
+    if created:
+        invalidate_permissions([instance.pk])
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def invalidate_user_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith("post_"):
+        return
+    if not reverse:
+        invalidate_permissions([instance.pk])
+    elif pk_set:
+        invalidate_permissions(pk_set)
+    else:
+        # clear() со стороны группы или права: пользователи уже неизвестны
+        invalidate_permissions()
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_group_permissions(sender, action, **kwargs):
+    if action.startswith("post_"):
+        invalidate_permissions()
+
+
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Permission)
+@receiver(post_migrate)
+def invalidate_all_permissions(sender, **kwargs):
+    invalidate_permissions()
+
@@ -0,0 +1,153 @@
+"""
+Массовое назначение групп и прав.
+
+Описание — словарь вида::
+
+    {
+        "groups": {"profile_manager": ["accounts.view_profile"]},
+        "users": {
+            "alice": {"groups": ["profile_manager"], "permissions": ["admin.view_logentry"]},
+        },
+    }
+
+Права задаются как ``app_label.codename`` (или просто ``codename``, если он
+однозначен) и находятся одним запросом. Группы, которых нет, создаются.
+Связи в промежуточных таблицах сравниваются с уже существующими и
+добавляются одним ``bulk_create`` на таблицу, поэтому повторный запуск
+ничего не меняет. При ``replace=True`` лишние связи упомянутых групп и
+пользователей удаляются.
+"""
+
+from django.contrib.auth.models import Group, Permission, User
+from django.db import transaction
+
+from .backends import invalidate_permissions
+
+
+class RBACError(ValueError):
+    def __init__(self, errors: list):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+def resolve_permissions(references) -> dict:
+    """{"app_label.codename" или "codename": id права}; неизвестные — RBACError."""
+    references = set(references)
+    if not references:
+        return {}
+    codenames = {reference.rsplit(".", 1)[-1] for reference in references}
+    permissions = Permission.objects.filter(codename__in=codenames).values_list(
+        "pk", "codename", "content_type__app_label",
+    )
+    by_codename = {}
+    for pk, codename, app_label in permissions:
+        by_codename.setdefault(codename, []).append((app_label, pk))
+
+    resolved = {}
+    errors = []
+    for reference in sorted(references):
+        app_label, _, codename = reference.rpartition(".")
+        candidates = [
+            pk for label, pk in by_codename.get(codename, ())
+            if not app_label or label == app_label
+        ]
+        if len(candidates) == 1:
+            resolved[reference] = candidates[0]
+        elif candidates:
+            errors.append(f"Permission {reference!r} is ambiguous, use app_label.codename")
+        else:
+            errors.append(f"Unknown permission {reference!r}")
+    if errors:
+        raise RBACError(errors)
+    return resolved
+
+
+def _sync_links(through, owner_field: str, target_field: str, desired: dict, replace: bool) -> tuple:
+    """
+    desired — {id владельца: множество id связанных объектов}.
+    Возвращает (сколько связей добавлено, сколько удалено).
+    """
+    if not desired:
+        return 0, 0
+    existing = {
+        (owner, target): pk
+        for pk, owner, target in through.objects.filter(
+            **{f"{owner_field}__in": desired.keys()}
+        ).values_list("pk", owner_field, target_field)
+    }
+    wanted = {(owner, target) for owner, targets in desired.items() for target in targets}
+
+    to_add = wanted - existing.keys()
+    through.objects.bulk_create(
+        (through(**{owner_field: owner, target_field: target}) for owner, target in to_add),
+        batch_size=1000,
+        ignore_conflicts=True,  # параллельный запуск мог уже добавить ту же связь
+    )
+
+    removed = 0
+    if replace:
+        extra = [pk for link, pk in existing.items() if link not in wanted]
+        for start in range(0, len(extra), 1000):
+            deleted, _ = through.objects.filter(pk__in=extra[start:start + 1000]).delete()
+            removed += deleted
+    return len(to_add), removed
+
+
+def apply_rbac(mapping: dict, replace: bool = False) -> dict:
+    groups_spec = mapping.get("groups") or {}
+    users_spec = mapping.get("users") or {}
+
+    permission_refs = {ref for refs in groups_spec.values() for ref in refs}
+    permission_refs |= {ref for spec in users_spec.values() for ref in spec.get("permissions", ())}
+    group_names = set(groups_spec) | {name for spec in users_spec.values() for name in spec.get("groups", ())}
+
+    permissions = resolve_permissions(permission_refs)
+    users = dict(User.objects.filter(username__in=users_spec.keys()).values_list("username", "pk"))
+    missing_users = sorted(set(users_spec) - set(users))
+    if missing_users:
+        raise RBACError([f"Unknown users: {', '.join(missing_users)}"])
+
+    with transaction.atomic():
+        groups = dict(Group.objects.filter(name__in=group_names).values_list("name", "pk"))
+        new_groups = sorted(group_names - set(groups))
+        if new_groups:
+            Group.objects.bulk_create((Group(name=name) for name in new_groups), ignore_conflicts=True)
+            groups.update(Group.objects.filter(name__in=new_groups).values_list("name", "pk"))
+
+        group_permissions = _sync_links(
+            Group.permissions.through, "group_id", "permission_id",
+            {groups[name]: {permissions[ref] for ref in refs} for name, refs in groups_spec.items()},
+            replace,
+        )
+        user_groups = _sync_links(
+            User.groups.through, "user_id", "group_id",
+            {
+                users[username]: {groups[name] for name in spec.get("groups", ())}
+                for username, spec in users_spec.items()
+                if "groups" in spec or replace
+            },
+            replace,
+        )
+        user_permissions = _sync_links(
+            User.user_permissions.through, "user_id", "permission_id",
+            {
+                users[username]: {permissions[ref] for ref in spec.get("permissions", ())}
+                for username, spec in users_spec.items()
+                if "permissions" in spec or replace
+            },
+            replace,
+        )
+
+        # bulk_create и delete по промежуточным таблицам не шлют m2m_changed
+        if any(group_permissions):
+            invalidate_permissions()
+        changed_users = [users[username] for username in users_spec]
+        if changed_users and (any(user_groups) or any(user_permissions)):
+            invalidate_permissions(changed_users)
+
+    return {
+        "groups_created": new_groups,
+        "group_permissions": dict(zip(("added", "removed"), group_permissions)),
+        "user_groups": dict(zip(("added", "removed"), user_groups)),
+        "user_permissions": dict(zip(("added", "removed"), user_permissions)),
+    }
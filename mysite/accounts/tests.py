@@ -1,6 +1,16 @@
 
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from django.contrib.auth.models import Group, Permission, User
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
 from django.test import TestCase
 from django.urls import reverse
+from django.utils import translation
+
+from requestdataapp.querybudget import QueryBudgetTestMixin
+from .rbac import RBACError, apply_rbac
 
 
 class GetCookieViewTestCase(TestCase):
@@ -16,3 +26,162 @@ class FooBarViewTest(TestCase):
         self.assertEquals(response.headers["content-type"], "application/json",)
         expected_data = {"foo": "bar", "spam": "eggs"}
         self.assertJSONEqual(response.content, expected_data)
+
+
+class ApplyRBACTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="rbac-alice", password="qwerty")
+        cls.mapping = {
+            "groups": {"rbac-managers": ["accounts.view_profile", "shopapp.view_order"]},
+            "users": {"rbac-alice": {"groups": ["rbac-managers"], "permissions": ["admin.view_logentry"]}},
+        }
+
+    def test_apply_is_idempotent(self):
+        report = apply_rbac(self.mapping)
+        self.assertEqual(report["groups_created"], ["rbac-managers"])
+        self.assertEqual(report["group_permissions"], {"added": 2, "removed": 0})
+        self.assertEqual(report["user_groups"], {"added": 1, "removed": 0})
+        self.assertEqual(report["user_permissions"], {"added": 1, "removed": 0})
+
+        with self.assertNumQueries(8):
+            report = apply_rbac(self.mapping)
+        self.assertEqual(report["groups_created"], [])
+        self.assertEqual(report["group_permissions"], {"added": 0, "removed": 0})
+        self.assertTrue(User.objects.get(pk=self.user.pk).has_perm("shopapp.view_order"))
+
+    def test_replace_removes_extra_links(self):
+        apply_rbac(self.mapping)
+        report = apply_rbac({"groups": {"rbac-managers": ["view_profile"]}}, replace=True)
+        self.assertEqual(report["group_permissions"], {"added": 0, "removed": 1})
+        group = Group.objects.get(name="rbac-managers")
+        self.assertEqual(list(group.permissions.values_list("codename", flat=True)), ["view_profile"])
+        self.assertTrue(self.user.groups.filter(pk=group.pk).exists())
+
+    def test_unknown_references(self):
+        with self.assertRaises(RBACError) as context:
+            apply_rbac({"groups": {"rbac-managers": ["shopapp.fly_order"]}, "users": {"nobody": {}}})
+        self.assertEqual(context.exception.errors, ["Unknown permission 'shopapp.fly_order'"])
+        self.assertFalse(Group.objects.filter(name="rbac-managers").exists())
+
+    def test_api_requires_superuser(self):
+        translation.activate("en")
+        url = reverse("myapiapp:rbac")
+        self.client.force_login(self.user)
+        response = self.client.post(url, self.mapping, content_type="application/json")
+        self.assertEqual(response.status_code, 403)
+
+        admin = User.objects.create_superuser(username="rbac-admin", password="qwerty")
+        self.client.force_login(admin)
+        response = self.client.post(url, self.mapping, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["user_groups"], {"added": 1, "removed": 0})
+        response = self.client.post(url, {"users": {"nobody": {}}}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"errors": ["Unknown users: nobody"]})
+
+
+class CachedPermissionBackendTestCase(TestCase):
+    def setUp(self):
+        # общий для воркеров кэш
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.shared_cache = FileBasedCache(directory.name, {})
+        patcher = mock.patch("accounts.backends.cache", self.shared_cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create_user(username="perm-bob", password="qwerty")
+        self.group = Group.objects.create(name="perm-viewers")
+        self.group.permissions.add(Permission.objects.get(codename="view_order"))
+        self.user.groups.add(self.group)
+
+    def fresh_user(self):
+        return User.objects.get(pk=self.user.pk)
+
+    def as_worker(self, cache, perm: str) -> bool:
+        with mock.patch("accounts.backends.cache", cache):
+            return self.fresh_user().has_perm(perm)
+
+    def test_revocation_is_seen_by_other_workers(self):
+        for first, second in (
+            (self.shared_cache, FileBasedCache(self.shared_cache._dir, {})),
+            # у каждого воркера свой LocMemCache: права не кэшируются
+            (LocMemCache("worker-1", {}), LocMemCache("worker-2", {})),
+        ):
+            with self.subTest(backend=type(first).__name__):
+                self.group.permissions.add(Permission.objects.get(codename="view_order"))
+                self.assertTrue(self.as_worker(first, "shopapp.view_order"))
+                self.assertTrue(self.as_worker(second, "shopapp.view_order"))
+
+                with mock.patch("accounts.backends.cache", first):
+                    self.group.permissions.clear()
+                self.assertFalse(self.as_worker(second, "shopapp.view_order"))
+
+    def test_per_process_cache_is_not_used(self):
+        worker_cache = LocMemCache("worker", {})
+        self.assertTrue(self.as_worker(worker_cache, "shopapp.view_order"))
+        user = self.fresh_user()
+        with mock.patch("accounts.backends.cache", worker_cache), self.assertNumQueries(2):
+            self.assertTrue(user.has_perm("shopapp.view_order"))
+
+    def test_warm_path_makes_no_queries(self):
+        self.assertTrue(self.fresh_user().has_perm("shopapp.view_order"))
+        user = self.fresh_user()
+        with self.assertNumQueries(0):
+            self.assertTrue(user.has_perm("shopapp.view_order"))
+            self.assertFalse(user.has_perm("shopapp.add_order"))
+
+    def test_m2m_changes_invalidate(self):
+        self.assertTrue(self.fresh_user().has_perm("shopapp.view_order"))
+        self.group.permissions.clear()
+        self.assertFalse(self.fresh_user().has_perm("shopapp.view_order"))
+
+        self.user.user_permissions.add(Permission.objects.get(codename="add_order"))
+        self.assertTrue(self.fresh_user().has_perm("shopapp.add_order"))
+
+        self.group.permissions.add(Permission.objects.get(codename="view_order"))
+        self.group.user_set.remove(self.user)
+        self.assertFalse(self.fresh_user().has_perm("shopapp.view_order"))
+
+    def test_rbac_invalidates(self):
+        self.assertFalse(self.fresh_user().has_perm("shopapp.add_product"))
+        apply_rbac({"groups": {"perm-viewers": ["shopapp.add_product"]}})
+        self.assertTrue(self.fresh_user().has_perm("shopapp.add_product"))
+
+
+class UserViewsQueryTestCase(QueryBudgetTestMixin, TestCase):
+    def setUp(self):
+        translation.activate("en")
+        self.user = User.objects.create_user(username="views-carol", password="qwerty")
+        self.client.force_login(self.user)
+
+    def test_object_is_loaded_once(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse("accounts:user_detail", kwargs={"pk": self.user.pk}))
+        self.assertContains(response, "views-carol")
+        self.assertWithinDeclaredBudget(reverse("accounts:profile_update", kwargs={"pk": self.user.profile.pk}))
+
+    def test_other_users_are_forbidden(self):
+        other = User.objects.create_user(username="views-dave", password="qwerty")
+        response = self.client.get(reverse("accounts:user_detail", kwargs={"pk": other.pk}))
+        self.assertEqual(response.status_code, 403)
+
+
+class UserAutocompleteTestCase(TestCase):
+    def setUp(self):
+        for username in ("anna", "Andrew", "bob"):
+            User.objects.create_user(username=username, password="qwerty")
+        self.staff = User.objects.create_user(username="staff", password="qwerty", is_staff=True)
+
+    def test_prefix_lookup(self):
+        url = reverse("myapiapp:users_autocomplete")
+        self.client.force_login(User.objects.get(username="bob"))
+        self.assertEqual(self.client.get(url, {"q": "an"}).status_code, 403)
+
+        self.client.force_login(self.staff)
+        response = self.client.get(url, {"q": "an"})
+        self.assertEqual(response.json()["count"], 2)
+        self.assertEqual([user["username"] for user in response.json()["results"]], ["Andrew", "anna"])
+        response = self.client.get(url, {"q": "AN"})
+        self.assertEqual([user["username"] for user in response.json()["results"]], ["Andrew", "anna"])
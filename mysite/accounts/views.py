@@ -13,7 +13,9 @@ from django.views.generic import TemplateView, CreateView, DetailView, UpdateVie
 from django.utils.translation import gettext_lazy as _, ngettext
 
 from accounts.forms import ProfileForm
+from accounts.mixins import ObjectPermissionMixin
 from accounts.models import Profile
+from requestdataapp.querybudget import query_budget
 
 
 class HelloView(View):
@@ -35,6 +37,7 @@ class HelloView(View):
 
 
 class AboutMeView(LoginRequiredMixin, TemplateView):
+    query_budget = 4
     template_name = "accounts/about-me.html"
 
     def get_context_data(self, **kwargs):
@@ -63,6 +66,7 @@ class AboutMeView(LoginRequiredMixin, TemplateView):
 
 
 class RegisterView(CreateView):
+    query_budget = 8
     form_class = UserCreationForm
     template_name = "accounts/register.html"
     success_url = reverse_lazy("accounts:about-me")
@@ -85,6 +89,7 @@ class MyLogoutView(LogoutView):
     next_page = reverse_lazy("accounts:login")
 
 
+@query_budget(2)
 @user_passes_test(lambda u: u.is_superuser)
 def set_cookie_view(request: HttpRequest) -> HttpResponse:
     response = HttpResponse("Cookie set")
@@ -97,12 +102,14 @@ def get_cookie_view(request: HttpRequest) -> HttpResponse:
     return HttpResponse(f"Cookie value: {value!r}")
 
 
+@query_budget(6)
 @permission_required("accounts.view_profile", raise_exception=True)
 def set_session_view(request: HttpRequest) -> HttpResponse:
     request.session["foobar"] = "spameggs"
     return HttpResponse("Session set!")
 
 
+@query_budget(3)
 @login_required
 def get_session_view(request: HttpRequest) -> HttpResponse:
     value = request.session.get("foobar", "default")
@@ -115,13 +122,17 @@ class FooBarView(View):
 
 
 class UserListView(View):
+    query_budget = 3
+
     def get(self, request):
         users = User.objects.all()
         return render(request, 'accounts/user_list.html', {'users': users})
 
 
-class UserDetailView(UserPassesTestMixin, DetailView):
+class UserDetailView(UserPassesTestMixin, ObjectPermissionMixin, DetailView):
+    query_budget = 3
     model = User
+    object_select_related = ("profile",)
     template_name = 'accounts/user_detail.html'
     context_object_name = 'user'
 
@@ -139,8 +150,10 @@ class UserDetailView(UserPassesTestMixin, DetailView):
         return HttpResponseForbidden("У вас нет разрешения на просмотр этой страницы.")
 
 
-class UserUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
+class UserUpdateView(LoginRequiredMixin, UserPassesTestMixin, ObjectPermissionMixin, UpdateView):
+    query_budget = 4
     model = Profile
+    object_select_related = ("user",)
     template_name = 'accounts/user_update.html'
     fields = ['avatar', ]
 
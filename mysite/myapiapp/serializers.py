@@ -1,4 +1,4 @@
-from django.contrib.auth.models import Group
+from django.contrib.auth.models import Group, User
 from rest_framework import serializers
 
 
@@ -6,3 +6,24 @@ class GroupSerializer(serializers.ModelSerializer):
     class Meta:
         model = Group
         fields = "pk", "name"
+
+
+class UserLookupSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = "pk", "username"
+
+
+class UserAssignmentSerializer(serializers.Serializer):
+    groups = serializers.ListField(child=serializers.CharField(max_length=150), required=False)
+    permissions = serializers.ListField(child=serializers.CharField(), required=False)
+
+
+class RBACMappingSerializer(serializers.Serializer):
+    groups = serializers.DictField(
+        child=serializers.ListField(child=serializers.CharField()),
+        required=False,
+        default=dict,
+    )
+    users = serializers.DictField(child=UserAssignmentSerializer(), required=False, default=dict)
+    replace = serializers.BooleanField(default=False)
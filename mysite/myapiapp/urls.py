@@ -1,10 +1,12 @@
 from django.urls import path
 
-from .views import hello_world_view, GroupsListView
+from .views import hello_world_view, GroupsListView, RBACView, UserAutocompleteView
 
 app_name = "myapiapp"
 
 urlpatterns = [
     path("hello/", hello_world_view, name="hello"),
     path("groups/", GroupsListView.as_view(), name="groups"),
+    path("rbac/", RBACView.as_view(), name="rbac"),
+    path("users/autocomplete/", UserAutocompleteView.as_view(), name="users_autocomplete"),
 ]
\ No newline at end of file
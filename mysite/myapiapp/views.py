@@ -1,11 +1,16 @@
-from django.contrib.auth.models import Group
+from django.contrib.auth.models import Group, User
+from django.db.models import Value
+from django.db.models.functions import Concat, Lower
+from rest_framework import status
 from rest_framework.decorators import api_view
+from rest_framework.permissions import BasePermission, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.request import Request
-from rest_framework.generics import ListCreateAPIView
+from rest_framework.generics import ListAPIView, ListCreateAPIView
+from rest_framework.views import APIView
 
-
-from .serializers import GroupSerializer
+from accounts.rbac import RBACError, apply_rbac
+from .serializers import GroupSerializer, RBACMappingSerializer, UserLookupSerializer
 
 
 @api_view()
@@ -17,3 +22,51 @@ class GroupsListView(ListCreateAPIView):
     queryset = Group.objects.all()
     serializer_class = GroupSerializer
 
+
+class UserAutocompleteView(ListAPIView):
+    """
+    Поиск пользователей по началу имени (без учёта регистра) для виджетов выбора.
+    Диапазон по LOWER(username) идёт по индексу accounts_user_username_lower,
+    без LIKE. Обе границы приводит к нижнему регистру сама БД, чтобы они
+    совпадали с индексом.
+    """
+    query_budget = 4
+    permission_classes = [IsAdminUser]
+    serializer_class = UserLookupSerializer
+
+    def get_queryset(self):
+        query = self.request.query_params.get("q", "").strip()
+        queryset = (
+            User.objects.only("pk", "username")
+            .alias(username_lower=Lower("username"))
+            .order_by("username_lower", "pk")
+        )
+        if query:
+            prefix = Lower(Value(query))
+            queryset = queryset.filter(
+                username_lower__gte=prefix,
+                username_lower__lt=Concat(prefix, Value("\U0010ffff")),
+            )
+        return queryset
+
+
+class IsSuperuser(BasePermission):
+    def has_permission(self, request, view):
+        return bool(request.user and request.user.is_superuser)
+
+
+class RBACView(APIView):
+    """Массовое назначение групп и прав (формат — в accounts.rbac)"""
+    query_budget = 16
+    permission_classes = [IsSuperuser]
+
+    def post(self, request: Request) -> Response:
+        serializer = RBACMappingSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        try:
+            report = apply_rbac(data, replace=data["replace"])
+        except RBACError as exc:
+            return Response({"errors": exc.errors}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report)
+
@@ -0,0 +1,22 @@
+"""
+Общий ли кэш для всех процессов сайта.
+
+Версии каталога (``shopapp.cache``) и прав (``accounts.backends``) лежат
+в кэше по умолчанию и увеличиваются в том процессе, который изменил данные.
+Другие воркеры видят новую версию, только если кэш у них общий (memcached,
+redis, база, файлы). У ``LocMemCache`` кэш свой в каждом процессе,
+``DummyCache`` ничего не хранит.
+"""
+
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.connection import ConnectionProxy
+
+PER_PROCESS_BACKENDS = (LocMemCache, DummyCache)
+
+
+def is_shared_cache(cache) -> bool:
+    if isinstance(cache, ConnectionProxy):  # django.core.cache.cache
+        cache = caches[cache._alias]
+    return not isinstance(cache, PER_PROCESS_BACKENDS)
@@ -0,0 +1,124 @@
+"""
+Освобождение ссылок на блобы ``ContentAddressedStorage`` из FileField.
+
+Каждое сохранение файла в хранилище — одна ссылка на блоб, и её нужно
+вернуть через ``storage.delete()``, когда строка перестаёт ссылаться на файл:
+
+* файл в поле заменили или очистили — старое имя освобождается после
+  коммита транзакции;
+* строку удалили — имя освобождается после коммита;
+* транзакция, в которой файл был сохранён, откатилась — новое имя
+  освобождается сразу после отката.
+
+``connect_signals()`` подключает обработчики только к моделям, у которых
+есть FileField с этим хранилищем: обработчик ``post_delete`` выключает
+быстрое удаление каскадом, и остальным моделям он не нужен. Имена,
+загруженные из базы, запоминаются на ``post_init``. Отложенные
+(``defer()``) поля не отслеживаются.
+"""
+
+from django.core.files.base import File
+from django.apps import apps
+from django.db import transaction
+from django.db.models import FileField
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+
+from mysite.storage import ContentAddressedStorage
+
+_file_fields = {}
+
+
+def stored_file_fields(model) -> list:
+    """FileField модели, которые хранятся в ContentAddressedStorage."""
+    fields = _file_fields.get(model)
+    if fields is None:
+        fields = _file_fields[model] = [
+            field for field in model._meta.concrete_fields
+            if isinstance(field, FileField) and isinstance(field.storage, ContentAddressedStorage)
+        ]
+    return fields
+
+
+def _file_name(value):
+    return getattr(value, "name", value) or None
+
+
+class _RollbackRelease:
+    """
+    Колбэк для ``on_commit``, который срабатывает наоборот — при откате.
+
+    При коммите Django вызывает его (и освобождать ничего не нужно), при
+    откате отбрасывает не вызвав, и тогда освобождение выполняет ``__del__``.
+    """
+
+    def __init__(self, storage, name: str):
+        self.storage = storage
+        self.name = name
+
+    def __call__(self):
+        self.name = None
+
+    def __del__(self):
+        if self.name is not None:
+            self.storage.delete(self.name)
+
+
+def release_on_commit(storage, name: str) -> None:
+    transaction.on_commit(lambda: storage.delete(name))
+
+
+def remember_file_names(sender, instance, **kwargs):
+    instance._stored_files = {
+        field.attname: _file_name(instance.__dict__.get(field.attname))
+        for field in stored_file_fields(sender) if field.attname in instance.__dict__
+    }
+
+
+def note_new_files(sender, instance, raw, update_fields, **kwargs):
+    if raw:
+        return
+    # файл, ещё не переданный хранилищу, FileField.pre_save сохранит — это новая ссылка
+    instance._storing_files = {
+        field.attname for field in stored_file_fields(sender)
+        if (update_fields is None or field.name in update_fields)
+        and isinstance(value := instance.__dict__.get(field.attname), File)
+        and not getattr(value, "_committed", False)
+    }
+
+
+def release_replaced_files(sender, instance, created, raw, update_fields, **kwargs):
+    if raw:
+        return
+    loaded = getattr(instance, "_stored_files", {})
+    storing = getattr(instance, "_storing_files", set())
+    for field in stored_file_fields(sender):
+        if update_fields is not None and field.name not in update_fields:
+            continue
+        if field.attname not in instance.__dict__:
+            continue
+        name = _file_name(instance.__dict__[field.attname])
+        previous = None if created else loaded.get(field.attname)
+        if field.attname in storing and name:
+            transaction.on_commit(_RollbackRelease(field.storage, name))
+        # то же имя без новой загрузки — та же ссылка
+        if previous and (previous != name or field.attname in storing):
+            release_on_commit(field.storage, previous)
+        loaded[field.attname] = name
+    instance._stored_files = loaded
+    instance._storing_files = set()
+
+
+def release_deleted_files(sender, instance, **kwargs):
+    for field in stored_file_fields(sender):
+        name = _file_name(instance.__dict__.get(field.attname))
+        if name:
+            release_on_commit(field.storage, name)
+
+
+def connect_signals() -> None:
+    for model in apps.get_models():
+        if stored_file_fields(model):
+            post_init.connect(remember_file_names, sender=model)
+            pre_save.connect(note_new_files, sender=model)
+            post_save.connect(release_replaced_files, sender=model)
+            post_delete.connect(release_deleted_files, sender=model)
@@ -66,7 +66,8 @@ MIDDLEWARE = [
     'django.contrib.admindocs.middleware.XViewMiddleware',
 
     'requestdataapp.middlewares.set_useragent_on_request_middleware',
-    'requestdataapp.middlewares.CountRequestMiddleware',
+    'requestdataapp.middlewares.MetricsMiddleware',
+    'requestdataapp.middlewares.QueryBudgetMiddleware',
 ]
 
 ROOT_URLCONF = 'mysite.urls'
@@ -99,6 +100,24 @@ DATABASES = {
     }
 }
 
+# LocMemCache — только для запуска в одном процессе (runserver): версии каталога
+# и прав должны быть видны всем воркерам, см. mysite.caches и check --deploy
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+CATALOGUE_CACHE_TIMEOUT = 600
+AUTOCOMPLETE_FULL_RELOAD = 600
+
+# права кэшируются между запросами только при общем для воркеров кэше (см. mysite.caches)
+AUTHENTICATION_BACKENDS = [
+    'accounts.backends.CachedPermissionBackend',
+]
+
+PERMISSIONS_CACHE_TIMEOUT = 600
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -146,6 +165,24 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'uploads'
 
+STORAGES = {
+    "default": {
+        "BACKEND": "mysite.storage.ContentAddressedStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+}
+
+PRODUCT_UPLOAD_MAX_SIZE = 20 * 1024 * 1024
+
+# MIME-типы (по сигнатуре содержимого), которые принимает requestdataapp:file-upload,
+# например ("image/png", "image/jpeg", "application/pdf"); None — любые файлы
+UPLOAD_ALLOWED_TYPES = None
+
+THUMBNAIL_WIDTHS = (160, 320, 640)
+THUMBNAIL_WORKERS = 2
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -170,6 +207,29 @@ SPECTACULAR_SETTINGS = {
     "SERVE_INCLUDE_SCHEMA": False,
 }
 
+RATE_LIMIT = {
+    "STORAGE": "requestdataapp.ratelimit.LocMemStorage",
+    "STORAGE_OPTIONS": {
+        "max_entries": 10000,
+        "ttl": 3600,
+    },
+    "ANON_RATE": "500/s",
+    "USER_RATE": "500/s",
+    "ROUTES": {
+        "requestdataapp:file-upload": "10/m",
+    },
+}
+
+INTERNAL_IPS = [
+    "127.0.0.1",
+]
+
+METRICS_DIR = None
+METRICS_FLUSH_INTERVAL = 5
+
+QUERY_BUDGET_ENABLED = DEBUG
+QUERY_BUDGET_RAISE = False
+
 LOGGING = {
     'version': 1,
     'filters': {
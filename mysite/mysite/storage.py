@@ -0,0 +1,165 @@
+"""
+Хранилище загрузок с адресацией по содержимому.
+
+Файл при сохранении хэшируется (sha256) по мере записи на диск и кладётся
+в ``blobs/ab/cd/<sha256><расширение>``; имя, которое передал ``upload_to``,
+важно только расширением. Одинаковые файлы хранятся один раз, в базе у
+всех ссылающихся строк одно и то же имя.
+
+Число ссылок на блоб лежит рядом в ``<блоб>.refs``; чтение и изменение
+счётчика идут под блокировкой ``fcntl.flock`` на этом файле, поэтому
+параллельные загрузки из разных процессов не теряют ссылки. ``delete()``
+уменьшает счётчик и удаляет блоб, когда ссылок не осталось.
+
+Старые файлы вне ``blobs/`` продолжают открываться и удаляться как обычно.
+Ссылки, которые держат FileField моделей, освобождает ``mysite.file_refs``.
+"""
+
+import hashlib
+import os
+import posixpath
+import tempfile
+from contextlib import suppress
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+
+try:
+    import fcntl
+except ImportError:  # Windows: без межпроцессной блокировки
+    fcntl = None
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    blobs_dir = "blobs"
+
+    def get_available_name(self, name, max_length=None):
+        # Итоговое имя определяется содержимым в _save(), поэтому
+        # перебирать свободные имена (stat() на каждый вариант) не нужно.
+        return name
+
+    def blob_name(self, digest: str, name: str) -> str:
+        ext = os.path.splitext(name)[1].lower()
+        return posixpath.join(self.blobs_dir, digest[:2], digest[2:4], digest + ext)
+
+    def is_blob(self, name: str) -> bool:
+        return name.replace("\\", "/").startswith(self.blobs_dir + "/")
+
+    def _save(self, name, content):
+        if hasattr(content, "temporary_file_path"):
+            # большой файл уже лежит на диске (TemporaryUploadedFile); хэш мог
+            # посчитать обработчик загрузки (requestdataapp.uploads)
+            tmp_path = content.temporary_file_path()
+            digest = getattr(content, "content_sha256", None) or self._hash_file(tmp_path)
+            owned = False
+        else:
+            tmp_path, digest = self._write_temporary(content)
+            owned = True
+
+        blob = self.blob_name(digest, name)
+        path = self.path(blob)
+        self._makedirs(os.path.dirname(path))
+
+        def place(count: int) -> int:
+            if count and os.path.exists(path):
+                if owned:
+                    os.remove(tmp_path)
+                return count + 1
+            if owned:
+                os.replace(tmp_path, path)
+            else:
+                file_move_safe(tmp_path, path, allow_overwrite=True)
+            if self.file_permissions_mode is not None:
+                os.chmod(path, self.file_permissions_mode)
+            return 1
+
+        try:
+            self._update_refs(path, place)
+        except BaseException:
+            if owned:
+                with suppress(FileNotFoundError):
+                    os.remove(tmp_path)
+            raise
+        return blob
+
+    def delete(self, name):
+        if not name or not self.is_blob(name):
+            return super().delete(name)
+
+        path = self.path(name)
+
+        def release(count: int) -> int:
+            if count <= 1:
+                with suppress(FileNotFoundError):
+                    os.remove(path)
+                return 0
+            return count - 1
+
+        # файл .refs с нулём остаётся: его могут ждать другие процессы под flock;
+        # каталога блоба может уже не быть — тогда и освобождать нечего
+        with suppress(FileNotFoundError):
+            self._update_refs(path, release)
+
+    def refs(self, name: str) -> int:
+        with suppress(FileNotFoundError), open(self.path(name) + ".refs") as file:
+            return int(file.read().strip() or 0)
+        return 0
+
+    def _update_refs(self, path: str, update) -> int:
+        with open(path + ".refs", "a+") as file:
+            if fcntl is not None:
+                fcntl.flock(file, fcntl.LOCK_EX)
+            file.seek(0)
+            count = int(file.read().strip() or 0)
+            count = update(count)
+            file.seek(0)
+            file.truncate()
+            file.write(str(count))
+            file.flush()
+        return count
+
+    def temporary_dir(self) -> str:
+        """
+        Каталог для недописанных файлов (``<MEDIA_ROOT>.tmp``): рядом с
+        MEDIA_ROOT, чтобы перенос в блобы был rename(), но не внутри него —
+        MEDIA_ROOT раздаётся по MEDIA_URL.
+        """
+        location = os.path.normpath(self.location)
+        return location + ".tmp"
+
+    def _write_temporary(self, content) -> tuple:
+        tmp_dir = self.temporary_dir()
+        self._makedirs(tmp_dir)
+        hasher = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as tmp:
+            try:
+                for chunk in content.chunks():
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    hasher.update(chunk)
+                    tmp.write(chunk)
+            except BaseException:
+                tmp.close()
+                os.remove(tmp.name)
+                raise
+        return tmp.name, hasher.hexdigest()
+
+    @staticmethod
+    def _hash_file(path: str) -> str:
+        hasher = hashlib.sha256()
+        with open(path, "rb") as file:
+            while chunk := file.read(HASH_CHUNK_SIZE):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    def _makedirs(self, directory: str) -> None:
+        if self.directory_permissions_mode is not None:
+            old_umask = os.umask(0o777 & ~self.directory_permissions_mode)
+            try:
+                os.makedirs(directory, self.directory_permissions_mode, exist_ok=True)
+            finally:
+                os.umask(old_umask)
+        else:
+            os.makedirs(directory, exist_ok=True)
@@ -0,0 +1,189 @@
+"""
+Метрики запросов в формате Prometheus.
+
+Каждый поток пишет в свой шард (``threading.local``), поэтому на горячем
+пути нет блокировок — только увеличение счётчиков в словарях. При чтении
+шарды всех потоков процесса складываются.
+
+Для нескольких процессов (gunicorn) задайте ``METRICS_DIR``: каждый процесс
+раз в ``METRICS_FLUSH_INTERVAL`` секунд сохраняет свой снимок в
+``<METRICS_DIR>/metrics-<pid>.json``, а ``/req/metrics/`` суммирует снимки
+всех процессов.
+"""
+
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Shard:
+    def __init__(self):
+        self.requests = defaultdict(int)
+        self.exceptions = defaultdict(int)
+        self.db_queries = defaultdict(int)
+        self.db_seconds = defaultdict(float)
+        self.latency = {}
+
+    def observe_latency(self, view: str, seconds: float) -> None:
+        histogram = self.latency.get(view)
+        if histogram is None:
+            # счётчики корзин, затем +Inf, сумма
+            histogram = self.latency[view] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+        histogram[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        histogram[-1] += seconds
+
+    def snapshot(self) -> dict:
+        return {
+            "requests": {json.dumps(key): value for key, value in self.requests.copy().items()},
+            "exceptions": {json.dumps(key): value for key, value in self.exceptions.copy().items()},
+            "db_queries": self.db_queries.copy(),
+            "db_seconds": self.db_seconds.copy(),
+            "latency": {view: list(histogram) for view, histogram in self.latency.copy().items()},
+        }
+
+
+class Registry:
+    def __init__(self):
+        self.local = threading.local()
+        self.shards = []
+        self.shards_lock = threading.Lock()
+        self.last_flush = 0.0
+
+    @property
+    def shard(self) -> Shard:
+        shard = getattr(self.local, "shard", None)
+        if shard is None:
+            shard = self.local.shard = Shard()
+            with self.shards_lock:
+                self.shards.append(shard)
+        return shard
+
+    def snapshot(self) -> dict:
+        with self.shards_lock:
+            shards = list(self.shards)
+        return merge_snapshots(shard.snapshot() for shard in shards)
+
+    def flush(self, now: float) -> None:
+        directory = getattr(settings, "METRICS_DIR", None)
+        if not directory or now - self.last_flush < getattr(settings, "METRICS_FLUSH_INTERVAL", 5):
+            return
+        self.last_flush = now
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"metrics-{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.snapshot(), file)
+        os.replace(tmp_path, path)
+
+    def collect(self) -> dict:
+        """Снимок всех процессов (или только текущего, если METRICS_DIR не задан)."""
+        own = self.snapshot()
+        directory = getattr(settings, "METRICS_DIR", None)
+        if not directory or not os.path.isdir(directory):
+            return own
+
+        own_file = f"metrics-{os.getpid()}.json"
+        snapshots = [own]
+        for name in os.listdir(directory):
+            if name.startswith("metrics-") and name.endswith(".json") and name != own_file:
+                try:
+                    with open(os.path.join(directory, name)) as file:
+                        snapshots.append(json.load(file))
+                except (OSError, ValueError):
+                    continue
+        return merge_snapshots(snapshots)
+
+
+def merge_snapshots(snapshots) -> dict:
+    merged = {
+        "requests": defaultdict(int),
+        "exceptions": defaultdict(int),
+        "db_queries": defaultdict(int),
+        "db_seconds": defaultdict(float),
+        "latency": {},
+    }
+    for snapshot in snapshots:
+        for name in ("requests", "exceptions", "db_queries", "db_seconds"):
+            for key, value in snapshot[name].items():
+                merged[name][key] += value
+        for view, histogram in snapshot["latency"].items():
+            total = merged["latency"].setdefault(view, [0] * len(histogram))
+            for index, value in enumerate(histogram):
+                total[index] += value
+    return merged
+
+
+def _labels(**labels) -> str:
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def render_prometheus(snapshot: dict) -> str:
+    lines = [
+        "# HELP django_http_requests_total Requests by view, method and status.",
+        "# TYPE django_http_requests_total counter",
+    ]
+    for key, value in sorted(snapshot["requests"].items()):
+        view, method, status = json.loads(key)
+        lines.append(f"django_http_requests_total{_labels(view=view, method=method, status=status)} {value}")
+
+    lines += [
+        "# HELP django_http_request_duration_seconds Request latency by view.",
+        "# TYPE django_http_request_duration_seconds histogram",
+    ]
+    for view, histogram in sorted(snapshot["latency"].items()):
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), histogram):
+            cumulative += count
+            lines.append(f"django_http_request_duration_seconds_bucket{_labels(view=view, le=bound)} {cumulative}")
+        lines.append(f"django_http_request_duration_seconds_sum{_labels(view=view)} {histogram[-1]}")
+        lines.append(f"django_http_request_duration_seconds_count{_labels(view=view)} {cumulative}")
+
+    lines += [
+        "# HELP django_db_queries_total Database queries by view.",
+        "# TYPE django_db_queries_total counter",
+    ]
+    for view, value in sorted(snapshot["db_queries"].items()):
+        lines.append(f"django_db_queries_total{_labels(view=view)} {value}")
+
+    lines += [
+        "# HELP django_db_query_duration_seconds_total Time spent in database queries by view.",
+        "# TYPE django_db_query_duration_seconds_total counter",
+    ]
+    for view, value in sorted(snapshot["db_seconds"].items()):
+        lines.append(f"django_db_query_duration_seconds_total{_labels(view=view)} {value}")
+
+    lines += [
+        "# HELP django_http_exceptions_total Unhandled exceptions by view and type.",
+        "# TYPE django_http_exceptions_total counter",
+    ]
+    for key, value in sorted(snapshot["exceptions"].items()):
+        view, exception = json.loads(key)
+        lines.append(f"django_http_exceptions_total{_labels(view=view, exception=exception)} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+class QueryTimer:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+registry = Registry()
@@ -1,62 +1,92 @@
+import logging
+import math
 import time
-from django.http import HttpRequest, HttpResponseForbidden
 
+from django.conf import settings
+from django.db import connection
+from django.http import HttpRequest, HttpResponse
 
-def set_useragent_on_request_middleware(get_response):
-    print("initial call")
+from requestdataapp.metrics import registry, QueryTimer
+from requestdataapp.ratelimit import RateLimiter
+from requestdataapp.querybudget import QueryRecorder, QueryBudgetExceeded, get_view_budget
+
+log = logging.getLogger(__name__)
 
+
+def set_useragent_on_request_middleware(get_response):
     def middleware(request: HttpRequest):
-        print("before get response")
         user_agent = request.META.get('HTTP_USER_AGENT')
         request.user_agent = user_agent if user_agent else None
-        response = get_response(request)
-        print("after get response")
-        return response
+        return get_response(request)
 
     return middleware
 
 
-class CountRequestMiddleware:
+class MetricsMiddleware:
+    """
+    Собирает метрики запросов (см. ``requestdataapp.metrics``): число ответов
+    и гистограмму времени по имени URL, число и время SQL-запросов, исключения.
+    """
+
     def __init__(self, get_response):
         self.get_response = get_response
-        self.requests_count = 0
-        self.responses_count = 0
-        self.exceptions_count = 0
 
     def __call__(self, request: HttpRequest):
-        self.requests_count += 1
-        print("requests count", self.requests_count)
-        response = self.get_response(request)
-        self.responses_count += 1
-        print("responses count", self.responses_count)
+        timer = QueryTimer()
+        start = time.perf_counter()
+        with connection.execute_wrapper(timer):
+            response = self.get_response(request)
+        now = time.perf_counter()
+
+        view = self._get_view_name(request)
+        shard = registry.shard
+        shard.requests[(view, request.method, response.status_code)] += 1
+        shard.observe_latency(view, now - start)
+        shard.db_queries[view] += timer.count
+        shard.db_seconds[view] += timer.seconds
+        registry.flush(time.time())
         return response
 
     def process_exception(self, request: HttpRequest, exception: Exception):
-        self.exceptions_count += 1
-        print("got", self.exceptions_count, "exceptions so far")
+        registry.shard.exceptions[(self._get_view_name(request), type(exception).__name__)] += 1
+
+    @staticmethod
+    def _get_view_name(request: HttpRequest) -> str:
+        match = request.resolver_match
+        return match.view_name if match else "<unresolved>"
 
 
 class ThrottlingMiddleware:
-    def __init__(self, get_response, requests_per_second=500):
+    """
+    Ограничение частоты запросов (token bucket, см. ``requestdataapp.ratelimit``).
+
+    Проверка выполняется в ``process_view``, когда уже известны имя URL
+    и пользователь, поэтому лимиты задаются по маршрутам и отдельно для
+    авторизованных пользователей. При превышении отдаёт 429 с ``Retry-After``.
+    """
+
+    def __init__(self, get_response):
         self.get_response = get_response
-        self.requests_per_second = requests_per_second
-        self.request_history = {}
+        self.limiter = RateLimiter.from_settings()
 
     def __call__(self, request):
-        ip = self._get_client_ip(request)
-        current_time = time.time()
+        return self.get_response(request)
 
-        if ip in self.request_history:
-            last_request_time = self.request_history[ip]
-            elapsed_time = current_time - last_request_time
-            time_per_request = 1 / self.requests_per_second
+    def process_view(self, request: HttpRequest, view_func, view_args, view_kwargs):
+        user = getattr(request, "user", None)
+        if user is not None and user.is_authenticated:
+            client, authenticated = f"user:{user.pk}", True
+        else:
+            client, authenticated = f"ip:{self._get_client_ip(request)}", False
 
-            if elapsed_time < time_per_request:
-                error_message = 'Too many requests. Please try again later.'
-                return HttpResponseForbidden(error_message)
+        view_name = request.resolver_match.view_name if request.resolver_match else ""
+        allowed, retry_after = self.limiter.check(view_name, client, authenticated)
+        if allowed:
+            return None
 
-        self.request_history[ip] = current_time
-        return self.get_response(request)
+        response = HttpResponse('Too many requests. Please try again later.', status=429)
+        response["Retry-After"] = str(max(1, math.ceil(retry_after)))
+        return response
 
     def _get_client_ip(self, request):
         x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
@@ -65,3 +95,46 @@ class ThrottlingMiddleware:
         else:
             ip = request.META.get('REMOTE_ADDR')
         return ip
+
+
+class QueryBudgetMiddleware:
+    """
+    Считает SQL-запросы каждого запроса и сравнивает их с бюджетом
+    представления (``query_budget``), а также ищет повторяющиеся запросы (N+1).
+
+    Включается настройкой ``QUERY_BUDGET_ENABLED`` (по умолчанию при DEBUG).
+    При DEBUG добавляет заголовки ``X-Query-Count``, ``X-Query-Budget`` и
+    ``X-Query-N-Plus-One``; при ``QUERY_BUDGET_RAISE`` превышение бюджета
+    или N+1 приводят к ``QueryBudgetExceeded``, иначе пишутся в лог.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, "QUERY_BUDGET_ENABLED", settings.DEBUG)
+        self.raise_errors = getattr(settings, "QUERY_BUDGET_RAISE", False)
+
+    def __call__(self, request: HttpRequest):
+        if not self.enabled:
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+
+        budget = getattr(request, "query_budget", None)
+        over_budget = budget is not None and recorder.count > budget
+        if over_budget or recorder.n_plus_one:
+            message = f"{request.method} {request.path}: budget {budget}, {recorder.report()}"
+            if self.raise_errors:
+                raise QueryBudgetExceeded(message)
+            log.warning(message)
+
+        if settings.DEBUG:
+            response["X-Query-Count"] = str(recorder.count)
+            if budget is not None:
+                response["X-Query-Budget"] = str(budget)
+            response["X-Query-N-Plus-One"] = str(len(recorder.n_plus_one))
+        return response
+
+    def process_view(self, request: HttpRequest, view_func, view_args, view_kwargs):
+        request.query_budget = get_view_budget(view_func, request.method)
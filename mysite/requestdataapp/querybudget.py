@@ -0,0 +1,183 @@
+"""
+Учёт SQL-запросов на запрос к сайту.
+
+``QueryRecorder`` подключается через ``connection.execute_wrapper`` и
+считает запросы, группируя их по "форме" (SQL без значений параметров).
+Если одна и та же форма повторилась ``threshold`` раз, это похоже на N+1:
+для такой формы запоминается место в шаблоне или в коде проекта,
+откуда ушёл запрос.
+
+Бюджет запросов объявляется у представления атрибутом ``query_budget``
+(для классов) или декоратором ``@query_budget(n)`` (для функций,
+действий ViewSet и отдельных методов класса).
+Проверяет его ``requestdataapp.middlewares.QueryBudgetMiddleware``,
+а в тестах ``QueryBudgetTestMixin``.
+"""
+
+import os
+import re
+import sys
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.urls import resolve
+
+N_PLUS_ONE_THRESHOLD = 3
+
+_IN_LIST_RE = re.compile(r"\bIN \((?:%s|\?|[-\w.']+)(?:, (?:%s|\?|[-\w.']+))*\)", re.IGNORECASE)
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"(?<![\w\"])-?\d+(?:\.\d+)?\b")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_budget(budget: int):
+    """Объявляет бюджет запросов для функции-представления или действия ViewSet."""
+    def decorator(view_func):
+        view_func.query_budget = budget
+        return view_func
+    return decorator
+
+
+def get_view_budget(view_func, method: str = None):
+    # у действий ViewSet (@action) и методов классов (get, post) может быть свой бюджет
+    if method:
+        actions = getattr(view_func, "actions", None)
+        if actions:
+            handler = getattr(getattr(view_func, "cls", None), actions.get(method.lower(), ""), None)
+        else:
+            handler = getattr(getattr(view_func, "view_class", None), method.lower(), None)
+        budget = getattr(handler, "query_budget", None)
+        if budget is not None:
+            return budget
+
+    for view in (
+        view_func,
+        getattr(view_func, "view_class", None),
+        getattr(view_func, "cls", None),
+    ):
+        budget = getattr(view, "query_budget", None)
+        if budget is not None:
+            return budget
+    return None
+
+
+def normalize_sql(sql: str) -> str:
+    sql = _IN_LIST_RE.sub("IN (...)", sql)
+    sql = _STRING_RE.sub("?", sql)
+    sql = _NUMBER_RE.sub("?", sql)
+    return _WHITESPACE_RE.sub(" ", sql).strip()
+
+
+# аргументы обёрток connection.execute_wrapper
+EXECUTE_WRAPPER_ARGS = ("execute", "sql", "params", "many", "context")
+
+
+def is_execute_wrapper(code) -> bool:
+    return code.co_varnames[code.co_argcount - len(EXECUTE_WRAPPER_ARGS):code.co_argcount] == EXECUTE_WRAPPER_ARGS
+
+
+def find_query_origin() -> str:
+    """
+    Ищет по стеку строку шаблона (узел, который рендерился) и ближайший
+    кадр кода проекта (не Django, не сторонние пакеты и не обёртки
+    ``execute_wrapper``, например ``metrics.QueryTimer``).
+    """
+    template_line = None
+    code_line = None
+    base_dir = str(settings.BASE_DIR)
+    ignored_files = {
+        os.path.abspath(__file__),
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "middlewares.py"),
+    }
+
+    frame = sys._getframe(1)
+    while frame is not None and (template_line is None or code_line is None):
+        code = frame.f_code
+        if template_line is None and code.co_name == "render_annotated":
+            node = frame.f_locals.get("self")
+            origin = getattr(node, "origin", None)
+            token = getattr(node, "token", None)
+            if origin is not None and token is not None:
+                template_line = f"{origin.template_name}:{token.lineno}"
+        elif (
+            code_line is None
+            and code.co_filename.startswith(base_dir)
+            and "site-packages" not in code.co_filename
+            and os.path.abspath(code.co_filename) not in ignored_files
+            and not is_execute_wrapper(code)
+        ):
+            filename = os.path.relpath(code.co_filename, base_dir)
+            code_line = f"{filename}:{frame.f_lineno} in {code.co_name}"
+        frame = frame.f_back
+
+    return " <- ".join(line for line in (template_line, code_line) if line) or "unknown"
+
+
+class QueryRecorder:
+    def __init__(self, threshold: int = N_PLUS_ONE_THRESHOLD):
+        self.threshold = threshold
+        self.count = 0
+        self.shapes = Counter()
+        self.origins = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        shape = normalize_sql(sql)
+        self.count += 1
+        self.shapes[shape] += 1
+        if self.shapes[shape] == self.threshold:
+            self.origins[shape] = find_query_origin()
+        return execute(sql, params, many, context)
+
+    @property
+    def n_plus_one(self) -> list:
+        return [
+            (shape, count, self.origins.get(shape, "unknown"))
+            for shape, count in self.shapes.most_common()
+            if count >= self.threshold
+        ]
+
+    def report(self) -> str:
+        lines = [f"{self.count} queries"]
+        for shape, count, origin in self.n_plus_one:
+            lines.append(f"  N+1 ({count}x) at {origin}: {shape}")
+        return "\n".join(lines)
+
+
+@contextmanager
+def record_queries(threshold: int = N_PLUS_ONE_THRESHOLD):
+    recorder = QueryRecorder(threshold)
+    with connection.execute_wrapper(recorder):
+        yield recorder
+
+
+class QueryBudgetTestMixin:
+    """Проверки числа запросов для TestCase."""
+
+    def assertQueryBudget(self, budget: int, threshold: int = N_PLUS_ONE_THRESHOLD):
+        return self._assert_queries(budget, threshold)
+
+    def assertNoNPlusOne(self, threshold: int = N_PLUS_ONE_THRESHOLD):
+        return self._assert_queries(None, threshold)
+
+    @contextmanager
+    def _assert_queries(self, budget, threshold):
+        with record_queries(threshold) as recorder:
+            yield recorder
+        if budget is not None and recorder.count > budget:
+            raise QueryBudgetExceeded(f"Query budget {budget} exceeded: {recorder.report()}")
+        if recorder.n_plus_one:
+            raise QueryBudgetExceeded(f"N+1 queries detected: {recorder.report()}")
+
+    def assertWithinDeclaredBudget(self, url: str, method: str = "GET", **kwargs):
+        """Запрос к url (по умолчанию GET) с проверкой бюджета, объявленного у представления."""
+        budget = get_view_budget(resolve(url.split("?")[0]).func, method)
+        self.assertIsNotNone(budget, f"No query budget declared for {method} {url}")
+        with self.assertQueryBudget(budget):
+            response = getattr(self.client, method.lower())(url, **kwargs)
+        return response
@@ -0,0 +1,196 @@
+"""
+Ограничение частоты запросов по алгоритму token bucket.
+
+У каждого клиента (пользователь или IP) есть "ведро" на ``N`` токенов,
+которое пополняется со скоростью ``N`` токенов за период. Запрос забирает
+один токен, пустое ведро означает 429. Состояние ведра — два числа
+(токены и время обновления), хранилище выбирается настройкой:
+
+* ``LocMemStorage`` — в памяти процесса, LRU с ограничением размера и TTL;
+* ``CacheStorage`` — через кэш Django (общий для воркеров, если общий кэш);
+* ``SQLiteStorage`` — файл SQLite, общий для всех воркеров на одной машине.
+
+Настройки в ``settings.RATE_LIMIT``::
+
+    RATE_LIMIT = {
+        "STORAGE": "requestdataapp.ratelimit.LocMemStorage",
+        "STORAGE_OPTIONS": {"max_entries": 10000, "ttl": 3600},
+        "ANON_RATE": "500/s",
+        "USER_RATE": "500/s",
+        "ROUTES": {
+            "requestdataapp:file-upload": "10/m",
+            "shopapp:product-*": {"anon": "20/s", "user": "50/s"},
+        },
+    }
+
+Ключи ``ROUTES`` — шаблоны (fnmatch) имён URL, срабатывает первый подходящий.
+"""
+
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+RATE_RE = re.compile(r"^\s*(\d+)\s*/\s*(\d*)\s*([smhd])\w*\s*$")
+
+
+def parse_rate(rate: str) -> tuple:
+    """``"100/m"`` -> (ёмкость 100, пополнение 100/60 токенов в секунду)."""
+    match = RATE_RE.match(rate)
+    if not match:
+        raise ValueError(f"Invalid rate {rate!r}, expected e.g. '10/s' or '100/5m'")
+    count, multiplier, unit = match.groups()
+    seconds = PERIODS[unit] * int(multiplier or 1)
+    return int(count), int(count) / seconds
+
+
+def take_token(state, now: float, capacity: int, refill_rate: float) -> tuple:
+    """Возвращает (новое состояние, разрешён ли запрос, через сколько секунд повторить)."""
+    if state is None:
+        tokens = float(capacity)
+    else:
+        tokens, updated_at = state
+        tokens = min(float(capacity), tokens + (now - updated_at) * refill_rate)
+
+    if tokens >= 1:
+        return (tokens - 1, now), True, 0.0
+    return (tokens, now), False, (1 - tokens) / refill_rate
+
+
+class LocMemStorage:
+    def __init__(self, max_entries: int = 10000, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def consume(self, key: str, capacity: int, refill_rate: float, now: float) -> tuple:
+        with self.lock:
+            state, allowed, retry_after = take_token(self.buckets.pop(key, None), now, capacity, refill_rate)
+            self.buckets[key] = state
+            self._evict(now)
+        return allowed, retry_after
+
+    def _evict(self, now: float) -> None:
+        # Ключи упорядочены по времени последнего обращения,
+        # поэтому устаревшие и лишние всегда в начале.
+        while len(self.buckets) > self.max_entries:
+            self.buckets.popitem(last=False)
+        while self.buckets:
+            key, (_, updated_at) = next(iter(self.buckets.items()))
+            if now - updated_at <= self.ttl:
+                break
+            del self.buckets[key]
+
+
+class CacheStorage:
+    """
+    Состояние в кэше Django. Чтение и запись не атомарны, поэтому при гонке
+    воркеров лимит может быть немного превышен.
+    """
+
+    def __init__(self, alias: str = "default", ttl: float = 3600, prefix: str = "ratelimit"):
+        self.cache = caches[alias]
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def consume(self, key: str, capacity: int, refill_rate: float, now: float) -> tuple:
+        cache_key = f"{self.prefix}:{key}"
+        state, allowed, retry_after = take_token(self.cache.get(cache_key), now, capacity, refill_rate)
+        self.cache.set(cache_key, state, self.ttl)
+        return allowed, retry_after
+
+
+class SQLiteStorage:
+    """
+    Состояние в файле SQLite. ``BEGIN IMMEDIATE`` сериализует обновления
+    между процессами, поэтому лимит общий для всех воркеров на машине.
+    """
+
+    purge_every = 1000
+
+    def __init__(self, path: str = None, ttl: float = 3600):
+        self.path = str(path or settings.BASE_DIR / "ratelimit.sqlite3")
+        self.ttl = ttl
+        self.local = threading.local()
+        self.calls = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self.local.conn = conn
+        return conn
+
+    def consume(self, key: str, capacity: int, refill_rate: float, now: float) -> tuple:
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+            state, allowed, retry_after = take_token(row, now, capacity, refill_rate)
+            conn.execute(
+                "INSERT INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+                (key, *state),
+            )
+            self.calls += 1
+            if self.calls % self.purge_every == 0:
+                conn.execute("DELETE FROM buckets WHERE updated_at < ?", (now - self.ttl,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed, retry_after
+
+
+class RateLimiter:
+    def __init__(self, storage, anon_rate: str, user_rate: str, routes: dict = None):
+        self.storage = storage
+        self.default = {"anon": parse_rate(anon_rate), "user": parse_rate(user_rate)}
+        self.routes = []
+        for pattern, rates in (routes or {}).items():
+            if isinstance(rates, str):
+                rates = {"anon": rates, "user": rates}
+            self.routes.append((pattern, {kind: parse_rate(rate) for kind, rate in rates.items()}))
+
+    @classmethod
+    def from_settings(cls) -> "RateLimiter":
+        config = getattr(settings, "RATE_LIMIT", {})
+        storage_class = import_string(config.get("STORAGE", "requestdataapp.ratelimit.LocMemStorage"))
+        return cls(
+            storage=storage_class(**config.get("STORAGE_OPTIONS", {})),
+            anon_rate=config.get("ANON_RATE", "500/s"),
+            user_rate=config.get("USER_RATE", config.get("ANON_RATE", "500/s")),
+            routes=config.get("ROUTES"),
+        )
+
+    def get_rule(self, view_name: str) -> tuple:
+        if view_name:
+            for pattern, rates in self.routes:
+                if fnmatchcase(view_name, pattern):
+                    return pattern, rates
+        return "*", self.default
+
+    def check(self, view_name: str, client: str, authenticated: bool, now: float = None) -> tuple:
+        pattern, rates = self.get_rule(view_name)
+        kind = "user" if authenticated else "anon"
+        capacity, refill_rate = rates.get(kind) or self.default[kind]
+        return self.storage.consume(
+            f"{pattern}|{client}",
+            capacity,
+            refill_rate,
+            time.time() if now is None else now,
+        )
@@ -1,3 +1,234 @@
-from django.test import TestCase
+import json
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.urls import resolve, reverse
+from django.utils import translation
+
+from accounts.views import UserDetailView
+from requestdataapp.metrics import QueryTimer, Shard, registry, render_prometheus
+from requestdataapp.ratelimit import parse_rate, LocMemStorage, SQLiteStorage
+from requestdataapp.uploads import sniff_content_type
+from requestdataapp.views import MAX_UPLOAD_SIZE
+from requestdataapp.querybudget import (
+    get_view_budget,
+    normalize_sql,
+    record_queries,
+    QueryBudgetExceeded,
+    QueryBudgetTestMixin,
+)
+
+
+class NormalizeSQLTestCase(TestCase):
+    def test_collapses_values(self):
+        self.assertEqual(
+            normalize_sql('SELECT "a"."id" FROM "a" WHERE "a"."id" IN (%s, %s, %s) AND "a"."n" = \'x\' LIMIT 21'),
+            'SELECT "a"."id" FROM "a" WHERE "a"."id" IN (...) AND "a"."n" = ? LIMIT ?',
+        )
+
+
+class QueryRecorderTestCase(QueryBudgetTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create(username=f"user{index}") for index in range(4)]
+
+    def test_detects_n_plus_one_with_origin(self):
+        with record_queries() as recorder:
+            for user in self.users:
+                User.objects.get(pk=user.pk)
+        self.assertEqual(recorder.count, 4)
+        [(shape, count, origin)] = recorder.n_plus_one
+        self.assertEqual(count, 4)
+        self.assertIn("requestdataapp/tests.py", origin)
+
+    def test_origin_skips_other_execute_wrappers(self):
+        # MetricsMiddleware оборачивает запросы снаружи QueryBudgetMiddleware
+        with connection.execute_wrapper(QueryTimer()), record_queries() as recorder:
+            for user in self.users:
+                User.objects.get(pk=user.pk)
+        [(shape, count, origin)] = recorder.n_plus_one
+        self.assertIn("requestdataapp/tests.py", origin)
+        self.assertNotIn("metrics.py", origin)
+
+    def test_assert_query_budget(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            with self.assertQueryBudget(1):
+                list(User.objects.all())
+                list(User.objects.all())
+
+        with self.assertQueryBudget(1):
+            list(User.objects.all())
+
+
+@override_settings(DEBUG=True, QUERY_BUDGET_ENABLED=True)
+class QueryBudgetMiddlewareTestCase(TestCase):
+    def setUp(self):
+        translation.activate("en")
+
+    def test_debug_headers(self):
+        response = self.client.get(reverse("shopapp:products_list"))
+        self.assertEqual(response["X-Query-Budget"], "3")
+        self.assertEqual(response["X-Query-Count"], "1")
+        self.assertEqual(response["X-Query-N-Plus-One"], "0")
+
+    def test_method_budget_overrides_class_budget(self):
+        view = resolve(reverse("shopapp:order_update", kwargs={"pk": 1})).func
+        self.assertEqual(get_view_budget(view, "GET"), 10)
+        self.assertEqual(get_view_budget(view, "POST"), 20)
+
+    @override_settings(QUERY_BUDGET_RAISE=True)
+    def test_raises_over_budget(self):
+        user = User.objects.create_user(username="budget", password="qwerty")
+        self.client.force_login(user)
+        with mock.patch.object(UserDetailView, "query_budget", 1), self.assertRaises(QueryBudgetExceeded):
+            self.client.get(reverse("accounts:user_detail", kwargs={"pk": user.pk}))
+
+
+class TokenBucketTestCase(TestCase):
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate("10/s"), (10, 10.0))
+        self.assertEqual(parse_rate("120/2m"), (120, 1.0))
+        with self.assertRaises(ValueError):
+            parse_rate("ten per second")
+
+    def check_bucket(self, storage):
+        capacity, refill_rate = parse_rate("2/s")
+        self.assertEqual(storage.consume("k", capacity, refill_rate, 100.0), (True, 0.0))
+        self.assertEqual(storage.consume("k", capacity, refill_rate, 100.0), (True, 0.0))
+        allowed, retry_after = storage.consume("k", capacity, refill_rate, 100.0)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(retry_after, 0.5)
+        self.assertTrue(storage.consume("k", capacity, refill_rate, 100.5)[0])
+
+    def test_locmem_storage(self):
+        self.check_bucket(LocMemStorage())
+
+    def test_locmem_storage_is_bounded(self):
+        storage = LocMemStorage(max_entries=2, ttl=10)
+        for index in range(5):
+            storage.consume(f"client{index}", 1, 1.0, 100.0)
+        self.assertEqual(list(storage.buckets), ["client3", "client4"])
+        storage.consume("client5", 1, 1.0, 120.0)
+        self.assertEqual(list(storage.buckets), ["client5"])
+
+    def test_sqlite_storage(self):
+        with TemporaryDirectory() as directory:
+            self.check_bucket(SQLiteStorage(path=Path(directory) / "ratelimit.sqlite3"))
+
+
+@override_settings(RATE_LIMIT={
+    "ANON_RATE": "100/s",
+    "ROUTES": {"requestdataapp:get-view": "1/m"},
+})
+class ThrottlingMiddlewareTestCase(TestCase):
+    def test_route_limit_returns_429(self):
+        url = reverse("requestdataapp:get-view")
+        self.assertEqual(self.client.get(url).status_code, 200)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "60")
+        self.assertEqual(self.client.get(reverse("requestdataapp:user-form")).status_code, 200)
+
+
+class MetricsTestCase(TestCase):
+    def test_request_metrics_exposed(self):
+        self.client.get(reverse("requestdataapp:get-view"))
+        response = self.client.get(reverse("requestdataapp:metrics"))
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        self.assertIn(
+            'django_http_request_duration_seconds_bucket{view="requestdataapp:get-view",le="+Inf"}',
+            content,
+        )
+        self.assertRegex(
+            content,
+            r'django_http_requests_total\{view="requestdataapp:get-view",method="GET",status="200"\} \d+',
+        )
+
+    def test_forbidden_outside_internal_ips(self):
+        response = self.client.get(reverse("requestdataapp:metrics"), REMOTE_ADDR="10.0.0.1")
+        self.assertEqual(response.status_code, 403)
+
+    def test_merges_worker_snapshots(self):
+        with TemporaryDirectory() as directory:
+            other = Shard()
+            other.requests[("shopapp:index", "GET", 200)] += 7
+            other.observe_latency("shopapp:index", 0.02)
+            with open(Path(directory) / "metrics-999999.json", "w") as file:
+                json.dump(other.snapshot(), file)
+
+            with self.settings(METRICS_DIR=directory):
+                content = render_prometheus(registry.collect())
+        self.assertIn('django_http_requests_total{view="shopapp:index",method="GET",status="200"} 7', content)
+        self.assertIn('django_http_request_duration_seconds_bucket{view="shopapp:index",le="0.025"} 1', content)
+
+
+@override_settings(RATE_LIMIT={"ANON_RATE": "1000/s"})
+class StreamingUploadTestCase(TestCase):
+    PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 100
+
+    def setUp(self):
+        translation.activate("en")
+        self.media_root = TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        media_override = override_settings(MEDIA_ROOT=self.media_root.name)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+        self.url = reverse("requestdataapp:file-upload")
+
+    def upload(self, name: str, content: bytes, client=None):
+        return (client or self.client).post(self.url, {"file": SimpleUploadedFile(name, content)})
+
+    def stored_files(self) -> list:
+        return [
+            path.name for path in Path(self.media_root.name).rglob("*")
+            if path.is_file() and path.suffix != ".refs"
+        ]
+
+    def test_valid_file_is_stored_without_temporary_leftovers(self):
+        response = self.upload("photo.png", self.PNG)
+        self.assertEqual(response.status_code, 200)
+        stored = self.stored_files()
+        self.assertEqual(len(stored), 1)
+        self.assertTrue(stored[0].endswith(".png"))
+
+    def test_oversized_upload_is_rejected(self):
+        # тело чуть больше лимита: обрывается при получении кусков
+        response = self.upload("big.png", self.PNG + b"\x00" * MAX_UPLOAD_SIZE)
+        self.assertEqual(response.status_code, 413)
+        # тело намного больше лимита: отклоняется по Content-Length
+        response = self.upload("huge.png", self.PNG + b"\x00" * MAX_UPLOAD_SIZE * 2)
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(self.stored_files(), [])
+
+    def test_name_and_content_are_validated(self):
+        response = self.upload("virus.png", self.PNG)
+        self.assertContains(response, "virus", status_code=400)
+        self.assertEqual(self.stored_files(), [])
+
+        # без UPLOAD_ALLOWED_TYPES принимаются файлы любого типа
+        response = self.upload("notes.txt", b"plain text")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.stored_files()), 1)
+
+    @override_settings(UPLOAD_ALLOWED_TYPES=("image/png", "application/pdf"))
+    def test_allowed_types_setting(self):
+        response = self.upload("photo.png", b"plain text pretending to be an image")
+        self.assertContains(response, "File type is not allowed.", status_code=400)
+        self.assertEqual(self.stored_files(), [])
+        response = self.upload("photo.png", self.PNG)
+        self.assertEqual(response.status_code, 200)
+
+    def test_csrf_is_still_checked(self):
+        response = self.upload("photo.png", self.PNG, client=Client(enforce_csrf_checks=True))
+        self.assertEqual(response.status_code, 403)
+
+    def test_sniff_content_type(self):
+        self.assertEqual(sniff_content_type(b"\xff\xd8\xff\xe0" + b"\x00" * 8), "image/jpeg")
+        self.assertEqual(sniff_content_type(b"RIFF\x00\x00\x00\x00WEBPVP8 "), "image/webp")
+        self.assertIsNone(sniff_content_type(b"hello world!"))
@@ -0,0 +1,172 @@
+"""
+Потоковый приём файлов с проверками на лету.
+
+``StreamingUploadHandler`` заменяет стандартные обработчики Django:
+каждый пришедший кусок сразу проверяется (размер, сигнатура в первых
+байтах), хэшируется и пишется во временный файл рядом с хранилищем.
+При нарушении загрузка прерывается ``StopUpload`` — остаток тела запроса
+не читается. Итоговый файл потом не копируется, а переименовывается
+хранилищем (``temporary_file_path``).
+
+Обработчик нужно поставить до чтения ``request.POST`` / ``request.FILES``,
+то есть до ``CsrfViewMiddleware``: представление помечается
+``csrf_exempt``, а проверка CSRF делается внутри через ``csrf_protect``.
+"""
+
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.http import QueryDict
+from django.utils.datastructures import MultiValueDict
+
+from requestdataapp.forms import validate_file_name
+
+SIGNATURES = (
+    ("image/png", 0, b"\x89PNG\r\n\x1a\n"),
+    ("image/jpeg", 0, b"\xff\xd8\xff"),
+    ("image/gif", 0, b"GIF87a"),
+    ("image/gif", 0, b"GIF89a"),
+    ("image/webp", 8, b"WEBP"),
+    ("application/pdf", 0, b"%PDF-"),
+    ("application/zip", 0, b"PK\x03\x04"),
+)
+FORM_FIELDS_ALLOWANCE = 64 * 1024
+SNIFF_SIZE = max(offset + len(magic) for _, offset, magic in SIGNATURES)
+
+
+def sniff_content_type(head: bytes):
+    for content_type, offset, magic in SIGNATURES:
+        if head[offset:offset + len(magic)] == magic:
+            if content_type == "image/webp" and not head.startswith(b"RIFF"):
+                continue
+            return content_type
+    return None
+
+
+class HashedUploadedFile(UploadedFile):
+    """Загруженный файл на диске с уже посчитанным sha256 (``content_sha256``)."""
+
+    def __init__(self, file, name, content_type, size, charset, content_sha256, content_type_extra=None):
+        super().__init__(file, name, content_type, size, charset, content_type_extra)
+        self.content_sha256 = content_sha256
+
+    def temporary_file_path(self) -> str:
+        return self.file.name
+
+    def close(self):
+        try:
+            return self.file.close()
+        finally:
+            # если хранилище не забрало файл, он больше не нужен
+            try:
+                os.remove(self.file.name)
+            except FileNotFoundError:
+                pass
+
+
+class StreamingUploadHandler(FileUploadHandler):
+    def __init__(self, request=None, max_size: int = None, allowed_types=None, storage=None):
+        super().__init__(request)
+        self.max_size = max_size
+        self.allowed_types = allowed_types
+        self.storage = storage or default_storage
+        self.error = None
+        self.too_large = False
+        self.writing = False
+
+    def size_error(self) -> str:
+        return f"File size exceeds the limit of {self.max_size} bytes."
+
+    def abort(self, error: str, too_large: bool = False):
+        self.error = error
+        self.too_large = too_large
+        self._discard()
+        raise StopUpload(connection_reset=True)
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # Content-Length больше лимита (с запасом на поля формы) — тело не читаем вовсе
+        if self.max_size is not None and content_length > self.max_size + FORM_FIELDS_ALLOWANCE:
+            self.error = self.size_error()
+            self.too_large = True
+            return QueryDict(encoding=encoding), MultiValueDict()
+        return None
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        try:
+            validate_file_name(UploadedFile(name=file_name))
+        except ValidationError as exc:
+            self.abort(exc.messages[0])
+
+        self.size = 0
+        self.head = b""
+        self.hasher = hashlib.sha256()
+        self.file = tempfile.NamedTemporaryFile(
+            suffix=".upload",
+            dir=self.temporary_dir(),
+            delete=False,
+        )
+        self.writing = True
+
+    def temporary_dir(self):
+        directory = getattr(self.storage, "temporary_dir", None)
+        if directory is not None:
+            directory = directory()
+            os.makedirs(directory, exist_ok=True)
+            return directory
+        return settings.FILE_UPLOAD_TEMP_DIR
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        if self.max_size is not None and self.size > self.max_size:
+            self.abort(self.size_error(), too_large=True)
+
+        if len(self.head) < SNIFF_SIZE:
+            self.head += raw_data[:SNIFF_SIZE - len(self.head)]
+            if len(self.head) >= SNIFF_SIZE:
+                self.check_type()
+
+        self.hasher.update(raw_data)
+        self.file.write(raw_data)
+
+    def check_type(self):
+        detected = sniff_content_type(self.head)
+        if self.allowed_types is not None and detected not in self.allowed_types:
+            self.abort("File type is not allowed.")
+        self.content_type = detected or self.content_type
+
+    def file_complete(self, file_size):
+        if len(self.head) < SNIFF_SIZE:
+            self.check_type()
+        self.file.flush()
+        self.file.seek(0)
+        uploaded = HashedUploadedFile(
+            file=self.file,
+            name=self.file_name,
+            content_type=self.content_type,
+            size=file_size,
+            charset=self.charset,
+            content_sha256=self.hasher.hexdigest(),
+            content_type_extra=self.content_type_extra,
+        )
+        self.writing = False
+        return uploaded
+
+    def upload_interrupted(self):
+        self._discard()
+
+    def _discard(self):
+        # MultiPartParser сам закрывает handler.file при StopUpload, поэтому атрибут не обнуляем
+        if self.writing:
+            self.writing = False
+            self.file.close()
+            try:
+                os.remove(self.file.name)
+            except FileNotFoundError:
+                pass
@@ -1,6 +1,6 @@
 from django.urls import path
 
-from requestdataapp.views import process_get_view, user_form, handle_file_upload
+from requestdataapp.views import process_get_view, user_form, handle_file_upload, metrics_view
 
 app_name = 'requestdataapp'
 
@@ -8,4 +8,5 @@ urlpatterns = [
     path('get/', process_get_view, name='get-view'),
     path('bio/', user_form, name='user-form'),
     path('upload/', handle_file_upload, name='file-upload'),
+    path('metrics/', metrics_view, name='metrics'),
 ]
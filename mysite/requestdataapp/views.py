@@ -1,8 +1,15 @@
-from django.core.files.storage import FileSystemStorage
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.core.files.storage import default_storage
 from django.http import HttpRequest, HttpResponse
 from django.shortcuts import render
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 
 from requestdataapp.forms import UserBioForm, UploadFileForm
+from requestdataapp.metrics import registry, render_prometheus
+from requestdataapp.uploads import StreamingUploadHandler
+
+MAX_UPLOAD_SIZE = 1048576
 
 
 def process_get_view(request: HttpRequest) -> HttpResponse:
@@ -24,19 +31,48 @@ def user_form(request: HttpRequest) -> HttpResponse:
     return render(request, 'requestdataapp/user-bio-form.html', context=context)
 
 
+@csrf_exempt
 def handle_file_upload(request: HttpRequest) -> HttpResponse:
+    # Обработчик загрузки ставится до того, как кто-либо прочитает тело
+    # запроса, поэтому CSRF проверяется не middleware, а ниже.
+    if request.method == "POST":
+        handler = StreamingUploadHandler(
+            request,
+            max_size=MAX_UPLOAD_SIZE,
+            # None — любые файлы; список MIME-типов включается настройкой
+            allowed_types=getattr(settings, "UPLOAD_ALLOWED_TYPES", None),
+        )
+        request.upload_handlers = [handler]
+        request.FILES  # разбор тела запроса
+        if handler.too_large:
+            response = HttpResponse(handler.error, status=413)
+            response["Connection"] = "close"
+            return response
+    return _handle_file_upload(request)
+
+
+@csrf_protect
+def _handle_file_upload(request: HttpRequest) -> HttpResponse:
     if request.method == "POST":
+        handler = request.upload_handlers[0]
+        if handler.error:
+            return HttpResponse(handler.error, status=400)
         form = UploadFileForm(request.POST, request.FILES)
         if form.is_valid():
             myfile = form.cleaned_data["file"]
-            if myfile.size > 1048576:
-                return HttpResponse("File size exceeds the limit of 1MB.")
-            fs = FileSystemStorage()
-            filename = fs.save(myfile.name, myfile)
-            print("saved file", filename)
+            default_storage.save(myfile.name, myfile)
     else:
         form = UploadFileForm()
     context = {
         "form": form,
     }
     return render(request, 'requestdataapp/file-upload.html', context=context)
+
+
+def metrics_view(request: HttpRequest) -> HttpResponse:
+    if request.META.get("REMOTE_ADDR") not in settings.INTERNAL_IPS and not request.user.is_staff:
+        raise PermissionDenied
+    return HttpResponse(
+        render_prometheus(registry.collect()),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
@@ -2,12 +2,16 @@ from django.contrib import admin
 from django.db.models import QuerySet
 from django.http import HttpRequest
 
+from shopapp import analytics
 from shopapp.admin_mixins import ExportAsCSVMixin
+from shopapp.cache import invalidate_catalogue
 from shopapp.models import Product, Order, ProductImage
+from shopapp.widgets import ProductAutocompleteSelect
 
 
 class OrderInLine(admin.TabularInline):
     model = Product.orders.through
+    raw_id_fields = "order",
 
 
 class ProductInLine(admin.StackedInline):
@@ -16,16 +20,18 @@ class ProductInLine(admin.StackedInline):
 
 @admin.action(description="Archive products")
 def mark_archived(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet):
-    queryset.update(archived=True)
+    queryset.update_tracked(archived=True)
+    invalidate_catalogue()
 
 
 @admin.action(description="Unarchived products")
 def mark_unarchived(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet):
-    queryset.update(archived=False)
+    queryset.update_tracked(archived=False)
+    invalidate_catalogue()
 
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
+class ProductAdmin(ExportAsCSVMixin, admin.ModelAdmin):
     actions = [
         mark_archived,
         mark_unarchived,
@@ -35,13 +41,13 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
         OrderInLine,
         ProductInLine,
     ]
-    list_display = "pk", "name", "description_short", "price", "discount", "archived"
+    list_display = "pk", "name", "description_short", "price", "discount", "archived", "images_count"
     list_display_links = "pk", "name"
     ordering = "name", "pk"
-    search_fields = "name", "description"
+    search_fields = "sku", "name", "description"
     fieldsets = [
         (None, {
-            "fields": ("name", "description"),
+            "fields": ("sku", "name", "description"),
         }),
         ("Price options", {
             "fields": ("price", "discount"),
@@ -66,16 +72,27 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
 class ProductInLine(admin.StackedInline):
     model = Order.products.through
 
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == "product":
+            kwargs["widget"] = ProductAutocompleteSelect()
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     inlines = [
         ProductInLine,
     ]
+    autocomplete_fields = "user",
     list_display = "delivery_address", "promo_code", "created_at", "user_verbose"
 
     def get_queryset(self, request):
         return Order.objects.select_related("user").prefetch_related("products")
 
+    def save_related(self, request, form, formsets, change):
+        # строки инлайна пишут агрегаты аналитики одним набором запросов
+        with analytics.batch():
+            super().save_related(request, form, formsets, change)
+
     def user_verbose(self, obj: Order) -> str:
         return obj.user.first_name or obj.user.username
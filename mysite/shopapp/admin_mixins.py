@@ -1,27 +1,62 @@
 import csv
 
+from django.core.exceptions import PermissionDenied
 from django.db.models import QuerySet
 from django.db.models.options import Options
-from django.http import HttpRequest, HttpResponse
+from django.http import HttpRequest, StreamingHttpResponse
+from django.urls import path
+
+from shopapp.exporters import Echo
 
 
 class ExportAsCSVMixin:
+    """
+    Выгрузка объектов модели в CSV.
+
+    Строки читаются через ``values_list(...).iterator()`` пачками и сразу
+    отдаются клиенту, связанные объекты не загружаются (для ForeignKey
+    выгружается id). Кроме действия над выбранными объектами доступен адрес
+    ``export-csv/``, выгружающий весь отфильтрованный changelist.
+    """
+    change_list_template = "admin/export_csv_change_list.html"
+    export_chunk_size = 2000
+
+    def get_urls(self):
+        meta: Options = self.model._meta
+        urls = [
+            path(
+                "export-csv/",
+                self.admin_site.admin_view(self.export_changelist_csv),
+                name=f"{meta.app_label}_{meta.model_name}_export_csv",
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def export_changelist_csv(self, request: HttpRequest):
+        if not self.has_view_or_change_permission(request):
+            raise PermissionDenied
+        changelist = self.get_changelist_instance(request)
+        return self.export_csv(request, changelist.get_queryset(request))
+
     def export_csv(self, request: HttpRequest, queryset: QuerySet):
         meta: Options = self.model._meta
         field_names = [field.name for field in meta.fields]
+        columns = [field.attname for field in meta.fields]
 
-        response = HttpResponse(content_type="text/csv")
-        response['Content-Disposition'] = f"attachment; filename={meta}-export.csv"
-
-        csv_writer = csv.writer(response)
+        rows = (
+            queryset
+            .values_list(*columns)
+            .iterator(chunk_size=self.export_chunk_size)
+        )
+        csv_writer = csv.writer(Echo())
 
-        csv_writer.writerow(field_names)
-
-        for obj in queryset:
-            csv_writer.writerow([getattr(obj, field) for field in field_names])
+        def stream():
+            yield csv_writer.writerow(field_names)
+            for row in rows:
+                yield csv_writer.writerow(row)
 
+        response = StreamingHttpResponse(stream(), content_type="text/csv")
+        response['Content-Disposition'] = f"attachment; filename={meta}-export.csv"
         return response
 
     export_csv.short_description = "Export as CSV"
-
-
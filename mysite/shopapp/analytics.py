@@ -0,0 +1,200 @@
+"""
+Аналитика продаж по дневным агрегатам.
+
+``ProductSalesDaily`` (единицы и выручка товара за день) и ``UserSpendDaily``
+(заказы и траты покупателя за день) обновляются приращениями при каждом
+изменении заказа (см. обработчики в ``shopapp.signals`` и ``shopapp.bulk``),
+поэтому отчёты читают только агрегаты и не зависят от числа заказов.
+Изменения заказа в API, формах и админке идут внутри ``batch()``: все
+приращения одного запроса пишутся разом.
+
+Выручка строки — цена из снимка ``OrderLine`` с учётом скидки. День — дата
+создания заказа в текущем часовом поясе. ``rebuild_rollups()`` пересчитывает
+всё с нуля (команда ``rebuild_sales_rollups``).
+"""
+
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from decimal import ROUND_HALF_UP, Decimal
+from itertools import groupby
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Round, TruncDate
+from django.utils import timezone
+
+from .models import Order, OrderLine, Product, ProductSalesDaily, UserSpendDaily
+
+CENT = Decimal("0.01")
+
+
+def order_day(created_at):
+    return timezone.localdate(created_at) if timezone.is_aware(created_at) else created_at.date()
+
+
+def line_amount(price, discount) -> Decimal:
+    # округление как у ROUND() в SQL, чтобы совпадать с rebuild_rollups()
+    return (Decimal(price or 0) * (100 - (discount or 0)) / 100).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def _apply(model, key_field: str, deltas: dict) -> None:
+    """deltas — {(ключ, день): {поле: приращение}}; одно UPDATE на день."""
+    deltas = {key: values for key, values in deltas.items() if any(values.values())}
+    if not deltas:
+        return
+    model.objects.bulk_create(
+        (model(**{key_field: key, "day": day}) for key, day in deltas),
+        ignore_conflicts=True,
+    )
+    by_day = sorted(deltas.items(), key=lambda item: item[0][1])
+    for day, items in groupby(by_day, key=lambda item: item[0][1]):
+        items = list(items)
+        fields = {name for _, values in items for name in values}
+        model.objects.filter(day=day, **{f"{key_field}__in": [key for (key, _), _ in items]}).update(**{
+            name: F(name) + Case(
+                *(When(**{key_field: key}, then=Value(values.get(name, 0))) for (key, _), values in items),
+                default=Value(0),
+                output_field=model._meta.get_field(name),
+            )
+            for name in fields
+        })
+
+
+class RollupDeltas:
+    """Приращения агрегатов, накопленные для записи одним набором запросов."""
+
+    def __init__(self):
+        self.products = defaultdict(lambda: {"units": 0, "revenue": Decimal(0)})
+        self.users = defaultdict(lambda: {"orders": 0, "spend": Decimal(0)})
+
+    def add(self, lines=(), orders=(), sign: int = 1, per_product: bool = True) -> None:
+        for product_id, user_id, created_at, price, discount in lines:
+            day = order_day(created_at)
+            amount = line_amount(price, discount) * sign
+            if per_product:
+                self.products[product_id, day]["units"] += sign
+                self.products[product_id, day]["revenue"] += amount
+            self.users[user_id, day]["spend"] += amount
+        for user_id, created_at in orders:
+            self.users[user_id, order_day(created_at)]["orders"] += sign
+
+    def apply(self) -> None:
+        with transaction.atomic(savepoint=False):
+            _apply(ProductSalesDaily, "product_id", self.products)
+            _apply(UserSpendDaily, "user_id", self.users)
+
+
+_batch = threading.local()
+
+
+@contextmanager
+def batch():
+    """
+    Копит вклад всех ``record()`` внутри блока и пишет его в конце одним
+    набором запросов (встречные изменения, например смена покупателя,
+    взаимно сокращаются). Вызывается внутри транзакции изменения заказа.
+    """
+    if getattr(_batch, "deltas", None) is not None:
+        yield
+        return
+    _batch.deltas = RollupDeltas()
+    try:
+        yield
+        deltas = _batch.deltas
+    finally:
+        _batch.deltas = None
+    deltas.apply()
+
+
+def record(lines=(), orders=(), sign: int = 1, per_product: bool = True) -> None:
+    """
+    Добавляет (sign=1) или вычитает (sign=-1) вклад в агрегаты.
+
+    lines — [(product_id, user_id, created_at, price, discount)] строк заказов,
+    orders — [(user_id, created_at)] самих заказов (счётчик заказов покупателя).
+    ``per_product=False`` не трогает агрегаты товаров (товар удаляется вместе с ними).
+    Внутри ``batch()`` только накапливает приращения.
+    """
+    deltas = getattr(_batch, "deltas", None)
+    if deltas is not None:
+        deltas.add(lines, orders, sign, per_product)
+        return
+    deltas = RollupDeltas()
+    deltas.add(lines, orders, sign, per_product)
+    deltas.apply()
+
+
+LINE_FIELDS = ("product_id", "order__user_id", "order__created_at", "price", "discount")
+
+
+def line_values(lines):
+    """Queryset OrderLine → аргумент ``lines`` для ``record()``."""
+    return lines.values_list(*LINE_FIELDS)
+
+
+def snapshot_prices(lines) -> None:
+    """Заполняет цену и скидку строк, добавленных через ``order.products.add()``."""
+    product = Product.objects.filter(pk=OuterRef("product_id"))
+    lines.filter(price__isnull=True).update(
+        price=Subquery(product.values("price")[:1]),
+        discount=Subquery(product.values("discount")[:1]),
+    )
+
+
+def rebuild_rollups(apps=None) -> tuple:
+    """
+    Пересчитывает все агрегаты по строкам заказов, возвращает число строк агрегатов.
+
+    ``apps`` — реестр моделей миграции (из ``RunPython``), по умолчанию текущие модели.
+    """
+    models = (Order, OrderLine, ProductSalesDaily, UserSpendDaily)
+    if apps is not None:
+        models = [apps.get_model("shopapp", model.__name__) for model in models]
+    order_model, line_model, product_model, user_model = models
+    amount = Round(
+        ExpressionWrapper(
+            F("price") * (100 - F("discount")) / 100,
+            output_field=DecimalField(max_digits=14, decimal_places=2),
+        ),
+        2,
+    )
+    product_rows = (
+        line_model.objects.annotate(day=TruncDate("order__created_at"))
+        .values("product_id", "day")
+        .annotate(units=Count("pk"), revenue=Sum(amount))
+        .order_by()
+    )
+    spend_rows = {
+        (row["user_id"], row["day"]): row["spend"]
+        for row in line_model.objects.annotate(day=TruncDate("order__created_at"), user_id=F("order__user_id"))
+        .values("user_id", "day")
+        .annotate(spend=Sum(amount))
+        .order_by()
+    }
+    order_rows = (
+        order_model.objects.annotate(day=TruncDate("created_at"))
+        .values("user_id", "day")
+        .annotate(orders=Count("pk"))
+        .order_by()
+    )
+    with transaction.atomic():
+        product_model.objects.all().delete()
+        user_model.objects.all().delete()
+        products = product_model.objects.bulk_create(
+            (product_model(**row) for row in product_rows.iterator()),
+            batch_size=1000,
+        )
+        users = user_model.objects.bulk_create(
+            (
+                user_model(
+                    user_id=row["user_id"],
+                    day=row["day"],
+                    orders=row["orders"],
+                    spend=(spend_rows.get((row["user_id"], row["day"])) or 0),
+                )
+                for row in order_rows.iterator()
+            ),
+            batch_size=1000,
+        )
+    return len(products), len(users)
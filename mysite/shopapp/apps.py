@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class ShopappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shopapp'
+
+    def ready(self):
+        from mysite import file_refs
+        from shopapp import checks  # noqa: F401
+        from shopapp.signals import restore_product_search_index
+
+        post_migrate.connect(restore_product_search_index, sender=self)
+        # освобождение ссылок на блобы для FileField всех моделей проекта
+        file_refs.connect_signals()
@@ -0,0 +1,121 @@
+"""
+Подсказки товаров по началу названия.
+
+В каждом процессе хранятся два отсортированных списка ``(ключ, pk)``:
+названия целиком и их окончания с начала каждого слова (для «Red office
+chair» — «red office chair», «office chair» и «chair»). Поиск — ``bisect``
+сначала по названиям, затем по словам, без обращений к базе: товары,
+название которых начинается с запроса, идут первыми.
+
+Индекс загружается при первом запросе. Перед поиском сверяется версия
+каталога (``shopapp.cache``, одно чтение из кэша); если она изменилась,
+из базы дочитываются только товары с ``updated_at`` не старше прошлой
+синхронизации. Удалённые из базы товары (а не архивированные) так не
+видны, поэтому раз в ``AUTOCOMPLETE_FULL_RELOAD`` секунд индекс
+перестраивается целиком.
+"""
+
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .cache import get_catalogue_version
+from .models import Product
+
+# updated_at выставляется до коммита: берём изменения с запасом
+SYNC_OVERLAP = timedelta(seconds=5)
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.casefold().split())
+
+
+def keys_for(name: str) -> list:
+    words = normalize(name).split(" ")
+    return [" ".join(words[index:]) for index in range(len(words)) if words[index]]
+
+
+def _discard(keys: list, item: tuple) -> None:
+    position = bisect_left(keys, item)
+    if position < len(keys) and keys[position] == item:
+        del keys[position]
+
+
+class ProductPrefixIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.prefixes = []
+        self.keys = []
+        self.names = {}
+        self.catalogue_version = None
+        self.synced_at = None
+        self.loaded_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def _load(self) -> None:
+        names = dict(Product.objects.filter(archived=False).order_by().values_list("pk", "name"))
+        self.prefixes = sorted((normalize(name), pk) for pk, name in names.items())
+        self.keys = sorted((key, pk) for pk, name in names.items() for key in keys_for(name))
+        self.names = names
+        self.loaded_at = time.monotonic()
+
+    def _sync(self, since) -> None:
+        # правим копии и подменяем целиком: поиск идёт без блокировки
+        prefixes, keys, names = list(self.prefixes), list(self.keys), dict(self.names)
+        changed = Product.objects.filter(updated_at__gte=since - SYNC_OVERLAP).order_by()
+        for pk, name, archived in changed.values_list("pk", "name", "archived"):
+            old_name = names.pop(pk, None)
+            if old_name is not None:
+                _discard(prefixes, (normalize(old_name), pk))
+                for key in keys_for(old_name):
+                    _discard(keys, (key, pk))
+            if not archived:
+                names[pk] = name
+                insort(prefixes, (normalize(name), pk))
+                for key in keys_for(name):
+                    insort(keys, (key, pk))
+        self.prefixes, self.keys, self.names = prefixes, keys, names
+
+    def refresh(self) -> None:
+        version = get_catalogue_version()
+        full_reload = getattr(settings, "AUTOCOMPLETE_FULL_RELOAD", 600)
+        if version == self.catalogue_version and time.monotonic() - self.loaded_at < full_reload:
+            return
+        with self.lock:
+            if version == self.catalogue_version and time.monotonic() - self.loaded_at < full_reload:
+                return
+            started_at = timezone.now()
+            if self.synced_at is None or time.monotonic() - self.loaded_at >= full_reload:
+                self._load()
+            else:
+                self._sync(self.synced_at)
+            self.synced_at = started_at
+            self.catalogue_version = version
+
+    def search(self, query: str, limit: int = 10) -> list:
+        """[(pk, name)] товаров, в названии которых есть слово, начинающееся с query."""
+        query = normalize(query)
+        if not query:
+            return []
+        self.refresh()
+        names = self.names
+        found = {}
+        for keys in (self.prefixes, self.keys):
+            position = bisect_left(keys, (query,))
+            while position < len(keys) and len(found) < limit:
+                key, pk = keys[position]
+                if not key.startswith(query):
+                    break
+                if pk not in found and pk in names:
+                    found[pk] = names[pk]
+                position += 1
+        return list(found.items())
+
+
+product_index = ProductPrefixIndex()
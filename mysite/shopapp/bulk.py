@@ -0,0 +1,140 @@
+"""
+Массовое создание заказов (``POST /api/orders/bulk/`` и ``import_orders``).
+
+Заказ — словарь ``{"delivery_address", "promo_code", "user", "products"}``,
+где ``user`` — id пользователя, ``products`` — список id товаров.
+Все пользователи и товары проверяются двумя запросами на весь список,
+затем корректные заказы создаются пачками: один ``INSERT`` заказов и один
+``INSERT`` строк связи с товарами (со снимком цены) на пачку, всё в одной
+транзакции. Сигналы при этом не шлются, агрегаты аналитики обновляются
+явно, одним вызовом ``analytics.record`` на пачку.
+Ошибки возвращаются по номеру заказа в списке.
+"""
+
+from itertools import islice
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from . import analytics
+from .models import Order, OrderLine, Product
+
+BATCH_SIZE = 500
+PROMO_CODE_MAX_LENGTH = Order._meta.get_field("promo_code").max_length
+
+
+def _clean_ids(value) -> list:
+    if not isinstance(value, (list, tuple)) or not value:
+        raise ValueError("A non-empty list of product ids is required.")
+    ids = []
+    for pk in value:
+        if isinstance(pk, bool) or not isinstance(pk, int) or pk < 1:
+            raise ValueError(f"Invalid product id {pk!r}.")
+        ids.append(pk)
+    return list(dict.fromkeys(ids))
+
+
+def clean_item(item, default_user_id=None) -> tuple:
+    """Возвращает (данные заказа, ошибки по полям) без запросов к базе."""
+    if not isinstance(item, dict):
+        return None, {"non_field_errors": ["Expected an object."]}
+
+    errors = {}
+    data = {
+        "delivery_address": item.get("delivery_address") or "",
+        "promo_code": item.get("promo_code") or "",
+        "user_id": item.get("user", default_user_id),
+    }
+    for field in ("delivery_address", "promo_code"):
+        if not isinstance(data[field], str):
+            errors[field] = ["Expected a string."]
+    if not errors.get("promo_code") and len(data["promo_code"]) > PROMO_CODE_MAX_LENGTH:
+        errors["promo_code"] = [f"Ensure this field has no more than {PROMO_CODE_MAX_LENGTH} characters."]
+    if isinstance(data["user_id"], bool) or not isinstance(data["user_id"], int):
+        errors["user"] = ["A user id is required."]
+    try:
+        data["products"] = _clean_ids(item.get("products"))
+    except ValueError as exc:
+        errors["products"] = [str(exc)]
+    return data, errors
+
+
+def create_orders(
+        items: list,
+        default_user_id: int = None,
+        only_default_user: bool = False,
+        atomic: bool = False,
+        batch_size: int = BATCH_SIZE,
+) -> tuple:
+    """
+    Создаёт заказы, возвращает ([(номер, Order)], {номер: ошибки}).
+
+    ``only_default_user`` запрещает заказы на других пользователей.
+    При ``atomic=True`` и хотя бы одной ошибке не создаётся ничего.
+    """
+    cleaned = []
+    errors = {}
+    for index, item in enumerate(items):
+        data, item_errors = clean_item(item, default_user_id)
+        if not item_errors and only_default_user and data["user_id"] != default_user_id:
+            item_errors = {"user": ["You can only create orders for yourself."]}
+        if item_errors:
+            errors[index] = item_errors
+        else:
+            cleaned.append((index, data))
+
+    product_ids = {pk for _, data in cleaned for pk in data["products"]}
+    user_ids = {data["user_id"] for _, data in cleaned}
+    known_products = {
+        pk: (price, discount)
+        for pk, price, discount in Product.objects.filter(pk__in=product_ids).values_list("pk", "price", "discount")
+    }
+    known_users = set(User.objects.filter(pk__in=user_ids).values_list("pk", flat=True))
+
+    valid = []
+    for index, data in cleaned:
+        item_errors = {}
+        if data["user_id"] not in known_users:
+            item_errors["user"] = [f"Unknown user {data['user_id']}."]
+        missing = [pk for pk in data["products"] if pk not in known_products]
+        if missing:
+            item_errors["products"] = [f"Unknown products {missing}."]
+        if item_errors:
+            errors[index] = item_errors
+        else:
+            valid.append((index, data))
+
+    if atomic and errors:
+        return [], dict(sorted(errors.items()))
+
+    created = []
+    rows = iter(valid)
+    with transaction.atomic():
+        while batch := list(islice(rows, batch_size)):
+            orders = Order.objects.bulk_create(
+                Order(
+                    delivery_address=data["delivery_address"],
+                    promo_code=data["promo_code"],
+                    user_id=data["user_id"],
+                )
+                for _, data in batch
+            )
+            lines = OrderLine.objects.bulk_create(
+                OrderLine(
+                    order=order,
+                    product_id=product_id,
+                    price=known_products[product_id][0],
+                    discount=known_products[product_id][1],
+                )
+                for order, (_, data) in zip(orders, batch)
+                for product_id in data["products"]
+            )
+            analytics.record(
+                lines=[
+                    (line.product_id, line.order.user_id, line.order.created_at, line.price, line.discount)
+                    for line in lines
+                ],
+                orders=[(order.user_id, order.created_at) for order in orders],
+            )
+            created.extend((index, order) for order, (index, _) in zip(orders, batch))
+    return created, dict(sorted(errors.items()))
@@ -0,0 +1,90 @@
+"""
+Кэширование страниц каталога.
+
+Ключи кэша содержат "версию каталога" — число в кэше, которое
+увеличивается при изменении товаров или их картинок (и ещё раз после
+коммита транзакции). Старые записи не удаляются, а просто перестают читаться и
+вытесняются по таймауту.
+
+Анонимным пользователям страница отдаётся из кэша целиком
+(``CataloguePageCacheMixin``), для авторизованных кэшируются фрагменты
+шаблонов: ``{% cache ... catalogue_version LANGUAGE_CODE %}``.
+
+Версия увеличивается в кэше того процесса, который изменил каталог, поэтому
+при нескольких воркерах кэш должен быть общим: с ``LocMemCache`` остальные
+воркеры отдают старые страницы до таймаута. ``manage.py check --deploy``
+сообщает об этом ошибкой ``shopapp.E001``; ``LocMemCache`` допустим только
+при запуске в одном процессе (``runserver``).
+"""
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpRequest, HttpResponse
+from django.utils.translation import get_language
+
+CATALOGUE_VERSION_KEY = "shopapp:catalogue-version"
+
+
+def get_catalogue_version() -> int:
+    version = cache.get(CATALOGUE_VERSION_KEY)
+    if version is None:
+        # если ключ вытеснен, начинаем с нового числа, чтобы не прочитать
+        # страницы, закэшированные под старыми версиями
+        cache.add(CATALOGUE_VERSION_KEY, int(time.time() * 1000), None)
+        version = cache.get(CATALOGUE_VERSION_KEY)
+    return version
+
+
+def _bump_catalogue_version() -> None:
+    try:
+        cache.incr(CATALOGUE_VERSION_KEY)
+    except ValueError:
+        get_catalogue_version()
+
+
+def invalidate_catalogue() -> None:
+    # Сразу и ещё раз после коммита: страница, отрисованная другим запросом
+    # до коммита, могла попасть в кэш под промежуточной версией.
+    _bump_catalogue_version()
+    transaction.on_commit(_bump_catalogue_version)
+
+
+def page_cache_key(request: HttpRequest) -> str:
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f"shopapp:page:{get_catalogue_version()}:{get_language()}:{path}"
+
+
+class CataloguePageCacheMixin:
+    """Кэш всей страницы для анонимных GET-запросов и версия каталога в контексте."""
+    page_cache_timeout = getattr(settings, "CATALOGUE_CACHE_TIMEOUT", 600)
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD") or request.user.is_authenticated:
+            return super().dispatch(request, *args, **kwargs)
+
+        key = page_cache_key(request)
+        cached = cache.get(key)
+        if cached is not None:
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+
+        response = super().dispatch(request, *args, **kwargs)
+        if response.status_code == 200 and not response.streaming:
+            def store(rendered):
+                cache.set(key, (rendered.content, rendered["Content-Type"]), self.page_cache_timeout)
+
+            if hasattr(response, "add_post_render_callback"):
+                response.add_post_render_callback(store)
+            else:
+                store(response)
+        return response
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["catalogue_version"] = get_catalogue_version()
+        context["catalogue_cache_timeout"] = self.page_cache_timeout
+        return context
@@ -0,0 +1,20 @@
+from django.core.cache import cache
+from django.core.checks import Error, Tags, register
+
+from mysite.caches import is_shared_cache
+
+
+@register(Tags.caches, deploy=True)
+def check_catalogue_cache(app_configs=None, **kwargs):
+    """Версия каталога (shopapp.cache) должна быть видна всем воркерам."""
+    if is_shared_cache(cache):
+        return []
+    return [
+        Error(
+            "The default cache is local to each process, so a catalogue change "
+            "made in one worker does not invalidate cached pages in the others.",
+            hint="Use a cache shared by all workers (Memcached, Redis, database or "
+                 "file-based) or run the site in a single process.",
+            id="shopapp.E001",
+        ),
+    ]
@@ -0,0 +1,99 @@
+"""
+Условные запросы для API.
+
+ETag и Last-Modified считаются одним агрегирующим запросом по
+``updated_at`` / ``version`` (см. ``ChangeTrackedModel``), без загрузки
+объектов и без сериализатора. Если клиент прислал актуальный
+``If-None-Match`` / ``If-Modified-Since``, сразу отдаётся 304.
+Для PUT / PATCH / DELETE проверяются ``If-Match`` / ``If-Unmodified-Since``
+(412 при несовпадении) — оптимистичная блокировка.
+"""
+
+import hashlib
+
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+class ConditionalRequestMixin:
+    def get_conditional_querysets(self, queryset, include_related=True) -> list:
+        """Выборки, от которых зависит ответ (для вложенных данных — несколько)."""
+        return [queryset]
+
+    def get_conditional_state(self, queryset, *extra, include_related=True) -> tuple:
+        states = [
+            qs.order_by().aggregate(
+                count=Count("pk"),
+                last_modified=Max("updated_at"),
+                versions=Sum("version"),
+            )
+            for qs in self.get_conditional_querysets(queryset, include_related)
+        ]
+        last_modified = max(
+            (state["last_modified"] for state in states if state["last_modified"]),
+            default=None,
+        )
+        key = repr((extra, [tuple(state.values()) for state in states]))
+        etag = quote_etag(hashlib.md5(key.encode()).hexdigest())
+        return etag, last_modified, states[0]["count"]
+
+    def get_object_queryset(self):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        return self.filter_queryset(self.get_queryset()).filter(
+            **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+        )
+
+    @staticmethod
+    def set_conditional_headers(response, etag, last_modified=None):
+        response["ETag"] = etag
+        if last_modified is not None:
+            response["Last-Modified"] = http_date(last_modified.timestamp())
+        return response
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        etag, _, _ = self.get_conditional_state(
+            queryset,
+            request.get_full_path(),
+            request.accepted_renderer.format,
+        )
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+        return self.set_conditional_headers(super().list(request, *args, **kwargs), etag)
+
+    def retrieve(self, request, *args, **kwargs):
+        etag, last_modified, count = self.get_conditional_state(self.get_object_queryset())
+        if count:
+            not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if not_modified is not None:
+                return not_modified
+        response = super().retrieve(request, *args, **kwargs)
+        return self.set_conditional_headers(response, etag, last_modified)
+
+    def _precondition_checked(self, action, request, *args, **kwargs):
+        with transaction.atomic():
+            queryset = self.get_object_queryset()
+            list(queryset.select_for_update().values_list("pk"))
+            etag, last_modified, count = self.get_conditional_state(queryset, include_related=False)
+            if count:
+                failed = get_conditional_response(request, etag=etag, last_modified=last_modified)
+                if failed is not None:
+                    return failed
+            response = action(request, *args, **kwargs)
+
+        if response.status_code < 300 and request.method != "DELETE":
+            etag, last_modified, _ = self.get_conditional_state(
+                self.get_object_queryset(),
+                include_related=False,
+            )
+            self.set_conditional_headers(response, etag, last_modified)
+        return response
+
+    def update(self, request, *args, **kwargs):
+        return self._precondition_checked(super().update, request, *args, **kwargs)
+
+    def destroy(self, request, *args, **kwargs):
+        return self._precondition_checked(super().destroy, request, *args, **kwargs)
@@ -0,0 +1,85 @@
+"""
+Потоковая выгрузка заказов.
+
+Заказы читаются пачками по первичному ключу (keyset), id товаров для каждой
+пачки подтягиваются одним запросом к промежуточной таблице, поэтому память
+не растёт с количеством заказов, а число запросов пропорционально числу пачек.
+"""
+
+import csv
+import json
+from typing import Iterable, Iterator
+
+from shopapp.models import Order
+
+EXPORT_CHUNK_SIZE = 2000
+
+CSV_FIELDS = ("order_id", "address", "promo_code", "user_id", "product_ids")
+
+
+def iter_orders_data(chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[dict]:
+    last_pk = 0
+    through = Order.products.through
+    while True:
+        orders = list(
+            Order.objects
+            .filter(pk__gt=last_pk)
+            .order_by("pk")
+            .values_list("pk", "delivery_address", "promo_code", "user_id")[:chunk_size]
+        )
+        if not orders:
+            return
+
+        order_ids = [order[0] for order in orders]
+        product_ids = {order_id: [] for order_id in order_ids}
+        links = (
+            through.objects
+            .filter(order_id__in=order_ids)
+            .order_by("product__name", "product__price")
+            .values_list("order_id", "product_id")
+        )
+        for order_id, product_id in links:
+            product_ids[order_id].append(product_id)
+
+        for pk, address, promo_code, user_id in orders:
+            yield {
+                "order_id": pk,
+                "address": address,
+                "promo_code": promo_code,
+                "user_id": user_id,
+                "product_ids": product_ids[pk],
+            }
+
+        last_pk = order_ids[-1]
+        if len(orders) < chunk_size:
+            return
+
+
+def stream_json(orders: Iterable[dict]) -> Iterator[str]:
+    yield '{"orders": ['
+    separator = ""
+    for order in orders:
+        yield separator + json.dumps(order)
+        separator = ", "
+    yield "]}"
+
+
+def stream_ndjson(orders: Iterable[dict]) -> Iterator[str]:
+    for order in orders:
+        yield json.dumps(order) + "\n"
+
+
+class Echo:
+    """Псевдо-буфер для csv.writer: возвращает строку вместо записи."""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def stream_csv(orders: Iterable[dict]) -> Iterator[str]:
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_FIELDS)
+    for order in orders:
+        row = [order[field] for field in CSV_FIELDS[:-1]]
+        row.append(" ".join(map(str, order["product_ids"])))
+        yield writer.writerow(row)
@@ -0,0 +1,65 @@
+"""
+Счётчики для боковой панели фильтров каталога (фасеты).
+
+``product_facets()`` группирует отфильтрованную выборку товаров одним
+запросом по (корзина цены, корзина скидки, archived) и складывает
+результат в три фасета. Корзины — полуинтервалы ``[gte, lt)``, их границы
+совпадают с фильтрами ``price__gte`` / ``price__lt`` API, так что клиент
+строит ссылку фильтра прямо из элемента фасета.
+
+Запросу хватает индекса ``(archived, price, discount)``: таблицу товаров
+он не читает.
+"""
+
+from django.db.models import Case, Count, IntegerField, Value, When
+
+# нижние границы корзин; последняя корзина открыта сверху
+PRICE_BUCKETS = (0, 100, 500, 1000, 5000)
+DISCOUNT_BUCKETS = (0, 1, 10, 25, 50)
+
+
+def _bucket(field: str, bounds: tuple) -> Case:
+    return Case(
+        *(When(**{f"{field}__lt": high}, then=Value(index)) for index, high in enumerate(bounds[1:])),
+        default=Value(len(bounds) - 1),
+        output_field=IntegerField(),
+    )
+
+
+def _buckets(bounds: tuple, counts: dict) -> list:
+    return [
+        {
+            "key": f"{low}-{high}" if high is not None else f"{low}+",
+            "gte": low,
+            "lt": high,
+            "count": counts.get(index, 0),
+        }
+        for index, (low, high) in enumerate(zip(bounds, bounds[1:] + (None,)))
+    ]
+
+
+def facet_rows(queryset):
+    """Сгруппированные строки (archived, price_bucket, discount_bucket, count)."""
+    return (
+        queryset.order_by()
+        .values(
+            "archived",
+            price_bucket=_bucket("price", PRICE_BUCKETS),
+            discount_bucket=_bucket("discount", DISCOUNT_BUCKETS),
+        )
+        .annotate(count=Count("pk"))
+    )
+
+
+def product_facets(queryset) -> dict:
+    rows = facet_rows(queryset)
+    price, discount, archived = {}, {}, {False: 0, True: 0}
+    for row in rows:
+        price[row["price_bucket"]] = price.get(row["price_bucket"], 0) + row["count"]
+        discount[row["discount_bucket"]] = discount.get(row["discount_bucket"], 0) + row["count"]
+        archived[row["archived"]] += row["count"]
+    return {
+        "price": _buckets(PRICE_BUCKETS, price),
+        "discount": _buckets(DISCOUNT_BUCKETS, discount),
+        "archived": [{"key": key, "count": count} for key, count in archived.items()],
+    }
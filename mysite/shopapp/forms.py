@@ -2,6 +2,7 @@ from django import forms
 from django.contrib.auth.models import Group
 from multiupload.fields import MultiFileField
 from shopapp.models import Product, Order
+from shopapp.widgets import ProductAutocompleteSelectMultiple, UserAutocompleteSelect
 
 
 class ProductForm(forms.ModelForm):
@@ -16,6 +17,24 @@ class OrderForm(forms.ModelForm):
     class Meta:
         model = Order
         fields = 'delivery_address', 'promo_code', 'user', 'products'
+        # вместо <select> со всеми пользователями и товарами
+        widgets = {
+            'user': UserAutocompleteSelect,
+            'products': ProductAutocompleteSelectMultiple,
+        }
+
+    def __init__(self, *args, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Поиск пользователей (myapiapp:users_autocomplete) доступен только персоналу.
+        # Остальные выбирают из себя и текущего покупателя заказа.
+        if not (user and user.is_staff):
+            pks = {self.instance.user_id} - {None}
+            if user and user.is_authenticated:
+                pks.add(user.pk)
+                self.initial.setdefault('user', user.pk)
+            field = self.fields['user']
+            field.queryset = field.queryset.filter(pk__in=pks)
+            field.widget = forms.Select(choices=field.choices)
 
 
 class GroupForm(forms.ModelForm):
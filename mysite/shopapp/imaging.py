@@ -0,0 +1,32 @@
+"""
+Уменьшенные копии картинок в WebP.
+
+Модуль не импортирует Django: функции выполняются в дочерних процессах
+пула (``shopapp.thumbnails``) и получают/возвращают только байты.
+"""
+
+import io
+
+from PIL import Image, ImageOps
+
+WEBP_QUALITY = 80
+
+
+def render_webp_variants(data: bytes, widths) -> list:
+    """
+    Возвращает [(ширина, высота, байты WebP)] для каждой ширины меньше
+    исходной. Если картинка уже меньше всех размеров — одна копия в исходном размере.
+    """
+    with Image.open(io.BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source)
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+    targets = sorted(width for width in set(widths) if width < image.width) or [image.width]
+    variants = []
+    for width in targets:
+        height = max(1, round(image.height * width / image.width))
+        resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+        buffer = io.BytesIO()
+        resized.save(buffer, "WEBP", quality=WEBP_QUALITY, method=4)
+        variants.append((width, height, buffer.getvalue()))
+    return variants
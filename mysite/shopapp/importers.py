@@ -0,0 +1,91 @@
+"""
+Разбор и проверка строк каталога для команды ``import_products``.
+
+Модуль не импортирует модели Django: ``parse_batch`` выполняется и в
+дочерних процессах пула, куда пачки строк передаются как есть
+(словари из ``csv.DictReader`` или сырые строки NDJSON).
+"""
+
+import json
+from decimal import Decimal, InvalidOperation
+
+FIELDS = ("sku", "name", "description", "price", "discount", "archived")
+MAX_PRICE = Decimal("999999.99")
+TRUE_VALUES = {"1", "true", "yes", "y", "t"}
+FALSE_VALUES = {"", "0", "false", "no", "n", "f"}
+
+
+class RowError(ValueError):
+    pass
+
+
+def _text(row: dict, field: str, max_length: int, required: bool = True) -> str:
+    value = row.get(field)
+    value = "" if value is None else str(value).strip()
+    if required and not value:
+        raise RowError(f"{field} is required")
+    if max_length and len(value) > max_length:
+        raise RowError(f"{field} is longer than {max_length} characters")
+    return value
+
+
+def _price(value) -> Decimal:
+    try:
+        price = Decimal(str(value if value not in (None, "") else 0)).quantize(Decimal("0.01"))
+    except InvalidOperation:
+        raise RowError(f"invalid price {value!r}")
+    if not 0 <= price <= MAX_PRICE:
+        raise RowError(f"price {price} is out of range")
+    return price
+
+
+def _discount(value) -> int:
+    try:
+        discount = int(value or 0)
+    except (TypeError, ValueError):
+        raise RowError(f"invalid discount {value!r}")
+    if not 0 <= discount <= 100:
+        raise RowError(f"discount {discount} is out of range")
+    return discount
+
+
+def _bool(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    value = "" if value is None else str(value).strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise RowError(f"invalid archived flag {value!r}")
+
+
+def clean_row(row: dict) -> dict:
+    return {
+        "sku": _text(row, "sku", 64),
+        "name": _text(row, "name", 100),
+        "description": _text(row, "description", 0, required=False),
+        "price": _price(row.get("price")),
+        "discount": _discount(row.get("discount")),
+        "archived": _bool(row.get("archived")),
+    }
+
+
+def parse_batch(batch: list) -> tuple:
+    """
+    batch — список (номер строки, строка NDJSON или словарь CSV).
+    Возвращает (проверенные строки, отклонённые [(номер, ошибка, исходник)]).
+    """
+    rows = []
+    rejects = []
+    for line, raw in batch:
+        try:
+            row = raw
+            if isinstance(raw, str):
+                row = json.loads(raw)
+                if not isinstance(row, dict):
+                    raise RowError("expected a JSON object")
+            rows.append(clean_row(row))
+        except (RowError, ValueError) as exc:
+            rejects.append((line, str(exc), raw if isinstance(raw, str) else json.dumps(raw, ensure_ascii=False)))
+    return rows, rejects
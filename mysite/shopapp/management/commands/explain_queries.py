@@ -0,0 +1,110 @@
+import re
+
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+
+from shopapp.facets import facet_rows
+from shopapp.views import OrdersListView, OrderViewSet, ProductsListView, ProductViewSet
+
+# строки плана с полным проходом по таблице (обход индекса полным не считается)
+FULL_SCAN_PATTERNS = {
+    "sqlite": re.compile(r"\bSCAN (?:TABLE )?(\w+)(?: AS \w+)?$"),
+    "postgresql": re.compile(r"\bSeq Scan on (\w+)"),
+}
+
+
+def full_scans(queryset) -> tuple:
+    """(план запроса, таблицы, которые читаются целиком)."""
+    plan = queryset.explain()
+    pattern = FULL_SCAN_PATTERNS.get(connection.vendor)
+    if pattern is None:
+        raise CommandError(f"Full scan detection is not supported for {connection.vendor}")
+    tables = {match.group(1) for line in plan.splitlines() if (match := pattern.search(line.strip()))}
+    return plan, tables
+
+
+def list_view_queryset(view_class, params=None):
+    view = view_class()
+    view.setup(RequestFactory().get("/", params or {}))
+    return view.get_queryset()
+
+
+def viewset_queryset(viewset, params=None, paginate=True):
+    """Выборка списка (первая страница) так, как её строит ViewSet для запроса с params."""
+    view = viewset(action_map={"get": "list"}, format_kwarg=None, args=(), kwargs={})
+    view.request = view.initialize_request(RequestFactory().get("/", params or {}))
+    queryset = view.filter_queryset(view.get_queryset())
+    if paginate:
+        queryset = queryset[:view.paginator.get_page_size(view.request)]
+    return queryset
+
+
+def orders_of_any_user():
+    # фильтр ?user= проверяет, что пользователь существует
+    user_pk = User.objects.order_by().values_list("pk", flat=True).first()
+    return viewset_queryset(OrderViewSet, {"user": user_pk}) if user_pk else None
+
+
+# (название, выборка или None, если её не построить, таблицы, полный проход по которым ожидаем)
+CHECKS = [
+    ("ProductsListView", lambda: list_view_queryset(ProductsListView), ()),
+    ("ProductViewSet list", lambda: viewset_queryset(ProductViewSet), ()),
+    ("ProductViewSet ?archived=false", lambda: viewset_queryset(ProductViewSet, {"archived": False}), ()),
+    (
+        "ProductViewSet ?archived=false&price__gte=100&price__lt=500",
+        lambda: viewset_queryset(ProductViewSet, {"archived": False, "price__gte": 100, "price__lt": 500}),
+        (),
+    ),
+    (
+        "ProductViewSet facets ?archived=false&price__gte=100",
+        lambda: facet_rows(viewset_queryset(ProductViewSet, {"archived": False, "price__gte": 100}, paginate=False)),
+        (),
+    ),
+    ("OrderViewSet list", lambda: viewset_queryset(OrderViewSet), ()),
+    ("OrderViewSet ?user=<pk>", orders_of_any_user, ()),
+    ("OrderViewSet ?ordering=-created_at", lambda: viewset_queryset(OrderViewSet, {"ordering": "-created_at"}), ()),
+    # список без пагинации показывает все заказы
+    ("OrdersListView", lambda: list_view_queryset(OrdersListView), ("shopapp_order",)),
+]
+
+
+class Command(BaseCommand):
+    """
+    Проверяет планы запросов основных списков магазина.
+
+    Выборки строятся самими представлениями (фильтры, сортировка,
+    пагинация API) для типичных параметров запроса и прогоняются через
+    ``EXPLAIN``. Полный проход по таблице, не отмеченный как ожидаемый,
+    означает, что представлению не хватает индекса.
+    """
+    help = "Run EXPLAIN on the querysets of the main shop views and report full table scans"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--fail", action="store_true",
+            help="Exit with an error if an unexpected full table scan is found",
+        )
+
+    def handle(self, *args, **options):
+        unexpected = []
+        for label, build, expected in CHECKS:
+            queryset = build()
+            if queryset is None:
+                self.stdout.write(f"skipped   {label}: no data to build the request")
+                continue
+            plan, tables = full_scans(queryset)
+            extra = sorted(tables - set(expected))
+            if extra:
+                unexpected.append(label)
+                self.stdout.write(self.style.ERROR(f"FULL SCAN {label}: {', '.join(extra)}"))
+            elif tables:
+                self.stdout.write(self.style.WARNING(f"expected  {label}: {', '.join(sorted(tables))}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"ok        {label}"))
+            if options["verbosity"] > 1:
+                self.stdout.write("\n".join(f"    {line}" for line in plan.splitlines()))
+
+        if unexpected and options["fail"]:
+            raise CommandError(f"Unexpected full table scans: {len(unexpected)}")
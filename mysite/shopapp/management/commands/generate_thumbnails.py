@@ -0,0 +1,41 @@
+from itertools import islice, repeat
+
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from shopapp.imaging import render_webp_variants
+from shopapp.thumbnails import TARGETS, get_executor, get_widths, needs_variants, read_source, store_variants
+
+
+class Command(BaseCommand):
+    help = "Generate missing thumbnails for product previews and images"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true", help="Regenerate existing thumbnails too")
+        parser.add_argument("--batch-size", type=int, default=16)
+
+    def handle(self, *args, force, batch_size, **options):
+        jobs = self.iter_jobs(force)
+        executor = get_executor() if settings.THUMBNAIL_WORKERS else None
+        widths = get_widths()
+        done = 0
+        while batch := list(islice(jobs, batch_size)):
+            batch = [(job, data) for job, data in ((job, read_source(job[2])) for job in batch) if data]
+            sources = [data for _, data in batch]
+            if executor is None:
+                rendered = map(render_webp_variants, sources, repeat(widths))
+            else:
+                rendered = executor.map(render_webp_variants, sources, repeat(widths))
+            for (job, _), variants in zip(batch, rendered):
+                store_variants(*job, variants)
+                done += 1
+            self.stdout.write(f"Processed {done} images")
+        self.stdout.write(self.style.SUCCESS(f"Thumbnails generated for {done} images"))
+
+    @staticmethod
+    def iter_jobs(force: bool):
+        for model, (field_name, _) in TARGETS.items():
+            queryset = model.objects.exclude(**{field_name: ""}).exclude(**{f"{field_name}__isnull": True})
+            for instance in queryset.iterator():
+                if force or needs_variants(instance):
+                    yield model, instance.pk, getattr(instance, field_name).name
@@ -0,0 +1,53 @@
+import json
+from itertools import islice
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand, CommandError
+
+from shopapp.bulk import BATCH_SIZE, create_orders
+
+
+class Command(BaseCommand):
+    """
+    Создаёт заказы из NDJSON-файла: по объекту
+    ``{"delivery_address", "promo_code", "user", "products"}`` на строку.
+
+    Каждая пачка создаётся в своей транзакции (см. ``shopapp.bulk``).
+    """
+    help = "Create orders in bulk from an NDJSON file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", type=Path)
+        parser.add_argument("--user", help="Username for orders without a user")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+        parser.add_argument("--atomic", action="store_true", help="Skip a whole batch if any order in it is invalid")
+
+    def handle(self, *args, path, user, batch_size, atomic, **options):
+        if not path.exists():
+            raise CommandError(f"File {path} does not exist")
+        default_user_id = None
+        if user:
+            try:
+                default_user_id = User.objects.get(username=user).pk
+            except User.DoesNotExist:
+                raise CommandError(f"User {user} does not exist")
+
+        created = failed = 0
+        with path.open(encoding="utf-8") as source:
+            lines = ((number, line) for number, line in enumerate(source, start=1) if line.strip())
+            while batch := list(islice(lines, batch_size)):
+                items = []
+                for number, line in batch:
+                    try:
+                        items.append(json.loads(line))
+                    except ValueError:
+                        items.append(None)
+                orders, errors = create_orders(items, default_user_id=default_user_id, atomic=atomic)
+                for index, item_errors in errors.items():
+                    self.stderr.write(f"line {batch[index][0]}: {json.dumps(item_errors)}")
+                created += len(orders)
+                failed += len(items) - len(orders)
+                self.stdout.write(f"{created} orders created, {failed} rejected")
+
+        self.stdout.write(self.style.SUCCESS(f"Orders created: {created}, rejected: {failed}"))
@@ -0,0 +1,123 @@
+import csv
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+
+from shopapp.cache import invalidate_catalogue
+from shopapp.importers import FIELDS, parse_batch
+from shopapp.models import Product
+
+UPDATE_FIELDS = ["name", "description", "price", "discount", "archived", "updated_at"]
+
+
+class Command(BaseCommand):
+    """
+    Загружает каталог товаров из CSV или NDJSON.
+
+    Файл читается потоком и делится на пачки; пачки разбираются и
+    проверяются (в пуле процессов при ``--workers``), а затем записываются
+    одним ``INSERT ... ON CONFLICT (sku) DO UPDATE`` на пачку (и одним
+    ``UPDATE`` номера изменения уже существующих товаров).
+    """
+    help = "Import products from a CSV or NDJSON file, upserting by sku"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", type=Path)
+        parser.add_argument("--format", choices=("csv", "ndjson"), help="Defaults to the file extension")
+        parser.add_argument("--batch-size", type=int, default=2000)
+        parser.add_argument("--workers", type=int, default=0, help="Parse batches in N processes")
+        parser.add_argument("--rejects", type=Path, help="Write rejected rows to this CSV file")
+        parser.add_argument("--dry-run", action="store_true", help="Only validate rows")
+
+    def handle(self, *args, path, format, batch_size, workers, rejects, dry_run, **options):
+        if not path.exists():
+            raise CommandError(f"File {path} does not exist")
+        kind = format or ("csv" if path.suffix.lower() == ".csv" else "ndjson")
+
+        started = time.monotonic()
+        imported = rejected = 0
+        rejects_file = rejects.open("w", newline="", encoding="utf-8") if rejects else None
+        rejects_writer = csv.writer(rejects_file) if rejects_file else None
+        if rejects_writer:
+            rejects_writer.writerow(["line", "error", "row"])
+
+        try:
+            with path.open(newline="", encoding="utf-8-sig") as source:
+                batches = self.iter_batches(self.iter_rows(source, kind), batch_size)
+                for rows, batch_rejects in self.parse(batches, workers):
+                    if rows and not dry_run:
+                        self.save(rows)
+                    imported += len(rows)
+                    rejected += len(batch_rejects)
+                    if rejects_writer:
+                        rejects_writer.writerows(batch_rejects)
+                    elapsed = time.monotonic() - started
+                    self.stdout.write(
+                        f"{imported} imported, {rejected} rejected, "
+                        f"{(imported + rejected) / max(elapsed, 1e-6):.0f} rows/s"
+                    )
+        finally:
+            if rejects_file:
+                rejects_file.close()
+
+        if imported and not dry_run:
+            invalidate_catalogue()
+        self.stdout.write(self.style.SUCCESS(
+            f"Products {'validated' if dry_run else 'imported'}: {imported}, rejected: {rejected}"
+        ))
+
+    @staticmethod
+    def iter_rows(source, kind: str):
+        if kind == "csv":
+            reader = csv.DictReader(source)
+            missing = {"sku", "name"} - set(reader.fieldnames or ())
+            if missing:
+                raise CommandError(f"CSV header lacks columns: {', '.join(sorted(missing))}")
+            for row in reader:
+                yield reader.line_num, {field: row.get(field) for field in FIELDS}
+        else:
+            for line, raw in enumerate(source, start=1):
+                if raw.strip():
+                    yield line, raw
+
+    @staticmethod
+    def iter_batches(rows, batch_size: int):
+        while batch := list(islice(rows, batch_size)):
+            yield batch
+
+    @staticmethod
+    def parse(batches, workers: int):
+        if workers <= 0:
+            yield from map(parse_batch, batches)
+            return
+
+        # не больше двух пачек на процесс в очереди, чтобы не читать весь файл в память
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            pending = deque()
+            for batch in batches:
+                pending.append(executor.submit(parse_batch, batch))
+                if len(pending) >= workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    @staticmethod
+    def save(rows: list) -> None:
+        # при повторе sku в пачке побеждает последняя строка
+        products = {row["sku"]: Product(**row) for row in rows}
+        with transaction.atomic():
+            # upsert не умеет version = version + 1, поэтому номер изменения
+            # существующих строк (для ETag API) поднимается отдельно, до вставки
+            Product.objects.filter(sku__in=products).update_tracked()
+            Product.objects.bulk_create(
+                products.values(),
+                update_conflicts=True,
+                unique_fields=["sku"],
+                update_fields=UPDATE_FIELDS,
+            )
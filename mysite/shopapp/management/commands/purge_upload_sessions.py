@@ -0,0 +1,16 @@
+from datetime import timedelta
+
+from django.core.management import BaseCommand
+
+from shopapp.resumable import purge_stale_uploads
+
+
+class Command(BaseCommand):
+    help = "Delete unfinished chunked uploads older than the given age"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hours", type=int, default=24)
+
+    def handle(self, *args, hours, **options):
+        count = purge_stale_uploads(timedelta(hours=hours))
+        self.stdout.write(self.style.SUCCESS(f"Deleted {count} stale uploads"))
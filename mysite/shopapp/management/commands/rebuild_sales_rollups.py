@@ -0,0 +1,19 @@
+from django.core.management import BaseCommand
+
+from shopapp.analytics import rebuild_rollups
+
+
+class Command(BaseCommand):
+    """
+    Пересчитывает дневные агрегаты продаж по строкам заказов.
+
+    Нужна после изменений заказов в обход сигналов (загрузка фикстур, правки
+    в базе вручную); существующие заказы заполняет миграция 0023.
+    """
+    help = "Rebuild daily product sales and user spend rollups from order lines"
+
+    def handle(self, *args, **options):
+        products, users = rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rollups rebuilt: {products} product-days, {users} user-days"
+        ))
@@ -0,0 +1,20 @@
+from django.core.management import BaseCommand
+
+from shopapp.cache import invalidate_catalogue
+from shopapp.models import Product
+
+
+class Command(BaseCommand):
+    """
+    Пересчитывает Product.images_count и Product.cover_image по таблице картинок.
+
+    Нужна после загрузки фикстур, массовых вставок ``bulk_create`` и прочих
+    изменений ProductImage в обход сигналов.
+    """
+    help = "Recompute denormalized image counts and cover images of products"
+
+    def handle(self, *args, **options):
+        refreshed = Product.objects.refresh_image_stats()
+        if refreshed:
+            invalidate_catalogue()
+        self.stdout.write(self.style.SUCCESS(f"Image stats refreshed for {refreshed} products"))
@@ -11,11 +11,7 @@ class Command(BaseCommand):
             return
 
         products = Product.objects.all()
-
-        for product in products:
-            order.products.add(product)
-
-        order.save()
+        order.products.add(*products)
 
         self.stdout.write(
             self.style.SUCCESS(
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+from shopapp.search import ensure_product_search_index, drop_product_search_index
+
+
+def create_search_index(apps, schema_editor):
+    ensure_product_search_index(schema_editor.connection)
+
+
+def remove_search_index(apps, schema_editor):
+    drop_product_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0013_alter_product_description_alter_product_name'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, remove_search_index),
+    ]
@@ -0,0 +1,38 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_image_stats(apps, schema_editor):
+    Product = apps.get_model("shopapp", "Product")
+    ProductImage = apps.get_model("shopapp", "ProductImage")
+    images = ProductImage.objects.filter(product=OuterRef("pk"))
+    Product.objects.filter(pk__in=ProductImage.objects.values("product")).update(
+        images_count=Coalesce(
+            Subquery(images.order_by().values("product").annotate(count=Count("pk")).values("count")),
+            0,
+        ),
+        cover_image=Subquery(images.order_by("pk").values("pk")[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0018_product_sku'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='images_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='cover_image',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='shopapp.productimage'),
+        ),
+        migrations.RunPython(fill_image_stats, migrations.RunPython.noop),
+    ]
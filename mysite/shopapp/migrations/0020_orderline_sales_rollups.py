@@ -0,0 +1,85 @@
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def snapshot_line_prices(apps, schema_editor):
+    # цен на момент заказа не сохранялось: берём текущие цены товаров
+    OrderLine = apps.get_model("shopapp", "OrderLine")
+    Product = apps.get_model("shopapp", "Product")
+    product = Product.objects.filter(pk=OuterRef("product_id"))
+    OrderLine.objects.filter(price__isnull=True).update(
+        price=Subquery(product.values("price")[:1]),
+        discount=Subquery(product.values("discount")[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('shopapp', '0019_product_image_stats'),
+    ]
+
+    operations = [
+        # таблица связи уже существует: меняем только состояние моделей
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='OrderLine',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='shopapp.order')),
+                        ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_lines', to='shopapp.product')),
+                    ],
+                    options={
+                        'db_table': 'shopapp_order_products',
+                        'unique_together': {('order', 'product')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='order',
+                    name='products',
+                    field=models.ManyToManyField(related_name='orders', through='shopapp.OrderLine', to='shopapp.product'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='orderline',
+            name='price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=8, null=True),
+        ),
+        migrations.AddField(
+            model_name='orderline',
+            name='discount',
+            field=models.SmallIntegerField(default=0),
+        ),
+        migrations.RunPython(snapshot_line_prices, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='ProductSalesDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(db_index=True)),
+                ('units', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_daily', to='shopapp.product')),
+            ],
+            options={
+                'unique_together': {('product', 'day')},
+            },
+        ),
+        migrations.CreateModel(
+            name='UserSpendDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('orders', models.IntegerField(default=0)),
+                ('spend', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='spend_daily', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'day')},
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.2 on 2026-10-18 18:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0020_orderline_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['archived', 'price', 'discount'], name='shopapp_product_facets_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations
+
+from shopapp.analytics import rebuild_rollups
+
+
+def backfill_rollups(apps, schema_editor):
+    # заказы, созданные до 0020, иначе не попадают в API аналитики
+    rebuild_rollups(apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0022_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
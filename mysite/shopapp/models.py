@@ -1,8 +1,51 @@
+import uuid
+
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 
+class ChangeTrackedQuerySet(models.QuerySet):
+    def update(self, **kwargs) -> int:
+        """``update()``, который также обновляет updated_at и version (если их не передали)."""
+        kwargs.setdefault("updated_at", timezone.now())
+        kwargs.setdefault("version", models.F("version") + 1)
+        return super().update(**kwargs)
+
+    def update_tracked(self, **kwargs) -> int:
+        """То же, что ``update()``; имя подчёркивает, что меняется и версия строки."""
+        return self.update(**kwargs)
+
+
+class ChangeTrackedModel(models.Model):
+    """
+    Время и номер последнего изменения строки.
+
+    Используются для ETag / Last-Modified в API. ``save()`` и ``update()``
+    (а значит, и ``bulk_update()``) поднимают их сами; ``bulk_create()`` с
+    ``update_conflicts`` — нет, там версию нужно поднять отдельно
+    (см. команду ``import_products``).
+    """
+    class Meta:
+        abstract = True
+
+    updated_at = models.DateTimeField(auto_now=True)
+    version = models.PositiveIntegerField(default=1)
+
+    objects = ChangeTrackedQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            self.version += 1
+            update_fields = kwargs.get("update_fields")
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, "updated_at", "version"}
+        super().save(*args, **kwargs)
+
+
 def product_preview_directory_path(instance: "Product", filename: str) -> str:
     return "products/product_{pk}/preview/{filename}".format(
         pk=instance.pk,
@@ -10,7 +53,33 @@ def product_preview_directory_path(instance: "Product", filename: str) -> str:
     )
 
 
-class Product(models.Model):
+def actual_image_stats() -> dict:
+    """Выражения для images_count и cover_image, посчитанные по ProductImage."""
+    images = ProductImage.objects.filter(product=OuterRef("pk"))
+    return {
+        "images_count": Coalesce(
+            Subquery(images.order_by().values("product").annotate(count=Count("pk")).values("count")),
+            0,
+        ),
+        "cover_image": Subquery(images.order_by("pk").values("pk")[:1]),
+    }
+
+
+class ProductQuerySet(ChangeTrackedQuerySet):
+    def refresh_image_stats(self) -> int:
+        """Пересчитывает images_count и cover_image там, где они разошлись с картинками."""
+        stats = actual_image_stats()
+        rows = self.annotate(
+            actual_images_count=stats["images_count"],
+            actual_cover_image=stats["cover_image"],
+        ).values_list("pk", "images_count", "cover_image", "actual_images_count", "actual_cover_image")
+        stale = [pk for pk, *stored, count, cover in rows.iterator() if stored != [count, cover]]
+        for start in range(0, len(stale), 1000):
+            Product.objects.filter(pk__in=stale[start:start + 1000]).update_tracked(**actual_image_stats())
+        return len(stale)
+
+
+class Product(ChangeTrackedModel):
     """
     Модель продукт представляет товар,
     который можно продавать в интернет магазине
@@ -21,7 +90,18 @@ class Product(models.Model):
         ordering = ['name', 'price']
         verbose_name = _("Product")
         verbose_name_plural = _("Products")
+        indexes = [
+            # сортировка по умолчанию (и курсорная пагинация API) без временного B-дерева
+            models.Index(fields=["name", "price"], name="shopapp_product_ordering_idx"),
+            # витрина показывает только неархивные товары
+            models.Index(
+                fields=["name", "price"], condition=models.Q(archived=False), name="shopapp_product_active_idx",
+            ),
+            # фильтры по цене и счётчики фасетов (shopapp.facets) только по индексу
+            models.Index(fields=["archived", "price", "discount"], name="shopapp_product_facets_idx"),
+        ]
 
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     name = models.CharField(max_length=100)
     description = models.TextField(null=False, blank=True)
     price = models.DecimalField(default=0, max_digits=8, decimal_places=2)
@@ -30,10 +110,34 @@ class Product(models.Model):
     archived = models.BooleanField(default=False)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, default=None, null=True)
     preview = models.ImageField(null=True, blank=True, upload_to="product_preview_directory_path")
+    preview_variants = models.JSONField(default=dict, blank=True, editable=False)
+    # поддерживаются сигналами ProductImage, см. shopapp.signals
+    images_count = models.PositiveIntegerField(default=0, editable=False)
+    cover_image = models.ForeignKey(
+        "ProductImage", on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name="+",
+    )
+
+    objects = ProductQuerySet.as_manager()
+
+    IMAGE_STATS_FIELDS = ("images_count", "cover_image")
 
     def __str__(self) -> str:
         return f"Product(pk={self.pk}, name={self.name!r})"
 
+    def save(self, *args, **kwargs):
+        # Объект мог быть загружен до добавления картинок: перед полным
+        # сохранением счётчик и обложка перечитываются под блокировкой строки,
+        # чтобы не затереть их устаревшими значениями. Если строки уже нет,
+        # save() как обычно вставляет её заново.
+        with transaction.atomic(savepoint=False):
+            if not self._state.adding and not kwargs.get("force_insert") and kwargs.get("update_fields") is None:
+                attnames = [self._meta.get_field(name).attname for name in self.IMAGE_STATS_FIELDS]
+                stats = Product.objects.select_for_update().filter(pk=self.pk).values_list(*attnames).first()
+                if stats is not None:
+                    for attname, value in zip(attnames, stats):
+                        setattr(self, attname, value)
+            super().save(*args, **kwargs)
+
 
 def product_images_directory_path(instance: "ProductImage", filename: str) -> str:
     return "products/product_{pk}/images/{filename}".format(
@@ -45,17 +149,98 @@ def product_images_directory_path(instance: "ProductImage", filename: str) -> st
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="images")
     image = models.ImageField(upload_to=product_images_directory_path)
+    variants = models.JSONField(default=dict, blank=True, editable=False)
     description = models.CharField(max_length=200, null=False, blank=True)
 
+    def save(self, *args, **kwargs):
+        # post_save обновляет images_count товара в той же транзакции
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+
+
+class UploadSession(models.Model):
+    """
+    Картинка товара, загружаемая по частям (см. ``shopapp.resumable``).
 
-class Order(models.Model):
+    Сами байты лежат во временном файле ``<id>.part``, ``offset`` — сколько
+    из ``size`` уже получено.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="upload_sessions")
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    description = models.CharField(max_length=200, null=False, blank=True)
+    size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class Order(ChangeTrackedModel):
     class Meta:
         verbose_name = _("Order")
         verbose_name_plural = _("Orders")
+        indexes = [
+            # заказы покупателя по дате (фильтр ?user= в API, аналитика покупателя)
+            models.Index(fields=["user", "created_at"], name="shopapp_order_user_created_idx"),
+            # сортировка списка заказов API
+            models.Index(fields=["created_at"], name="shopapp_order_created_idx"),
+        ]
 
     delivery_address = models.TextField(null=True, blank=True)
     promo_code = models.CharField(max_length=20, null=False, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     user = models.ForeignKey(User, on_delete=models.PROTECT)
-    products = models.ManyToManyField(Product, related_name="orders")
+    products = models.ManyToManyField(Product, related_name="orders", through="OrderLine")
     receipt = models.FileField(null=True, upload_to='orders/receipts/')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # для переноса сумм в аналитике при смене покупателя
+        instance._loaded_user_id = instance.__dict__.get("user_id")
+        return instance
+
+
+class OrderLine(models.Model):
+    """
+    Строка заказа: промежуточная таблица ``Order.products``.
+
+    ``price`` и ``discount`` — снимок товара на момент добавления в заказ
+    (заполняются в ``shopapp.analytics``), дальнейшие изменения цены
+    товара на прошлые заказы не влияют.
+    """
+    class Meta:
+        db_table = "shopapp_order_products"
+        unique_together = [("order", "product")]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="lines")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="order_lines")
+    price = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True)
+    discount = models.SmallIntegerField(default=0)
+
+    def save(self, *args, **kwargs):
+        if self.price is None:
+            self.price, self.discount = Product.objects.values_list("price", "discount").get(pk=self.product_id)
+        super().save(*args, **kwargs)
+
+
+class ProductSalesDaily(models.Model):
+    """Продажи товара за день: число проданных единиц и выручка с учётом скидок."""
+    class Meta:
+        unique_together = [("product", "day")]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="sales_daily")
+    day = models.DateField(db_index=True)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+
+class UserSpendDaily(models.Model):
+    """Заказы и траты покупателя за день."""
+    class Meta:
+        unique_together = [("user", "day")]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="spend_daily")
+    day = models.DateField()
+    orders = models.IntegerField(default=0)
+    spend = models.DecimalField(max_digits=14, decimal_places=2, default=0)
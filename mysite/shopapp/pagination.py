@@ -0,0 +1,218 @@
+"""
+Пагинация для API магазина.
+
+``KeysetPagination`` листает выборку по значениям полей сортировки
+последнего элемента страницы (``WHERE (name, price, pk) > (...)``),
+поэтому не выполняет ни ``COUNT(*)``, ни ``OFFSET`` и одинаково быстро
+отдаёт первую и тысячную страницу.
+
+``CursorOrPageNumberPagination`` по умолчанию работает как обычная
+постраничная навигация (её использует browsable API), а курсорный режим
+включается параметром ``?pagination=cursor`` или наличием ``?cursor=``.
+"""
+
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+
+
+class KeysetPagination(BasePagination):
+    page_size = 10
+    cursor_query_param = "cursor"
+    tiebreak_field = "pk"
+    invalid_cursor_message = _("Invalid cursor")
+
+    def __init__(self):
+        self.page = []
+        self.ordering = []
+        self.has_next = False
+        self.has_previous = False
+        self.request = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(queryset)
+        position, reverse = self.decode_cursor(request)
+
+        ordering = self.ordering
+        if reverse:
+            ordering = [self.reverse_field(field) for field in ordering]
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.position_filter(queryset.model, ordering, position))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if reverse:
+            results.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ("next", self.get_next_link()),
+            ("previous", self.get_previous_link()),
+            ("results", data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [{
+            "name": self.cursor_query_param,
+            "required": False,
+            "in": "query",
+            "description": "The pagination cursor value.",
+            "schema": {"type": "string"},
+        }]
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.build_link(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            url = self.request.build_absolute_uri()
+            return remove_query_param(url, self.cursor_query_param)
+        return self.build_link(self.page[0], reverse=True)
+
+    def build_link(self, instance, reverse):
+        url = self.request.build_absolute_uri()
+        position = [self.get_value(instance, field) for field in self.ordering]
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(position, reverse))
+
+    def get_ordering(self, queryset):
+        ordering = [
+            field for field in (queryset.query.order_by or queryset.model._meta.ordering)
+            if isinstance(field, str)
+        ]
+        names = {field.lstrip("-") for field in ordering}
+        pk_name = queryset.model._meta.pk.name
+        if self.tiebreak_field not in names and pk_name not in names:
+            ordering.append(self.tiebreak_field)
+        return ordering
+
+    @staticmethod
+    def reverse_field(field):
+        return field[1:] if field.startswith("-") else "-" + field
+
+    @staticmethod
+    def get_value(instance, field):
+        return getattr(instance, field.lstrip("-"))
+
+    @staticmethod
+    def to_python(model, field, value):
+        name = field.lstrip("-")
+        try:
+            model_field = model._meta.pk if name == "pk" else model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return value
+        return model_field.to_python(value)
+
+    def position_filter(self, model, ordering, position):
+        """
+        Условие "строго после позиции" для сортировки по нескольким полям:
+        (a > x) OR (a = x AND b > y) OR (a = x AND b = y AND c > z) ...
+        """
+        try:
+            values = [self.to_python(model, field, value) for field, value in zip(ordering, position)]
+        except ValidationError:
+            raise NotFound(self.invalid_cursor_message)
+
+        condition = Q()
+        equal = {}
+        for field, value in zip(ordering, values):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            condition |= Q(**equal, **{f"{name}__{lookup}": value})
+            equal[name] = value
+        return condition
+
+    def encode_cursor(self, position, reverse):
+        payload = {"o": self.ordering, "p": position}
+        if reverse:
+            payload["r"] = 1
+        data = json.dumps(payload, default=str, separators=(",", ":"))
+        return urlsafe_b64encode(data.encode()).decode()
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(urlsafe_b64decode(encoded.encode()).decode())
+            ordering, position, reverse = payload["o"], payload["p"], bool(payload.get("r"))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if ordering != self.ordering or len(position) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+
+class CursorOrPageNumberPagination(PageNumberPagination):
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    mode_query_param = "pagination"
+
+    def __init__(self):
+        self.keyset = None
+
+    def use_keyset(self, request):
+        return (
+            request.query_params.get(self.mode_query_param) == "cursor"
+            or KeysetPagination.cursor_query_param in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.use_keyset(request):
+            return super().paginate_queryset(queryset, request, view)
+
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        self.keyset = KeysetPagination()
+        self.keyset.page_size = page_size
+        return self.keyset.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_schema_operation_parameters(self, view):
+        parameters = super().get_schema_operation_parameters(view)
+        parameters.append({
+            "name": self.mode_query_param,
+            "required": False,
+            "in": "query",
+            "description": "Set to 'cursor' to paginate by cursor without COUNT/OFFSET.",
+            "schema": {"type": "string", "enum": ["cursor"]},
+        })
+        return parameters + KeysetPagination().get_schema_operation_parameters(view)
@@ -0,0 +1,170 @@
+"""
+Загрузка картинок товара по частям (в духе протокола tus).
+
+1. ``POST /api/products/<pk>/uploads/`` с ``{"filename", "size", "description"}``
+   создаёт ``UploadSession`` и пустой файл ``<id>.part``.
+2. ``PATCH /api/uploads/<id>/`` с ``Content-Type: application/offset+octet-stream``
+   и заголовком ``Upload-Offset`` дописывает кусок. Тело читается из потока
+   запроса небольшими частями и сразу пишется в файл. Если связь оборвалась,
+   ``HEAD`` вернёт, сколько байт уже получено, и можно продолжить с этого места.
+3. ``POST /api/products/<pk>/uploads/finalize/`` с ``{"uploads": [<id>, ...]}``
+   переносит собранные файлы в хранилище (переименованием, без копирования)
+   и создаёт ``ProductImage`` одной транзакцией.
+"""
+
+import os
+import tempfile
+from contextlib import suppress
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+
+from .models import ProductImage, UploadSession, product_images_directory_path
+
+try:
+    import fcntl
+except ImportError:  # Windows: без блокировки параллельных PATCH
+    fcntl = None
+
+CHUNK_SIZE = 64 * 1024
+CONTENT_TYPE = "application/offset+octet-stream"
+
+
+class UploadError(Exception):
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+
+class AssembledFile(File):
+    """Собранный файл; хранилище забирает его с диска по ``temporary_file_path``."""
+
+    def temporary_file_path(self) -> str:
+        return self.file.name
+
+
+def get_max_size() -> int:
+    return getattr(settings, "PRODUCT_UPLOAD_MAX_SIZE", 20 * 1024 * 1024)
+
+
+def temporary_dir() -> str:
+    directory = getattr(default_storage, "temporary_dir", None)
+    directory = directory() if directory else settings.FILE_UPLOAD_TEMP_DIR or tempfile.gettempdir()
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def partial_path(session: UploadSession) -> str:
+    return os.path.join(temporary_dir(), f"{session.pk}.part")
+
+
+def start_upload(product, user, filename: str, size: int, description: str = "") -> UploadSession:
+    session = UploadSession.objects.create(
+        product=product,
+        created_by=user,
+        filename=os.path.basename(filename),
+        size=size,
+        description=description,
+    )
+    open(partial_path(session), "xb").close()
+    return session
+
+
+def append_chunk(session: UploadSession, offset: int, stream) -> int:
+    """Дописывает тело запроса с позиции offset, возвращает новый offset."""
+    try:
+        file = open(partial_path(session), "r+b")
+    except FileNotFoundError:
+        raise UploadError("Upload data is missing, start a new upload.", 410)
+
+    with file:
+        if fcntl is not None:
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise UploadError("Upload is in progress in another request.", 409)
+
+        # истина — размер файла, а не offset в базе: прошлый PATCH мог оборваться
+        start = os.fstat(file.fileno()).st_size
+        if offset != start:
+            raise UploadError(f"Upload-Offset mismatch, expected {start}.", 409)
+
+        file.seek(start)
+        written = start
+        try:
+            while stream is not None and (chunk := stream.read(CHUNK_SIZE)):
+                if written + len(chunk) > session.size:
+                    file.truncate(start)
+                    written = start
+                    raise UploadError("Upload exceeds the declared size.", 413)
+                file.write(chunk)
+                written += len(chunk)
+        finally:
+            file.flush()
+            UploadSession.objects.filter(pk=session.pk).update(offset=written)
+    session.offset = written
+    return written
+
+
+def abort_upload(session: UploadSession) -> None:
+    with suppress(FileNotFoundError):
+        os.remove(partial_path(session))
+    session.delete()
+
+
+def finalize_uploads(product, user, upload_ids) -> list:
+    upload_ids = list(dict.fromkeys(upload_ids))
+    sessions = {
+        session.pk: session
+        for session in UploadSession.objects.filter(pk__in=upload_ids, product=product, created_by=user)
+    }
+    if len(sessions) != len(upload_ids):
+        raise UploadError("Unknown upload.", 404)
+    sessions = [sessions[pk] for pk in upload_ids]
+    if any(session.offset != session.size for session in sessions):
+        raise UploadError("Some uploads are not complete yet.", 409)
+
+    for session in sessions:
+        try:
+            with Image.open(partial_path(session)) as image:
+                image.verify()
+        except Exception:
+            raise UploadError(f"{session.filename} is not a valid image.", 400)
+
+    stored = []
+    try:
+        for session in sessions:
+            name = product_images_directory_path(ProductImage(product=product), session.filename)
+            with AssembledFile(open(partial_path(session), "rb"), name=session.filename) as file:
+                stored.append((session, default_storage.save(name, file)))
+
+        with transaction.atomic():
+            images = [
+                ProductImage.objects.create(product=product, image=name, description=session.description)
+                for session, name in stored
+            ]
+            UploadSession.objects.filter(pk__in=upload_ids).delete()
+    except BaseException:
+        for _, name in stored:
+            default_storage.delete(name)
+        raise
+
+    for session in sessions:
+        # хранилище обычно уже переместило файл, но могло и скопировать
+        with suppress(FileNotFoundError):
+            os.remove(partial_path(session))
+    return images
+
+
+def purge_stale_uploads(max_age: timedelta) -> int:
+    stale = UploadSession.objects.filter(created_at__lt=timezone.now() - max_age)
+    count = 0
+    for session in stale.iterator():
+        abort_upload(session)
+        count += 1
+    return count
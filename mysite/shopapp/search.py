@@ -0,0 +1,173 @@
+"""
+Полнотекстовый поиск товаров.
+
+На SQLite рядом с таблицей товаров живёт виртуальная таблица FTS5
+``shopapp_product_fts`` (external content), которую синхронизируют триггеры
+на вставку, изменение и удаление строк ``shopapp_product``. Триггеры срабатывают
+и для ``queryset.update()`` / ``bulk_create()``, поэтому индекс не зависит от
+сигналов моделей.
+
+SQLite пересоздаёт таблицу при некоторых миграциях (``AlterField``,
+``AddField`` с default), при этом триггеры удаляются вместе со старой таблицей.
+Поэтому ``ensure_product_search_index`` вызывается на ``post_migrate`` и
+восстанавливает триггеры, перестраивая индекс, если их не было.
+
+На других СУБД ``ProductSearchFilter`` работает как обычный ``SearchFilter``.
+"""
+
+import re
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from rest_framework.filters import SearchFilter
+
+FTS_TABLE = "shopapp_product_fts"
+
+HIGHLIGHT_START = "\x02"
+HIGHLIGHT_END = "\x03"
+
+CREATE_TABLE_SQL = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+    name, description,
+    content='shopapp_product', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2',
+    prefix='2 3'
+)
+"""
+
+TRIGGERS_SQL = {
+    f"{FTS_TABLE}_ai": f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON shopapp_product BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, name, description)
+            VALUES (new.id, new.name, new.description);
+        END
+    """,
+    f"{FTS_TABLE}_ad": f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON shopapp_product BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+        END
+    """,
+    f"{FTS_TABLE}_au": f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF name, description ON shopapp_product BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+            INSERT INTO {FTS_TABLE}(rowid, name, description)
+            VALUES (new.id, new.name, new.description);
+        END
+    """,
+}
+
+
+def ensure_product_search_index(using_connection=None) -> None:
+    using_connection = using_connection or connection
+    if using_connection.vendor != "sqlite":
+        return
+
+    with using_connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger') AND name LIKE %s",
+            ["shopapp_product%"],
+        )
+        existing = {row[0] for row in cursor.fetchall()}
+        if "shopapp_product" not in existing:
+            return
+        if FTS_TABLE in existing and existing.issuperset(TRIGGERS_SQL):
+            return
+
+        cursor.execute(CREATE_TABLE_SQL)
+        for sql in TRIGGERS_SQL.values():
+            cursor.execute(sql)
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def drop_product_search_index(using_connection=None) -> None:
+    using_connection = using_connection or connection
+    if using_connection.vendor != "sqlite":
+        return
+
+    with using_connection.cursor() as cursor:
+        for name in TRIGGERS_SQL:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+def build_match_expression(query: str) -> str:
+    """
+    Каждое слово запроса становится префиксным термом: ``lap pro`` ->
+    ``"lap"* "pro"*`` (все термы должны совпасть).
+    """
+    terms = re.findall(r"\w+", query)
+    return " ".join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+
+
+def render_highlight(value: str) -> str:
+    return (
+        escape(value)
+        .replace(HIGHLIGHT_START, "<mark>")
+        .replace(HIGHLIGHT_END, "</mark>")
+    )
+
+
+class ProductSearchFilter(SearchFilter):
+    """
+    ``?search=`` по индексу FTS5: совпадения по префиксам слов,
+    сортировка по релевантности (bm25, название весит больше описания)
+    и подсветка совпадений в ``search_highlight_*``.
+
+    Таблица FTS присоединяется к выборке один раз, релевантность берётся из
+    её столбца ``rank``. Подсветку считает ``add_highlights()`` отдельным
+    запросом только для строк текущей страницы.
+    """
+    name_weight = 10.0
+    description_weight = 1.0
+
+    def get_match_expression(self, request) -> str:
+        return build_match_expression(" ".join(self.get_search_terms(request)))
+
+    def filter_queryset(self, request, queryset, view):
+        if connection.vendor != "sqlite":
+            return super().filter_queryset(request, queryset, view)
+
+        match = self.get_match_expression(request)
+        if not match:
+            return queryset
+
+        table = queryset.model._meta.db_table
+        return (
+            queryset
+            .extra(
+                tables=[FTS_TABLE],
+                where=[
+                    f"{FTS_TABLE}.rowid = {table}.id",
+                    f"{FTS_TABLE} MATCH %s",
+                    # веса столбцов для rank на время запроса
+                    f"{FTS_TABLE}.rank MATCH %s",
+                ],
+                params=[match, f"bm25({self.name_weight}, {self.description_weight})"],
+            )
+            .annotate(search_rank=RawSQL(f"{FTS_TABLE}.rank", ()))
+            .order_by("search_rank", "pk")
+        )
+
+    def add_highlights(self, request, products) -> None:
+        """Проставляет ``search_highlight_*`` товарам страницы одним запросом."""
+        if connection.vendor != "sqlite" or not products:
+            return
+        match = self.get_match_expression(request)
+        if not match:
+            return
+
+        by_pk = {product.pk: product for product in products}
+        placeholders = ", ".join(["%s"] * len(by_pk))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid, highlight({FTS_TABLE}, 0, %s, %s),"
+                f" snippet({FTS_TABLE}, 1, %s, %s, '…', 16)"
+                f" FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND rowid IN ({placeholders})",
+                [HIGHLIGHT_START, HIGHLIGHT_END, HIGHLIGHT_START, HIGHLIGHT_END, match, *by_pk],
+            )
+            for pk, name, description in cursor.fetchall():
+                by_pk[pk].search_highlight_name = name
+                by_pk[pk].search_highlight_description = description
@@ -1,6 +1,10 @@
+from django.core.exceptions import ValidationError
 from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
 
-from .models import Product, Order
+from .models import Product, Order, ProductImage, UploadSession
+from .resumable import get_max_size
+from .search import render_highlight
 
 
 class ProductSerializer(serializers.ModelSerializer):
@@ -15,10 +19,56 @@ class ProductSerializer(serializers.ModelSerializer):
             "created_at",
             "archived",
             "preview",
+            "images_count",
         )
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if hasattr(instance, "search_highlight_name"):
+            data["highlight"] = {
+                "name": render_highlight(instance.search_highlight_name or ""),
+                "description": render_highlight(instance.search_highlight_description or ""),
+            }
+        return data
+
+
+class ManyPrimaryKeyRelatedField(serializers.ManyRelatedField):
+    """Список pk проверяется одним запросом, а не запросом на каждый элемент."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, "__iter__"):
+            self.fail("not_a_list", input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail("empty")
+        child = self.child_relation
+        queryset = child.get_queryset()
+        pks = []
+        for item in data:
+            try:
+                if isinstance(item, bool):
+                    raise TypeError
+                pks.append(queryset.model._meta.pk.to_python(item))
+            except (TypeError, ValueError, ValidationError):
+                child.fail("incorrect_type", data_type=type(item).__name__)
+        found = queryset.in_bulk(set(pks))
+        for pk in pks:
+            if pk not in found:
+                child.fail("does_not_exist", pk_value=pk)
+        return [found[pk] for pk in pks]
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {"child_relation": cls(*args, **kwargs)}
+        list_kwargs.update((key, value) for key, value in kwargs.items() if key in MANY_RELATION_KWARGS)
+        return ManyPrimaryKeyRelatedField(**list_kwargs)
+
 
 class OrderSerializer(serializers.ModelSerializer):
+    # у связи своя промежуточная модель (OrderLine), DRF сам сделал бы поле только для чтения
+    products = BulkPrimaryKeyRelatedField(many=True, queryset=Product.objects.all())
+
     class Meta:
         model = Order
         fields = [
@@ -28,3 +78,107 @@ class OrderSerializer(serializers.ModelSerializer):
             "products",
             "receipt",
         ]
+
+
+class ProductSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Product
+        fields = (
+            "pk",
+            "name",
+            "price",
+            "discount",
+        )
+
+
+class OrderExpandedSerializer(OrderSerializer):
+    """Заказ с краткими данными товаров вместо их id (``?expand=products``)."""
+    products = ProductSummarySerializer(many=True, read_only=True)
+
+
+class BulkOrdersSerializer(serializers.Serializer):
+    """Заказы проверяются по отдельности в ``shopapp.bulk.create_orders``."""
+    orders = serializers.ListField(child=serializers.JSONField(), min_length=1, max_length=1000)
+    atomic = serializers.BooleanField(default=False)
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = (
+            "id",
+            "filename",
+            "description",
+            "size",
+            "offset",
+            "created_at",
+        )
+        read_only_fields = ("id", "offset", "created_at")
+
+    def validate_size(self, value):
+        if not 0 < value <= get_max_size():
+            raise serializers.ValidationError(f"Size must be between 1 and {get_max_size()} bytes.")
+        return value
+
+
+class FinalizeUploadsSerializer(serializers.Serializer):
+    uploads = serializers.ListField(child=serializers.UUIDField(), min_length=1, max_length=10)
+
+
+class ProductImageSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ProductImage
+        fields = (
+            "pk",
+            "image",
+            "description",
+        )
+
+
+class AutocompleteQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=100, trim_whitespace=True, allow_blank=True)
+    limit = serializers.IntegerField(default=10, min_value=1, max_value=50)
+
+
+class FacetsQuerySerializer(serializers.Serializer):
+    facets = serializers.BooleanField(default=False, help_text="Add price, discount and archived counts")
+
+
+class AnalyticsQuerySerializer(serializers.Serializer):
+    """Параметры отчётов аналитики: период включительно по дням."""
+    since = serializers.DateField(required=False)
+    until = serializers.DateField(required=False)
+    product = serializers.IntegerField(required=False, min_value=1)
+    limit = serializers.IntegerField(default=10, min_value=1, max_value=100)
+    order_by = serializers.ChoiceField(choices=("revenue", "units"), default="revenue")
+
+    def validate(self, attrs):
+        if "since" in attrs and "until" in attrs and attrs["since"] > attrs["until"]:
+            raise serializers.ValidationError("since must not be later than until.")
+        return attrs
+
+
+class ProductSalesSerializer(serializers.Serializer):
+    product = serializers.IntegerField(source="product_id")
+    name = serializers.CharField(source="product__name")
+    units = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+
+class SalesDaySerializer(serializers.Serializer):
+    day = serializers.DateField()
+    units = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+
+class SpendDaySerializer(serializers.Serializer):
+    day = serializers.DateField()
+    orders = serializers.IntegerField()
+    spend = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+
+class UserSpendSerializer(serializers.Serializer):
+    user = serializers.IntegerField()
+    orders = serializers.IntegerField()
+    spend = serializers.DecimalField(max_digits=14, decimal_places=2)
+    days = SpendDaySerializer(many=True)
@@ -0,0 +1,166 @@
+import threading
+
+from django.db import connections
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from shopapp import analytics, thumbnails
+from shopapp.cache import invalidate_catalogue
+from shopapp.models import Product, ProductImage, Order, OrderLine, actual_image_stats
+from shopapp.search import ensure_product_search_index
+from shopapp.thumbnails import TARGETS, needs_variants, schedule_variants
+
+
+def restore_product_search_index(sender, using, **kwargs):
+    ensure_product_search_index(connections[using])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def invalidate_catalogue_cache(sender, **kwargs):
+    invalidate_catalogue()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductImage)
+def generate_image_variants(sender, instance, raw, **kwargs):
+    if not raw and needs_variants(instance):
+        schedule_variants(instance)
+
+
+@receiver(post_save, sender=ProductImage)
+def count_added_image(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        Product.objects.filter(pk=instance.product_id).update_tracked(
+            images_count=F("images_count") + 1,
+            cover_image=Coalesce("cover_image", Value(instance.pk), output_field=Product.cover_image.field),
+        )
+
+
+@receiver(post_delete, sender=ProductImage)
+def count_removed_image(sender, instance, **kwargs):
+    # обложку выбираем заново: удалённая могла быть ею (или уже обнулена SET_NULL)
+    Product.objects.filter(pk=instance.product_id).update_tracked(
+        images_count=Greatest(F("images_count") - 1, 0),
+        cover_image=actual_image_stats()["cover_image"],
+    )
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=ProductImage)
+def release_variant_files(sender, instance, **kwargs):
+    # сами картинки освобождает mysite.file_refs, здесь — их миниатюры
+    _, variants_name = TARGETS[sender]
+    thumbnails.release_variant_files(
+        size["name"] for size in (getattr(instance, variants_name) or {}).get("sizes", [])
+    )
+
+
+@receiver(m2m_changed, sender=Order.products.through)
+def touch_order_on_products_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        Order.objects.filter(pk=instance.pk).update_tracked()
+    elif pk_set:
+        Order.objects.filter(pk__in=pk_set).update_tracked()
+
+
+@receiver(pre_delete, sender=Product)
+def touch_orders_of_deleted_product(sender, instance, **kwargs):
+    # каскадное удаление строк заказа не шлёт m2m_changed, а список товаров заказа меняется
+    Order.objects.filter(lines__product=instance).update_tracked()
+
+
+# строки, уже вычтенные из агрегатов в pre_remove/pre_clear (их post_delete пропускаем)
+_removed_lines = threading.local()
+
+
+def _order_lines(instance, reverse: bool, pk_set):
+    if reverse:
+        lines = OrderLine.objects.filter(product=instance)
+        return lines if pk_set is None else lines.filter(order__in=pk_set)
+    lines = OrderLine.objects.filter(order=instance)
+    return lines if pk_set is None else lines.filter(product__in=pk_set)
+
+
+@receiver(m2m_changed, sender=Order.products.through)
+def record_order_lines(sender, instance, action, reverse, pk_set, **kwargs):
+    # add() вставляет строки через bulk_create: снимок цен и агрегаты — здесь;
+    # remove()/clear() удаляют их одним запросом: вычитаем все сразу заранее
+    if action == "post_add" and pk_set:
+        lines = _order_lines(instance, reverse, pk_set)
+        analytics.snapshot_prices(lines)
+        analytics.record(analytics.line_values(lines))
+    elif action in ("pre_remove", "pre_clear"):
+        rows = list(_order_lines(instance, reverse, pk_set).values_list("pk", *analytics.LINE_FIELDS))
+        analytics.record([row[1:] for row in rows], sign=-1)
+        _removed_lines.pks = {row[0] for row in rows}
+    elif action in ("post_remove", "post_clear"):
+        _removed_lines.pks = set()
+
+
+@receiver(post_save, sender=OrderLine)
+def record_saved_order_line(sender, instance, created, raw, **kwargs):
+    if not created or raw:
+        return
+    # инлайн админки и формы передают заказ в строке, иначе читаем два поля
+    if OrderLine.order.is_cached(instance):
+        order = (instance.order.user_id, instance.order.created_at)
+    else:
+        order = Order.objects.filter(pk=instance.order_id).values_list("user_id", "created_at").first()
+    if order is not None:
+        analytics.record([(instance.product_id, *order, instance.price, instance.discount)])
+
+
+@receiver(post_delete, sender=OrderLine)
+def record_deleted_order_line(sender, instance, origin=None, **kwargs):
+    # при удалении самого заказа или товара их вклад уже вычтен в pre_delete
+    origin_model = getattr(origin, "model", type(origin))
+    if origin_model in (Order, Product) or instance.pk in getattr(_removed_lines, "pks", ()):
+        return
+    order = Order.objects.filter(pk=instance.order_id).values_list("user_id", "created_at").first()
+    if order is not None:
+        analytics.record(
+            [(instance.product_id, *order, instance.price, instance.discount)],
+            sign=-1,
+            per_product=origin_model is not Product,
+        )
+
+
+@receiver(post_save, sender=Order)
+def record_order(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    previous_user_id = getattr(instance, "_loaded_user_id", None)
+    if created:
+        analytics.record(orders=[(instance.user_id, instance.created_at)])
+    elif previous_user_id is not None and previous_user_id != instance.user_id:
+        lines = list(analytics.line_values(instance.lines.all()))
+        analytics.record(
+            [(product_id, previous_user_id, *rest) for product_id, _, *rest in lines],
+            orders=[(previous_user_id, instance.created_at)],
+            sign=-1,
+        )
+        analytics.record(lines, orders=[(instance.user_id, instance.created_at)])
+    instance._loaded_user_id = instance.user_id
+
+
+@receiver(pre_delete, sender=Order)
+def forget_order(sender, instance, **kwargs):
+    analytics.record(
+        analytics.line_values(instance.lines.all()),
+        orders=[(instance.user_id, instance.created_at)],
+        sign=-1,
+    )
+
+
+@receiver(pre_delete, sender=Product)
+def forget_product_sales(sender, instance, **kwargs):
+    # строки агрегатов самого товара удалит каскад, вычитаем только траты покупателей
+    analytics.record(analytics.line_values(instance.order_lines.all()), sign=-1, per_product=False)
+
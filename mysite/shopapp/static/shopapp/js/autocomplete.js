@@ -0,0 +1,35 @@
+'use strict';
+{
+    // select2 из админки Django, варианты подгружаются из API по мере ввода
+    const $ = django.jQuery;
+
+    function initAutocomplete(element) {
+        $(element).select2({
+            ajax: {
+                url: element.dataset.autocompleteUrl,
+                dataType: 'json',
+                delay: 250,
+                data: params => ({q: params.term || '', page: params.page || 1}),
+                processResults: data => {
+                    const items = Array.isArray(data) ? data : data.results;
+                    return {
+                        results: items.map(item => ({id: item.pk, text: item.name || item.username})),
+                        pagination: {more: Boolean(data.next)},
+                    };
+                },
+            },
+            minimumInputLength: 1,
+            allowClear: !element.required,
+            placeholder: element.dataset.placeholder || '',
+            width: 'resolve',
+        });
+    }
+
+    $(function() {
+        $('.shopapp-autocomplete').not('[name*=__prefix__]').each((index, element) => initAutocomplete(element));
+    });
+
+    document.addEventListener('formset:added', event => {
+        $(event.target).find('.shopapp-autocomplete').each((index, element) => initAutocomplete(element));
+    });
+}
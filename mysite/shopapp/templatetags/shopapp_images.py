@@ -0,0 +1,28 @@
+from django import template
+from django.core.files.storage import default_storage
+
+register = template.Library()
+
+
+def _sizes(variants) -> list:
+    return (variants or {}).get("sizes") or []
+
+
+@register.filter
+def srcset(variants) -> str:
+    """Значение атрибута srcset по списку миниатюр (см. shopapp.thumbnails)."""
+    return ", ".join(
+        f"{default_storage.url(size['name'])} {size['width']}w"
+        for size in _sizes(variants)
+    )
+
+
+@register.filter
+def thumbnail_url(variants, width) -> str:
+    """URL самой маленькой миниатюры не уже width (или самой большой из имеющихся)."""
+    sizes = _sizes(variants)
+    if not sizes:
+        return ""
+    width = int(width)
+    size = next((size for size in sizes if size["width"] >= width), sizes[-1])
+    return default_storage.url(size["name"])
@@ -1,12 +1,48 @@
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import Future
+from decimal import Decimal
 from random import choices
 from string import ascii_letters
+from unittest import mock
 
+from django.apps import apps as django_apps
+from django.conf import settings
 from django.contrib.auth.models import User, Permission
 from django.contrib.contenttypes.models import ContentType
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.files.storage import default_storage
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import translation
+from PIL import Image
 
-from shopapp.models import Product, Order
+from requestdataapp.querybudget import QueryBudgetTestMixin
+from accounts.models import Profile
+from mysite.file_refs import stored_file_fields
+from mysite.storage import ContentAddressedStorage
+from shopapp.analytics import rebuild_rollups
+from shopapp.autocomplete import ProductPrefixIndex
+from shopapp.bulk import create_orders
+from shopapp.cache import invalidate_catalogue
+from shopapp.checks import check_catalogue_cache
+from shopapp.exporters import iter_orders_data, CSV_FIELDS
+from shopapp.facets import product_facets
+from shopapp.management.commands.explain_queries import full_scans
+from shopapp.models import Product, Order, OrderLine, ProductImage, ProductSalesDaily, UploadSession, UserSpendDaily
+from shopapp.imaging import render_webp_variants
+from shopapp.templatetags.shopapp_images import srcset, thumbnail_url
+from shopapp.thumbnails import _store_finished, store_variants
 from shopapp.utils import add_two_numbers
 
 
@@ -99,6 +135,13 @@ class OrderDetailViewTestCase(TestCase):
         self.assertContains(response, self.order.promo_code)
         self.assertEqual(response.context['order'].pk, self.order.pk)
 
+    def test_order_is_loaded_once(self):
+        url = reverse('shopapp:order_detail', kwargs={'pk': self.order.pk})
+        self.client.get(url)
+        # session, user, user and group permissions, order with its user, products
+        with self.assertNumQueries(6):
+            self.client.get(url)
+
 
 class OrdersExportTestCase(TestCase):
     fixtures = [
@@ -142,3 +185,1297 @@ class OrdersExportTestCase(TestCase):
             expected_data.append(order_data)
 
         self.assertEqual(response.json(), {'orders': expected_data})
+
+
+class OrdersStreamingExportTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.credentials = dict(username="exporter", password="qwerty")
+        cls.user = User.objects.create_user(is_staff=True, **cls.credentials)
+        cls.user.user_permissions.add(Permission.objects.get(codename="view_order"))
+        cls.products = [
+            Product.objects.create(name=name, price=10)
+            for name in ("Desktop", "Laptop")
+        ]
+        cls.orders = []
+        for index in range(5):
+            order = Order.objects.create(
+                delivery_address=f"Street {index}",
+                promo_code="SALE",
+                user=cls.user,
+            )
+            order.products.set(cls.products)
+            cls.orders.append(order)
+
+    def setUp(self):
+        translation.activate("en")
+        self.client.login(**self.credentials)
+
+    def expected_orders(self):
+        return [
+            {
+                'order_id': order.pk,
+                'address': order.delivery_address,
+                'promo_code': order.promo_code,
+                'user_id': self.user.pk,
+                'product_ids': [product.pk for product in self.products],
+            }
+            for order in self.orders
+        ]
+
+    def get_streamed(self, export_format):
+        response = self.client.get(reverse('shopapp:orders_export'), {'format': export_format})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content).decode()
+
+    def test_export_json_uses_chunk_queries(self):
+        with self.assertNumQueries(2):
+            orders = list(iter_orders_data(chunk_size=10))
+        self.assertEqual(orders, self.expected_orders())
+
+    def test_export_json_stream(self):
+        content = self.get_streamed('stream')
+        self.assertEqual(json.loads(content), {'orders': self.expected_orders()})
+
+    def test_export_ndjson(self):
+        content = self.get_streamed('ndjson')
+        orders = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(orders, self.expected_orders())
+
+    def test_export_csv(self):
+        content = self.get_streamed('csv')
+        rows = list(csv.reader(content.splitlines()))
+        self.assertEqual(rows[0], list(CSV_FIELDS))
+        self.assertEqual(len(rows), len(self.orders) + 1)
+
+    def test_unknown_format(self):
+        response = self.client.get(reverse('shopapp:orders_export'), {'format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ProductAdminExportCSVTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username="admin-export", password="qwerty")
+        Product.objects.create(name="Laptop", price=100, created_by=cls.admin)
+        Product.objects.create(name="Desktop", price=200, created_by=cls.admin)
+        Product.objects.create(name="Phone", price=50, archived=True, created_by=cls.admin)
+
+    def setUp(self):
+        translation.activate("en")
+        self.client.force_login(self.admin)
+
+    def read_rows(self, response):
+        self.assertEqual(response.status_code, 200)
+        content = b"".join(response.streaming_content).decode()
+        return list(csv.DictReader(content.splitlines()))
+
+    def test_export_filtered_changelist(self):
+        # session, user, two changelist counts and one streamed select
+        with self.assertNumQueries(5):
+            response = self.client.get(
+                reverse("admin:shopapp_product_export_csv"),
+                {"archived__exact": "0"},
+            )
+            rows = self.read_rows(response)
+        self.assertEqual([row["name"] for row in rows], ["Desktop", "Laptop"])
+        self.assertEqual(rows[0]["created_by"], str(self.admin.pk))
+
+    def test_export_selected_action(self):
+        product = Product.objects.get(name="Phone")
+        response = self.client.post(
+            reverse("admin:shopapp_product_changelist"),
+            {"action": "export_csv", "_selected_action": [product.pk]},
+        )
+        rows = self.read_rows(response)
+        self.assertEqual([row["name"] for row in rows], ["Phone"])
+
+
+class ProductCursorPaginationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for index in range(25):
+            Product.objects.create(
+                name=f"Product {index % 4}",
+                price=index % 3,
+                discount=index % 5,
+            )
+
+    def setUp(self):
+        translation.activate("en")
+
+    def walk(self, params):
+        url = reverse("shopapp:product-list")
+        pks = []
+        pages = 0
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            self.assertNotIn("count", data)
+            pks.extend(product["pk"] for product in data["results"])
+            pages += 1
+            if not data["next"]:
+                return pks, pages, data
+            response = self.client.get(data["next"])
+
+    def test_walks_all_products_without_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            pks, pages, _ = self.walk({"pagination": "cursor", "page_size": 7})
+        expected = list(
+            Product.objects.order_by("name", "price", "pk").values_list("pk", flat=True)
+        )
+        self.assertEqual(pks, expected)
+        self.assertEqual(pages, 4)
+        for query in queries.captured_queries:
+            # the ETag aggregate is fine, the paginator count is not
+            self.assertNotIn('AS "__count"', query["sql"])
+            self.assertNotIn("OFFSET", query["sql"])
+
+    def test_custom_ordering_and_previous_link(self):
+        pks, _, last_page = self.walk({"pagination": "cursor", "ordering": "-discount"})
+        expected = list(
+            Product.objects.order_by("-discount", "pk").values_list("pk", flat=True)
+        )
+        self.assertEqual(pks, expected)
+
+        previous = self.client.get(last_page["previous"]).json()
+        self.assertEqual([product["pk"] for product in previous["results"]], expected[10:20])
+
+    def test_page_number_mode_is_default(self):
+        response = self.client.get(reverse("shopapp:product-list"), {"page": 2})
+        self.assertEqual(response.json()["count"], 25)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse("shopapp:product-list"), {"cursor": "garbage"})
+        self.assertEqual(response.status_code, 404)
+
+
+class ProductSearchTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.laptop = Product.objects.create(name="Gaming laptop", description="Fast <b>machine</b>")
+        cls.bag = Product.objects.create(name="Bag", description="Fits any laptop")
+        cls.phone = Product.objects.create(name="Smartphone", description="Small")
+
+    def setUp(self):
+        translation.activate("en")
+
+    def search(self, query):
+        response = self.client.get(reverse("shopapp:product-list"), {"search": query})
+        self.assertEqual(response.status_code, 200)
+        return response.json()["results"]
+
+    def test_ranked_prefix_search(self):
+        results = self.search("lapt")
+        self.assertEqual([product["pk"] for product in results], [self.laptop.pk, self.bag.pk])
+        self.assertEqual(results[0]["highlight"]["name"], "Gaming <mark>laptop</mark>")
+        self.assertIn("&lt;b&gt;", results[0]["highlight"]["description"])
+
+    def test_index_follows_updates_and_deletes(self):
+        Product.objects.filter(pk=self.phone.pk).update(name="Smart watch")
+        self.assertEqual([product["pk"] for product in self.search("watch")], [self.phone.pk])
+        self.assertEqual(self.search("smartphone"), [])
+
+        self.bag.delete()
+        self.assertEqual([product["pk"] for product in self.search("laptop")], [self.laptop.pk])
+
+    def test_search_with_cursor_pagination(self):
+        response = self.client.get(
+            reverse("shopapp:product-list"),
+            {"search": "laptop", "pagination": "cursor", "page_size": 1},
+        )
+        data = response.json()
+        self.assertEqual(data["results"][0]["pk"], self.laptop.pk)
+        next_page = self.client.get(data["next"]).json()
+        self.assertEqual([product["pk"] for product in next_page["results"]], [self.bag.pk])
+
+
+    def test_large_match_set_is_ranked_in_one_join(self):
+        Product.objects.bulk_create(
+            Product(name=f"Laptop {index}", description="Light laptop") for index in range(2000)
+        )
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(
+                reverse("shopapp:product-list"),
+                {"search": "lap", "pagination": "cursor", "page_size": 5},
+            )
+        results = response.json()["results"]
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all("<mark>" in product["highlight"]["name"] for product in results))
+
+        queries = [query["sql"] for query in context.captured_queries]
+        # одна таблица FTS в FROM, без подзапроса на каждую строку
+        self.assertTrue(all(sql.count("MATCH '\"lap\"*'") <= 1 for sql in queries))
+        highlights = [sql for sql in queries if "highlight(" in sql]
+        self.assertEqual(len(highlights), 1)
+        page = ", ".join(str(product["pk"]) for product in results)
+        self.assertTrue(highlights[0].endswith(f"rowid IN ({page})"))
+
+        next_page = self.client.get(response.json()["next"]).json()["results"]
+        self.assertFalse({product["pk"] for product in results} & {product["pk"] for product in next_page})
+
+class OrderViewSetQueriesTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="api-orders", password="qwerty")
+        cls.products = [
+            Product.objects.create(name=f"Product {index}", price=index)
+            for index in range(3)
+        ]
+        Order.objects.bulk_create(
+            Order(delivery_address=f"Street {index}", user=cls.user)
+            for index in range(100)
+        )
+        through = Order.products.through
+        through.objects.bulk_create(
+            through(order_id=order_id, product_id=product.pk)
+            for order_id in Order.objects.values_list("pk", flat=True)
+            for product in cls.products
+        )
+
+    def setUp(self):
+        translation.activate("en")
+        self.client.force_login(self.user)
+
+    def test_order_page_query_count(self):
+        # session, user, etag aggregate, count, orders, products of all orders
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse("shopapp:order-list"), {"page_size": 100})
+        results = response.json()["results"]
+        self.assertEqual(len(results), 100)
+        self.assertEqual(results[0]["products"], [product.pk for product in self.products])
+
+    def test_expand_products_query_count(self):
+        # + etag aggregate for the expanded products
+        with self.assertNumQueries(7):
+            response = self.client.get(
+                reverse("shopapp:order-list"),
+                {"page_size": 100, "expand": "products"},
+            )
+        products = response.json()["results"][0]["products"]
+        self.assertEqual(
+            products[0],
+            {"pk": self.products[0].pk, "name": "Product 0", "price": "0.00", "discount": 0},
+        )
+
+
+    def test_products_keep_model_ordering(self):
+        zebra, apple = Product.objects.create(name="Zebra"), Product.objects.create(name="Apple")
+        order = Order.objects.create(delivery_address="Street", user=self.user)
+        order.products.add(zebra, apple)
+        response = self.client.get(reverse("shopapp:order-detail", kwargs={"pk": order.pk}))
+        self.assertEqual(response.json()["products"], [apple.pk, zebra.pk])
+
+class ConditionalRequestsTestCase(QueryBudgetTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser(username="etag-admin", password="qwerty")
+        cls.product = Product.objects.create(name="Lamp", price=10)
+        cls.order = Order.objects.create(delivery_address="Street 1", user=cls.user)
+        cls.order.products.add(cls.product)
+
+    def setUp(self):
+        translation.activate("en")
+        self.client.force_login(self.user)
+        self.detail_url = reverse("shopapp:product-detail", kwargs={"pk": self.product.pk})
+
+    def test_list_not_modified(self):
+        url = reverse("shopapp:product-list")
+        etag = self.client.get(url)["ETag"]
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        Product.objects.create(name="Chair")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_detail_not_modified(self):
+        response = self.client.get(self.detail_url)
+        self.assertIn("Last-Modified", response)
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_update_changes_etag_and_checks_if_match(self):
+        etag = self.client.get(self.detail_url)["ETag"]
+        response = self.client.patch(
+            self.detail_url,
+            {"price": "12.00"},
+            content_type="application/json",
+            HTTP_IF_MATCH=etag,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.version, 2)
+
+        response = self.client.patch(
+            self.detail_url,
+            {"price": "14.00"},
+            content_type="application/json",
+            HTTP_IF_MATCH=etag,
+        )
+        self.assertEqual(response.status_code, 412)
+
+    def test_product_changes_within_budget(self):
+        response = self.assertWithinDeclaredBudget(
+            self.detail_url, "PATCH", data={"price": "12.00"}, content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.assertWithinDeclaredBudget(self.detail_url, "DELETE")
+        self.assertEqual(response.status_code, 204)
+
+    def test_order_etag_follows_product_deletion(self):
+        url = reverse("shopapp:order-detail", kwargs={"pk": self.order.pk})
+        chair = Product.objects.create(name="Chair")
+        self.order.products.add(chair)
+        etag = self.client.get(url)["ETag"]
+
+        self.assertEqual(self.client.delete(reverse("shopapp:product-detail", kwargs={"pk": chair.pk})).status_code, 204)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["products"], [self.product.pk])
+
+    def test_list_etag_follows_bulk_changes(self):
+        url = reverse("shopapp:product-list")
+        self.product.sku = "LAMP-1"
+        self.product.save()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, "catalogue.csv")
+        with open(path, "w", encoding="utf-8") as file:
+            file.write("sku,name,price\nLAMP-1,Lamp,10\n")
+
+        changes = [
+            lambda: Product.objects.filter(pk=self.product.pk).update(price=11),
+            lambda: Product.objects.bulk_update([Product(pk=self.product.pk, price=12)], ["price"]),
+            # та же цена: строка переписана, версия всё равно новая
+            lambda: call_command("import_products", path, stdout=io.StringIO()),
+        ]
+        etag = self.client.get(url)["ETag"]
+        for change in changes:
+            change()
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            etag = response["ETag"]
+
+    def test_order_etag_follows_products_change(self):
+        url = reverse("shopapp:order-detail", kwargs={"pk": self.order.pk})
+        etag = self.client.get(url)["ETag"]
+        self.order.products.add(Product.objects.create(name="Chair"))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class ShopViewsQueryBudgetTestCase(QueryBudgetTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="budget-user", password="qwerty")
+        cls.products = [Product.objects.create(name=f"Product {index}") for index in range(5)]
+        for index in range(5):
+            order = Order.objects.create(delivery_address=f"Street {index}", user=cls.user)
+            order.products.set(cls.products)
+
+    def setUp(self):
+        translation.activate("en")
+        self.client.force_login(self.user)
+
+    def test_catalogue_views(self):
+        self.assertWithinDeclaredBudget(reverse("shopapp:index"))
+        self.assertWithinDeclaredBudget(reverse("shopapp:products_list"))
+        self.assertWithinDeclaredBudget(
+            reverse("shopapp:product_details", kwargs={"pk": self.products[0].pk})
+        )
+
+    def test_order_views(self):
+        self.assertWithinDeclaredBudget(reverse("shopapp:order_list"))
+        self.assertWithinDeclaredBudget(reverse("shopapp:order-list"))
+
+
+class CataloguePageCacheTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username="cache-admin", password="qwerty")
+        cls.product = Product.objects.create(name="Cached table")
+
+    def setUp(self):
+        translation.activate("en")
+        cache.clear()
+
+    def test_anonymous_page_served_from_cache(self):
+        url = reverse("shopapp:products_list")
+        first = self.client.get(url)
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+        self.assertEqual(first.content, second.content)
+
+    def test_cache_is_per_language(self):
+        self.client.get(reverse("shopapp:products_list"))
+        with translation.override("ru"):
+            response = self.client.get(reverse("shopapp:products_list"))
+        self.assertContains(response, "Cached table")
+        self.assertEqual(response.wsgi_request.LANGUAGE_CODE, "ru")
+
+    def test_product_save_invalidates(self):
+        url = reverse("shopapp:product_details", kwargs={"pk": self.product.pk})
+        self.client.get(url)
+        self.product.name = "Renamed table"
+        self.product.save()
+        self.assertContains(self.client.get(url), "Renamed table")
+
+    def test_admin_archive_action_invalidates(self):
+        url = reverse("shopapp:products_list")
+        self.assertContains(self.client.get(url), "Cached table")
+
+        admin_client = self.client_class()
+        admin_client.force_login(self.admin)
+        admin_client.post(
+            reverse("admin:shopapp_product_changelist"),
+            {"action": "mark_archived", "_selected_action": [self.product.pk]},
+        )
+        self.assertNotContains(self.client.get(url), "Cached table")
+
+    def test_authenticated_users_get_fragment_cache(self):
+        self.client.force_login(self.admin)
+        url = reverse("shopapp:products_list")
+        self.client.get(url)
+        # session, user and the catalogue fragment comes from cache
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertContains(response, "Cached table")
+
+    def test_deploy_check_requires_shared_cache(self):
+        self.assertEqual([error.id for error in check_catalogue_cache()], ["shopapp.E001"])
+        with tempfile.TemporaryDirectory() as directory, override_settings(CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": directory},
+        }):
+            self.assertEqual(check_catalogue_cache(), [])
+
+
+@override_settings(THUMBNAIL_WORKERS=0, THUMBNAIL_WIDTHS=(160, 320, 640))
+class ProductThumbnailsTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_override = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    @staticmethod
+    def make_image(width: int, height: int) -> SimpleUploadedFile:
+        buffer = io.BytesIO()
+        Image.new("RGB", (width, height), "orange").save(buffer, "PNG")
+        return SimpleUploadedFile("photo.png", buffer.getvalue(), content_type="image/png")
+
+    def setUp(self):
+        translation.activate("en")
+        self.product = Product.objects.create(name="Lamp")
+
+    def test_variants_generated_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = ProductImage.objects.create(product=self.product, image=self.make_image(800, 400))
+        image.refresh_from_db()
+
+        self.assertEqual(image.variants["source"], image.image.name)
+        sizes = image.variants["sizes"]
+        self.assertEqual([(size["width"], size["height"]) for size in sizes], [(160, 80), (320, 160), (640, 320)])
+        for size in sizes:
+            self.assertTrue(size["name"].endswith(".webp"))
+            with default_storage.open(size["name"]) as file, Image.open(file) as thumbnail:
+                self.assertEqual(thumbnail.format, "WEBP")
+                self.assertEqual(thumbnail.width, size["width"])
+
+        self.assertEqual(srcset(image.variants).count("w, "), 2)
+        self.assertEqual(thumbnail_url(image.variants, 300), default_storage.url(sizes[1]["name"]))
+        self.assertEqual(thumbnail_url(image.variants, 2000), default_storage.url(sizes[2]["name"]))
+
+    def test_small_image_and_preview_replacement(self):
+        self.product.preview = self.make_image(100, 100)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        self.product.refresh_from_db()
+        self.assertEqual([size["width"] for size in self.product.preview_variants["sizes"]], [100])
+
+        self.product.preview = None
+        self.product.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.preview_variants, {})
+
+    def test_details_page_uses_srcset(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductImage.objects.create(product=self.product, image=self.make_image(800, 400))
+        response = self.client.get(reverse("shopapp:product_details", kwargs={"pk": self.product.pk}))
+        self.assertContains(response, "srcset=")
+        self.assertContains(response, ".webp 320w")
+
+    def rendered(self, image):
+        with default_storage.open(image.image.name) as file:
+            return render_webp_variants(file.read(), (160, 320))
+
+    def refs(self, names):
+        return [default_storage.refs(name) for name in names]
+
+    def test_regeneration_releases_previous_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = ProductImage.objects.create(product=self.product, image=self.make_image(800, 400))
+        image.refresh_from_db()
+        names = [size["name"] for size in image.variants["sizes"]]
+        before = self.refs(names)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            variants = store_variants(ProductImage, image.pk, image.image.name, self.rendered(image))
+        # те же 160/320 — те же блобы, ссылок не прибавилось; ссылка на 640 снята
+        self.assertEqual([size["name"] for size in variants["sizes"]], names[:2])
+        self.assertEqual(self.refs(names), [before[0], before[1], before[2] - 1])
+
+    def test_lost_race_releases_new_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = ProductImage.objects.create(product=self.product, image=self.make_image(800, 400))
+        image.refresh_from_db()
+        rendered = self.rendered(image)
+        names = [size["name"] for size in image.variants["sizes"]][:2]
+        before = self.refs(names)
+        ProductImage.objects.filter(pk=image.pk).update(image="products/other.png")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            variants = store_variants(ProductImage, image.pk, image.image.name, rendered)
+        # запись не обновилась, сохранённые копии не держат лишних ссылок
+        self.assertEqual(ProductImage.objects.get(pk=image.pk).variants, image.variants)
+        self.assertEqual([size["name"] for size in variants["sizes"]], names)
+        self.assertEqual(self.refs(names), before)
+
+    def test_callback_in_calling_thread_keeps_connection(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = ProductImage.objects.create(product=self.product, image=self.make_image(800, 400))
+        future = Future()
+        future.set_result(self.rendered(image))
+
+        with mock.patch("shopapp.thumbnails.connection") as connection_mock:
+            _store_finished(ProductImage, image.pk, image.image.name, future, threading.get_ident())
+            connection_mock.close.assert_not_called()
+
+            failed = Future()
+            failed.set_exception(OSError("worker crashed"))
+            worker = threading.Thread(
+                target=_store_finished, args=(ProductImage, image.pk, image.image.name, failed, threading.get_ident()),
+            )
+            with self.assertLogs("shopapp.thumbnails", "ERROR"):
+                worker.start()
+                worker.join()
+            connection_mock.close.assert_called_once_with()
+
+
+class ContentAddressedStorageTestCase(TestCase):
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location, ignore_errors=True)
+        self.storage = ContentAddressedStorage(location=self.location)
+
+    def test_same_content_is_stored_once(self):
+        first = self.storage.save("products/product_1/images/a.PNG", ContentFile(b"image"))
+        second = self.storage.save("avatars/user_avatar.png", ContentFile(b"image"))
+        other = self.storage.save("a.png", ContentFile(b"other"))
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertRegex(first, r"^blobs/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.png$")
+        self.assertEqual(self.storage.refs(first), 2)
+        with self.storage.open(first) as file:
+            self.assertEqual(file.read(), b"image")
+        self.assertEqual(os.listdir(self.storage.temporary_dir()), [])
+        self.assertFalse(self.storage.temporary_dir().startswith(os.path.join(self.location, "")))
+
+    def test_delete_releases_references(self):
+        name = self.storage.save("a.txt", ContentFile(b"data"))
+        self.storage.save("b.txt", ContentFile(b"data"))
+
+        self.storage.delete(name)
+        self.assertTrue(self.storage.exists(name))
+        self.storage.delete(name)
+        self.assertFalse(self.storage.exists(name))
+        self.assertEqual(self.storage.refs(name), 0)
+
+        self.assertEqual(self.storage.save("c.txt", ContentFile(b"data")), name)
+        self.assertEqual(self.storage.refs(name), 1)
+
+    def test_temporary_upload_is_moved(self):
+        upload = TemporaryUploadedFile("big.bin", "application/octet-stream", 4, None)
+        upload.write(b"big!")
+        upload.flush()
+        temporary_path = upload.temporary_file_path()
+
+        name = self.storage.save("big.bin", upload)
+        upload.close()
+
+        self.assertFalse(os.path.exists(temporary_path))
+        with self.storage.open(name) as file:
+            self.assertEqual(file.read(), b"big!")
+
+
+class FileReferencesTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="receipts")
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_override = override_settings(MEDIA_ROOT=media_root)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+    def create_order(self, content: bytes) -> Order:
+        with self.captureOnCommitCallbacks(execute=True):
+            return Order.objects.create(user=self.user, receipt=ContentFile(content, name="receipt.txt"))
+
+    def test_replaced_and_deleted_files_are_released(self):
+        order = self.create_order(b"first")
+        first = order.receipt.name
+        self.assertEqual(default_storage.refs(first), 1)
+
+        order = Order.objects.get(pk=order.pk)
+        order.receipt = ContentFile(b"second", name="receipt.txt")
+        with self.captureOnCommitCallbacks(execute=True):
+            order.save()
+        second = order.receipt.name
+        self.assertEqual((default_storage.refs(first), default_storage.refs(second)), (0, 1))
+        self.assertFalse(default_storage.exists(first))
+
+        # та же загрузка ещё раз: новая ссылка взята, старая отдана
+        order.receipt = ContentFile(b"second", name="receipt.txt")
+        with self.captureOnCommitCallbacks(execute=True):
+            order.save()
+        self.assertEqual(default_storage.refs(second), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Order.objects.get(pk=order.pk).delete()
+        self.assertEqual(default_storage.refs(second), 0)
+
+    def test_file_fields_in_storage_are_tracked(self):
+        tracked = {
+            model.__name__: [field.name for field in stored_file_fields(model)]
+            for model in (Product, ProductImage, Order, Profile)
+        }
+        self.assertEqual(tracked, {
+            "Product": ["preview"], "ProductImage": ["image"], "Order": ["receipt"], "Profile": ["avatar"],
+        })
+
+    def test_rolled_back_save_releases_new_file(self):
+        shared = self.create_order(b"shared").receipt.name
+        order = Order.objects.get(pk=self.create_order(b"other").pk)
+        other = order.receipt.name
+
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            order.receipt = ContentFile(b"shared", name="receipt.txt")
+            order.save()
+            self.assertEqual(default_storage.refs(shared), 2)
+            raise RuntimeError
+        self.assertEqual((default_storage.refs(shared), default_storage.refs(other)), (1, 1))
+
+
+@override_settings(THUMBNAIL_WORKERS=0)
+class ResumableUploadTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="uploader", password="qwerty")
+        cls.user.user_permissions.add(Permission.objects.get(codename="change_product"))
+        cls.product = Product.objects.create(name="Lamp", created_by=cls.user)
+
+    def setUp(self):
+        translation.activate("en")
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_override = override_settings(MEDIA_ROOT=media_root)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+        self.client.force_login(self.user)
+
+        buffer = io.BytesIO()
+        Image.new("RGB", (64, 48), "green").save(buffer, "PNG")
+        self.content = buffer.getvalue()
+
+    def start(self, size=None) -> str:
+        response = self.client.post(
+            reverse("shopapp:product_uploads", kwargs={"pk": self.product.pk}),
+            {"filename": "photo.png", "size": size or len(self.content), "description": "Side view"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response["Upload-Offset"], "0")
+        return response["Location"]
+
+    def head(self, url: str):
+        # HEAD с INTERNAL_IPS перехватывает admindocs XViewMiddleware
+        return self.client.head(url, REMOTE_ADDR="10.0.0.1")
+
+    def patch(self, url: str, offset: int, data: bytes):
+        return self.client.patch(
+            url,
+            data,
+            content_type="application/offset+octet-stream",
+            HTTP_UPLOAD_OFFSET=str(offset),
+        )
+
+    def finalize(self, *urls):
+        return self.client.post(
+            reverse("shopapp:product_uploads_finalize", kwargs={"pk": self.product.pk}),
+            {"uploads": [url.rstrip("/").rsplit("/", 1)[1] for url in urls]},
+            content_type="application/json",
+        )
+
+    def test_chunks_are_assembled_and_attached(self):
+        first, second = self.start(), self.start()
+        middle = len(self.content) // 2
+
+        self.assertEqual(self.patch(first, 0, self.content[:middle]).status_code, 204)
+        self.assertEqual(self.head(first)["Upload-Offset"], str(middle))
+        response = self.patch(first, 0, self.content[middle:])
+        self.assertContains(response, f"expected {middle}", status_code=409)
+        response = self.patch(first, middle, self.content[middle:])
+        self.assertEqual(response["Upload-Offset"], str(len(self.content)))
+
+        self.assertEqual(self.finalize(first, second).status_code, 409)
+        self.patch(second, 0, self.content)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.finalize(first, second)
+        self.assertEqual(response.status_code, 201)
+
+        images = list(self.product.images.all())
+        self.assertEqual(len(images), 2)
+        self.assertEqual(images[0].description, "Side view")
+        with images[0].image.open() as file:
+            self.assertEqual(file.read(), self.content)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_rejects_oversized_and_invalid_data(self):
+        url = self.start(size=4)
+        self.assertEqual(self.patch(url, 0, b"12345").status_code, 413)
+        self.assertEqual(self.head(url)["Upload-Offset"], "0")
+        self.patch(url, 0, b"1234")
+        self.assertContains(self.finalize(url), "not a valid image", status_code=400)
+        self.assertFalse(ProductImage.objects.exists())
+
+    def test_other_users_cannot_upload(self):
+        other = User.objects.create_user(username="stranger", password="qwerty")
+        self.client.force_login(other)
+        response = self.client.post(
+            reverse("shopapp:product_uploads", kwargs={"pk": self.product.pk}),
+            {"filename": "photo.png", "size": 10},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 403)
+
+
+class ImportProductsCommandTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        Product.objects.create(sku="A-1", name="Old name", price=1)
+
+    def write(self, name: str, content: str) -> str:
+        path = os.path.join(self.directory, name)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(content)
+        return path
+
+    def test_csv_upsert_with_rejects(self):
+        path = self.write("catalogue.csv", (
+            "sku,name,price,discount,archived\n"
+            "A-1,Lamp,10.5,5,no\n"
+            "B-2,Chair,20,0,yes\n"
+            "C-3,,1,0,no\n"
+            "D-4,Table,abc,0,no\n"
+        ))
+        rejects = os.path.join(self.directory, "rejects.csv")
+        out = io.StringIO()
+        version = Product.objects.get(sku="A-1").version
+
+        # version bump and upsert for the first batch; the second batch is fully rejected
+        with self.assertNumQueries(4):
+            call_command("import_products", path, "--batch-size", "2", "--rejects", rejects, stdout=out)
+
+        lamp = Product.objects.get(sku="A-1")
+        self.assertEqual((lamp.name, str(lamp.price), lamp.discount), ("Lamp", "10.50", 5))
+        self.assertEqual(lamp.version, version + 1)
+        self.assertEqual(Product.objects.get(sku="B-2").version, 1)
+        self.assertTrue(Product.objects.get(sku="B-2").archived)
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertIn("imported: 2, rejected: 2", out.getvalue())
+        with open(rejects, encoding="utf-8") as file:
+            rows = list(csv.reader(file))
+        self.assertEqual([row[:2] for row in rows[1:]], [["4", "name is required"], ["5", "invalid price 'abc'"]])
+
+    def test_ndjson_in_process_pool(self):
+        path = self.write("catalogue.ndjson", "\n".join(
+            json.dumps({"sku": f"N-{index}", "name": f"Product {index}", "price": index})
+            for index in range(50)
+        ) + "\n[1, 2]\n")
+        out = io.StringIO()
+        call_command("import_products", path, "--batch-size", "10", "--workers", "2", stdout=out)
+        self.assertEqual(Product.objects.filter(sku__startswith="N-").count(), 50)
+        self.assertIn("imported: 50, rejected: 1", out.getvalue())
+
+
+class BulkOrdersTestCase(QueryBudgetTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="marketplace", password="qwerty")
+        cls.user.user_permissions.add(Permission.objects.get(codename="add_order"))
+        cls.products = [Product.objects.create(name=f"Product {index}") for index in range(3)]
+
+    def setUp(self):
+        translation.activate("en")
+        self.client.force_login(self.user)
+        self.url = reverse("shopapp:order-bulk-create")
+
+    def test_valid_orders_created_and_errors_reported(self):
+        orders = [
+            {"delivery_address": f"Street {index}", "products": [product.pk for product in self.products]}
+            for index in range(20)
+        ]
+        orders[3] = {"delivery_address": "Nowhere", "products": [999]}
+        orders[7] = {"promo_code": "X" * 21, "products": [self.products[0].pk]}
+        orders[9] = {"user": self.user.pk + 100, "products": [self.products[0].pk]}
+
+        with self.assertQueryBudget(14):
+            response = self.client.post(self.url, {"orders": orders}, content_type="application/json")
+
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(len(data["created"]), 17)
+        self.assertEqual([error["index"] for error in data["errors"]], [3, 7, 9])
+        self.assertIn("Unknown products [999].", data["errors"][0]["errors"]["products"])
+        self.assertEqual(data["errors"][2]["errors"]["user"], ["You can only create orders for yourself."])
+        order = Order.objects.get(pk=data["created"][0]["pk"])
+        self.assertEqual(order.user, self.user)
+        self.assertEqual(order.products.count(), 3)
+
+    def test_atomic_creates_nothing_on_error(self):
+        response = self.client.post(
+            self.url,
+            {"orders": [{"products": [self.products[0].pk]}, {"products": []}], "atomic": True},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+    def test_import_orders_command(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, "orders.ndjson")
+        with open(path, "w") as file:
+            file.write(json.dumps({"products": [self.products[1].pk]}) + "\nnot json\n")
+        out, err = io.StringIO(), io.StringIO()
+        call_command("import_orders", path, "--user", "marketplace", stdout=out, stderr=err)
+        self.assertIn("Orders created: 1, rejected: 1", out.getvalue())
+        self.assertIn("line 2:", err.getvalue())
+        self.assertEqual(Order.objects.get().products.get(), self.products[1])
+
+
+@override_settings(THUMBNAIL_WORKERS=0)
+class ProductImageStatsTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_override = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        translation.activate("en")
+        self.product = Product.objects.create(name="Sofa")
+
+    def add_image(self) -> ProductImage:
+        return ProductImage.objects.create(
+            product=self.product,
+            image=ProductThumbnailsTestCase.make_image(20, 20),
+        )
+
+    def test_count_and_cover_follow_images(self):
+        first, second = self.add_image(), self.add_image()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.images_count, self.product.cover_image_id), (2, first.pk))
+
+        first.delete()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.images_count, self.product.cover_image_id), (1, second.pk))
+
+        second.delete()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.images_count, self.product.cover_image_id), (0, None))
+
+    def test_stale_instance_save_keeps_stats(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        image = self.add_image()
+        stale.name = "Corner sofa"
+        stale.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.name, "Corner sofa")
+        self.assertEqual((self.product.images_count, self.product.cover_image_id), (1, image.pk))
+        self.assertEqual((stale.images_count, stale.cover_image_id), (1, image.pk))
+
+    def test_save_of_deleted_product_inserts_it_again(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        Product.objects.filter(pk=stale.pk).delete()
+        stale.save()
+        self.assertTrue(Product.objects.filter(pk=stale.pk, name=stale.name).exists())
+
+    def test_refresh_command(self):
+        images = ProductImage.objects.bulk_create(
+            ProductImage(product=self.product, image=f"products/sofa-{index}.png") for index in range(3)
+        )
+        Product.objects.create(name="Empty shelf")
+        out = io.StringIO()
+        call_command("refresh_image_stats", stdout=out)
+        self.assertIn("refreshed for 1 products", out.getvalue())
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.images_count, self.product.cover_image_id), (3, images[0].pk))
+
+    def test_pages_render_without_counting(self):
+        self.add_image()
+        self.add_image()
+        url = reverse("shopapp:product_details", kwargs={"pk": self.product.pk})
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertContains(response, "There are 2 images available.")
+        self.assertFalse(any("COUNT(" in query["sql"] for query in context.captured_queries))
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("shopapp:products_list"))
+        self.assertContains(response, "2 images")
+
+
+class SalesAnalyticsTestCase(QueryBudgetTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(username="analyst", password="qwerty", is_staff=True)
+        cls.buyer = User.objects.create_user(username="buyer", password="qwerty")
+        cls.chair = Product.objects.create(name="Chair", price=Decimal("100.00"), discount=10)
+        cls.table = Product.objects.create(name="Table", price=Decimal("50.00"))
+
+    def setUp(self):
+        translation.activate("en")
+
+    def rollups(self) -> tuple:
+        return (
+            sorted(ProductSalesDaily.objects.values_list("product_id", "units", "revenue")),
+            sorted(UserSpendDaily.objects.values_list("user_id", "orders", "spend")),
+        )
+
+    def test_rollups_follow_order_changes(self):
+        order = Order.objects.create(user=self.buyer)
+        order.products.add(self.chair, self.table)
+        self.chair.price = 200
+        self.chair.save()
+        self.assertEqual(self.rollups(), (
+            [(self.chair.pk, 1, Decimal("90.00")), (self.table.pk, 1, Decimal("50.00"))],
+            [(self.buyer.pk, 1, Decimal("140.00"))],
+        ))
+        self.assertEqual(OrderLine.objects.get(order=order, product=self.chair).price, Decimal("100.00"))
+
+        order.products.remove(self.table)
+        self.assertEqual(self.rollups()[1], [(self.buyer.pk, 1, Decimal("90.00"))])
+
+        order.user = self.staff
+        order.save()
+        self.assertEqual(self.rollups()[1], sorted([
+            (self.staff.pk, 1, Decimal("90.00")),
+            (self.buyer.pk, 0, Decimal("0.00")),
+        ]))
+
+        order.delete()
+        self.assertEqual(self.rollups(), (
+            [(self.chair.pk, 0, Decimal("0.00")), (self.table.pk, 0, Decimal("0.00"))],
+            sorted([(self.buyer.pk, 0, Decimal("0.00")), (self.staff.pk, 0, Decimal("0.00"))]),
+        ))
+
+    def test_order_created_through_api(self):
+        self.client.force_login(self.staff)
+        response = self.client.post(
+            reverse("shopapp:order-list"),
+            {"delivery_address": "Main st.", "user": self.buyer.pk, "products": [self.chair.pk]},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()["products"], [self.chair.pk])
+        self.assertEqual(self.rollups()[1], [(self.buyer.pk, 1, Decimal("90.00"))])
+
+    def test_order_changed_and_deleted_through_api_within_budget(self):
+        order = Order.objects.create(user=self.buyer)
+        order.products.add(self.chair)
+        extra = [Product.objects.create(name=f"Stool {index}", price=10) for index in range(3)]
+        self.client.force_login(self.staff)
+        url = reverse("shopapp:order-detail", kwargs={"pk": order.pk})
+
+        response = self.assertWithinDeclaredBudget(
+            url, "PATCH",
+            data={"user": self.staff.pk, "products": [self.table.pk, *(product.pk for product in extra)]},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.rollups()[1], sorted([
+            (self.buyer.pk, 0, Decimal("0.00")),
+            (self.staff.pk, 1, Decimal("80.00")),
+        ]))
+
+        response = self.assertWithinDeclaredBudget(url, "DELETE")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual({row[1:] for row in self.rollups()[0]}, {(0, Decimal("0.00"))})
+        self.assertEqual({row[1:] for row in self.rollups()[1]}, {(0, Decimal("0.00"))})
+
+    def test_product_deletion_subtracts_spend_in_one_pass(self):
+        buyers = [User.objects.create_user(username=f"chair-buyer-{index}") for index in range(3)]
+        create_orders([{"user": buyer.pk, "products": [self.chair.pk, self.table.pk]} for buyer in buyers])
+        with self.assertNoNPlusOne(threshold=2):
+            self.chair.delete()
+        self.assertEqual(self.rollups()[1], [(buyer.pk, 1, Decimal("50.00")) for buyer in buyers])
+        incremental = self.rollups()
+        rebuild_rollups()
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_migration_backfill(self):
+        create_orders([{"user": self.buyer.pk, "products": [self.chair.pk]}])
+        incremental = self.rollups()
+        ProductSalesDaily.objects.all().delete()
+        UserSpendDaily.objects.all().delete()
+        rebuild_rollups(django_apps)
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_bulk_orders_and_rebuild_agree(self):
+        create_orders([
+            {"user": self.buyer.pk, "products": [self.chair.pk, self.table.pk]},
+            {"user": self.buyer.pk, "products": [self.chair.pk]},
+        ])
+        incremental = self.rollups()
+        self.assertEqual(incremental[1], [(self.buyer.pk, 2, Decimal("230.00"))])
+        rebuild_rollups()
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_api(self):
+        order = Order.objects.create(user=self.buyer)
+        order.products.add(self.chair, self.table)
+
+        self.client.force_login(self.buyer)
+        self.assertEqual(self.client.get(reverse("shopapp:analytics_top_products")).status_code, 403)
+        self.assertEqual(
+            self.client.get(reverse("shopapp:analytics_user_spend", kwargs={"pk": self.staff.pk})).status_code,
+            403,
+        )
+        response = self.client.get(reverse("shopapp:analytics_user_spend", kwargs={"pk": self.buyer.pk}))
+        self.assertEqual(response.json()["spend"], "140.00")
+
+        self.client.force_login(self.staff)
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse("shopapp:analytics_top_products"), {"limit": 1})
+        self.assertEqual(response.json(), [{"product": self.chair.pk, "name": "Chair", "units": 1, "revenue": "90.00"}])
+        response = self.client.get(reverse("shopapp:analytics_revenue"), {"product": self.table.pk})
+        self.assertEqual([row["revenue"] for row in response.json()], ["50.00"])
+        response = self.client.get(reverse("shopapp:analytics_revenue"), {"since": "2030-01-02", "until": "2030-01-01"})
+        self.assertEqual(response.status_code, 400)
+
+
+class ProductAutocompleteTestCase(TestCase):
+    def setUp(self):
+        translation.activate("en")
+        cache.clear()
+        self.chair = Product.objects.create(name="Red office chair")
+        self.desk = Product.objects.create(name="Office desk")
+        Product.objects.create(name="Old chair", archived=True)
+        self.index = ProductPrefixIndex()
+        patcher = mock.patch("shopapp.views.product_index", self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_word_prefix_search(self):
+        self.assertEqual(self.index.search("off"), [(self.desk.pk, "Office desk"), (self.chair.pk, "Red office chair")])
+        self.assertEqual(self.index.search("  CHAIR "), [(self.chair.pk, "Red office chair")])
+        self.assertEqual(self.index.search("office c"), [(self.chair.pk, "Red office chair")])
+        self.assertEqual(self.index.search("off", limit=1), [(self.desk.pk, "Office desk")])
+        self.assertEqual(self.index.search(""), [])
+
+    def test_incremental_refresh(self):
+        self.index.search("chair")
+        lamp = Product.objects.create(name="Desk lamp")
+        self.desk.name = "Standing desk"
+        self.desk.save()
+        Product.objects.filter(pk=self.chair.pk).update_tracked(archived=True)
+        invalidate_catalogue()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.index.search("desk"), [(lamp.pk, "Desk lamp"), (self.desk.pk, "Standing desk")])
+        self.assertEqual(self.index.search("office"), [])
+        self.assertEqual(len(self.index), 2)
+
+    def test_endpoint(self):
+        url = reverse("shopapp:product-autocomplete")
+        response = self.client.get(url, {"q": "red"})
+        self.assertEqual(response.json(), [{"pk": self.chair.pk, "name": "Red office chair"}])
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {"q": "office", "limit": 1})
+        self.assertEqual(response.json(), [{"pk": self.desk.pk, "name": "Office desk"}])
+        self.assertEqual(self.client.get(url, {"q": "x", "limit": 500}).status_code, 400)
+
+    def test_admin_inline_renders_only_selected_products(self):
+        admin = User.objects.create_superuser(username="autocomplete-admin", password="qwerty")
+        order = Order.objects.create(user=admin)
+        order.products.add(self.chair)
+        self.client.force_login(admin)
+        response = self.client.get(reverse("admin:shopapp_order_change", args=[order.pk]))
+        self.assertContains(response, 'data-autocomplete-url="/en/shop/api/products/autocomplete/"')
+        self.assertContains(response, "Red office chair")
+        self.assertNotContains(response, "Office desk")
+
+
+class ProductFacetsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for price, discount, archived in (
+            (50, 0, False), (99, 5, False), (100, 5, False), (750, 30, False), (9000, 60, True),
+        ):
+            Product.objects.create(name=f"Product {price}", price=price, discount=discount, archived=archived)
+
+    def setUp(self):
+        translation.activate("en")
+
+    @staticmethod
+    def counts(facet):
+        return {bucket["key"]: bucket["count"] for bucket in facet}
+
+    def test_counts_from_one_grouped_query(self):
+        with self.assertNumQueries(1):
+            facets = product_facets(Product.objects.all())
+        self.assertEqual(
+            self.counts(facets["price"]),
+            {"0-100": 2, "100-500": 1, "500-1000": 1, "1000-5000": 0, "5000+": 1},
+        )
+        self.assertEqual(self.counts(facets["discount"]), {"0-1": 1, "1-10": 2, "10-25": 0, "25-50": 1, "50+": 1})
+        self.assertEqual(self.counts(facets["archived"]), {False: 4, True: 1})
+        self.assertEqual(facets["price"][1], {"key": "100-500", "gte": 100, "lt": 500, "count": 1})
+
+    def test_uses_covering_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            product_facets(Product.objects.filter(archived=False, price__gte=100))
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {queries.captured_queries[0]['sql']}")
+            plan = " ".join(row[-1] for row in cursor.fetchall())
+        self.assertIn("COVERING INDEX shopapp_product_facets_idx", plan)
+
+    def test_api_facets_follow_filters(self):
+        response = self.client.get(
+            reverse("shopapp:product-list"),
+            {"archived": False, "price__gte": 99, "price__lt": 1000, "facets": 1},
+        )
+        data = response.json()
+        self.assertEqual(sorted(product["price"] for product in data["results"]), ["100.00", "750.00", "99.00"])
+        self.assertEqual(self.counts(data["facets"]["price"])["0-100"], 1)
+        self.assertEqual(self.counts(data["facets"]["archived"]), {False: 3, True: 0})
+
+        response = self.client.get(reverse("shopapp:product-list"), {"search": "product", "facets": "true"})
+        self.assertEqual(self.counts(response.json()["facets"]["archived"]), {False: 4, True: 1})
+
+        response = self.client.get(reverse("shopapp:product-list"))
+        self.assertNotIn("facets", response.json())
+
+    def test_invalid_facets_rejected_before_list_queries(self):
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("shopapp:product-list"), {"facets": "maybe"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("facets", response.json())
+
+
+class ExplainQueriesCommandTestCase(TestCase):
+    def test_views_use_indexes(self):
+        User.objects.create_user(username="explain")
+        out = io.StringIO()
+        call_command("explain_queries", "--fail", stdout=out)
+        self.assertIn("ok        OrderViewSet ?user=<pk>", out.getvalue())
+        self.assertNotIn("FULL SCAN", out.getvalue())
+
+    def test_reports_full_scan(self):
+        _, tables = full_scans(Product.objects.filter(description="chair").order_by())
+        self.assertEqual(tables, {"shopapp_product"})
+        _, tables = full_scans(Product.objects.filter(archived=False).order_by("name", "price")[:10])
+        self.assertEqual(tables, set())
+
+
+class OrderFormWidgetsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.buyer = User.objects.create_user(username="widget-buyer", password="qwerty")
+        User.objects.create_user(username="widget-other", password="qwerty")
+        cls.products = [Product.objects.create(name=f"Widget product {index:02}") for index in range(30)]
+        cls.order = Order.objects.create(user=cls.buyer, delivery_address="Main st.")
+        cls.order.products.add(cls.products[0])
+        cls.staff = User.objects.create_user(username="widget-staff", password="qwerty", is_staff=True)
+
+    def setUp(self):
+        translation.activate("en")
+        self.client.force_login(self.staff)
+
+    def test_create_form_renders_no_choices(self):
+        response = self.client.get(reverse("shopapp:order_create"))
+        self.assertContains(response, 'data-autocomplete-url="/en/shop/api/products/autocomplete/"')
+        self.assertContains(response, 'data-autocomplete-url="/api/users/autocomplete/"')
+        self.assertContains(response, "shopapp/js/autocomplete.js")
+        self.assertNotContains(response, "Widget product")
+        self.assertNotContains(response, "widget-other")
+
+    def test_non_staff_selects_only_themselves(self):
+        # поиск пользователей ответил бы им 403, а полный список раскрыл бы всех
+        self.client.force_login(self.buyer)
+        response = self.client.get(reverse("shopapp:order_create"))
+        self.assertNotContains(response, 'data-autocomplete-url="/api/users/autocomplete/"')
+        self.assertContains(response, f'<option value="{self.buyer.pk}" selected>widget-buyer</option>', html=True)
+        self.assertNotContains(response, "widget-other")
+        self.assertNotContains(response, "widget-staff")
+        self.assertContains(response, 'data-autocomplete-url="/en/shop/api/products/autocomplete/"')
+
+        response = self.client.post(reverse("shopapp:order_create"), {
+            "delivery_address": "Main st.",
+            "promo_code": "",
+            "user": self.staff.pk,
+            "products": [self.products[1].pk],
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Order.objects.filter(user=self.staff).exists())
+
+    def test_anonymous_is_redirected_to_login(self):
+        self.client.logout()
+        response = self.client.get(reverse("shopapp:order_create"))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(str(settings.LOGIN_URL), response.url)
+
+    def test_update_form_renders_only_selected(self):
+        # session, user, order, its products (initial), selected user, selected products
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse("shopapp:order_update", kwargs={"pk": self.order.pk}))
+        self.assertContains(response, "Widget product 00")
+        self.assertNotContains(response, "Widget product 01")
+        self.assertContains(response, "widget-buyer")
+        self.assertNotContains(response, "widget-other")
+
+    def test_update_form_saves(self):
+        response = self.client.post(reverse("shopapp:order_update", kwargs={"pk": self.order.pk}), {
+            "delivery_address": "Second st.",
+            "promo_code": "",
+            "user": self.buyer.pk,
+            "products": [self.products[1].pk, self.products[2].pk],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            sorted(self.order.products.values_list("pk", flat=True)),
+            [self.products[1].pk, self.products[2].pk],
+        )
@@ -0,0 +1,159 @@
+"""
+Миниатюры для ``Product.preview`` и ``ProductImage.image``.
+
+После сохранения картинки (и коммита транзакции) исходный файл уходит в
+пул процессов, там из него делаются WebP-копии ширин ``THUMBNAIL_WIDTHS``.
+Готовые копии сохраняются рядом с оригиналом в ``thumbs/`` под именем с
+хэшем содержимого, а их список — в JSON-поле модели
+(``preview_variants`` / ``variants``)::
+
+    {"source": "<имя оригинала>", "sizes": [{"name": ..., "width": ..., "height": ...}]}
+
+Шаблоны строят по нему ``srcset`` (``shopapp_images``). При
+``THUMBNAIL_WORKERS = 0`` миниатюры делаются сразу, без пула (тесты, отладка).
+"""
+
+import hashlib
+import logging
+import multiprocessing
+import posixpath
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+
+from .cache import invalidate_catalogue
+from .imaging import render_webp_variants
+from .models import Product, ProductImage
+
+log = logging.getLogger(__name__)
+
+DEFAULT_WIDTHS = (160, 320, 640)
+
+# модель -> (поле с картинкой, поле со списком миниатюр)
+TARGETS = {
+    Product: ("preview", "preview_variants"),
+    ProductImage: ("image", "variants"),
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_widths() -> tuple:
+    return tuple(getattr(settings, "THUMBNAIL_WIDTHS", DEFAULT_WIDTHS))
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn, а не fork: процесс сервера многопоточный и держит соединения с БД
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.THUMBNAIL_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+    return _executor
+
+
+def needs_variants(instance) -> bool:
+    field_name, variants_name = TARGETS[type(instance)]
+    file = getattr(instance, field_name)
+    variants = getattr(instance, variants_name) or {}
+    if not file:
+        return bool(variants)
+    return variants.get("source") != file.name
+
+
+def schedule_variants(instance) -> None:
+    """Запускает генерацию миниатюр после коммита текущей транзакции."""
+    model = type(instance)
+    field_name, _ = TARGETS[model]
+    file = getattr(instance, field_name)
+    if not file:
+        _update_variants(model, instance.pk, {})
+        return
+
+    source = file.name
+    transaction.on_commit(lambda: generate_variants(model, instance.pk, source))
+
+
+def read_source(source: str):
+    try:
+        with default_storage.open(source, "rb") as file:
+            return file.read()
+    except OSError:
+        log.warning("Image %s is missing, thumbnails skipped", source)
+        return None
+
+
+def generate_variants(model, pk, source: str) -> None:
+    data = read_source(source)
+    if data is None:
+        return
+    if not getattr(settings, "THUMBNAIL_WORKERS", 0):
+        store_variants(model, pk, source, render_webp_variants(data, get_widths()))
+        return
+
+    caller = threading.get_ident()
+    future = get_executor().submit(render_webp_variants, data, get_widths())
+    future.add_done_callback(lambda done: _store_finished(model, pk, source, done, caller))
+
+
+def _store_finished(model, pk, source: str, future, caller: int) -> None:
+    try:
+        store_variants(model, pk, source, future.result())
+    except Exception:
+        log.exception("Thumbnails for %s pk=%s failed", model.__name__, pk)
+    finally:
+        # Обычно колбэк выполняется в служебном потоке пула со своим соединением.
+        # Если задача уже завершилась, add_done_callback вызывает его сразу в
+        # потоке запроса — его соединение закрывать нельзя.
+        if threading.get_ident() != caller:
+            connection.close()
+
+
+def _variant_names(variants) -> list:
+    return [size["name"] for size in (variants or {}).get("sizes", [])]
+
+
+def release_variant_files(names) -> None:
+    """Удаляет файлы миниатюр (в ContentAddressedStorage — снимает по ссылке) после коммита."""
+    names = list(names)
+    if names:
+        transaction.on_commit(lambda: [default_storage.delete(name) for name in names])
+
+
+def store_variants(model, pk, source: str, rendered) -> dict:
+    directory, filename = posixpath.split(source)
+    stem = posixpath.splitext(filename)[0]
+    sizes = []
+    for width, height, content in rendered:
+        digest = hashlib.sha256(content).hexdigest()[:12]
+        name = posixpath.join(directory, "thumbs", f"{stem}-{width}w.{digest}.webp")
+        # каждое сохранение — своя ссылка на блоб (или свой файл), прежние
+        # миниатюры освобождаются в _update_variants
+        name = default_storage.save(name, ContentFile(content))
+        sizes.append({"name": name, "width": width, "height": height})
+
+    field_name, _ = TARGETS[model]
+    variants = {"source": source, "sizes": sizes}
+    _update_variants(model, pk, variants, **{field_name: source})
+    return variants
+
+
+def _update_variants(model, pk, variants: dict, **lookup) -> None:
+    _, variants_name = TARGETS[model]
+    # картинку могли заменить, пока делались миниатюры, — тогда не записываем
+    queryset = model.objects.filter(pk=pk, **lookup)
+    update = getattr(queryset, "update_tracked", queryset.update)
+    with transaction.atomic():
+        previous = queryset.select_for_update().values_list(variants_name, flat=True).first()
+        if update(**{variants_name: variants}):
+            release_variant_files(_variant_names(previous))
+            invalidate_catalogue()
+        else:
+            release_variant_files(_variant_names(variants))
@@ -16,6 +16,12 @@ from shopapp.views import (
     OrdersExportView,
     ProductViewSet,
     OrderViewSet,
+    ProductUploadsView,
+    FinalizeProductUploadsView,
+    UploadSessionView,
+    TopProductsView,
+    RevenueSeriesView,
+    UserSpendView,
 )
 
 routers = DefaultRouter()
@@ -27,6 +33,16 @@ app_name = 'shopapp'
 urlpatterns = [
     path('', ShopIndexView.as_view(), name="index"),
     path('api/', include(routers.urls)),
+    path('api/products/<int:pk>/uploads/', ProductUploadsView.as_view(), name='product_uploads'),
+    path(
+        'api/products/<int:pk>/uploads/finalize/',
+        FinalizeProductUploadsView.as_view(),
+        name='product_uploads_finalize',
+    ),
+    path('api/uploads/<uuid:pk>/', UploadSessionView.as_view(), name='upload_session'),
+    path('api/analytics/top-products/', TopProductsView.as_view(), name='analytics_top_products'),
+    path('api/analytics/revenue/', RevenueSeriesView.as_view(), name='analytics_revenue'),
+    path('api/analytics/users/<int:pk>/spend/', UserSpendView.as_view(), name='analytics_user_spend'),
     path('groups/', GroupsListView.as_view(), name='groups_list'),
     path('products/', ProductsListView.as_view(), name='products_list'),
     path('products/create/', ProductCreateView.as_view(), name='product_create'),
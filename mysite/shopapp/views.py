@@ -4,36 +4,78 @@
 Разные view интернет магазина по товарам , заказам и т.д.
 """
 
+from decimal import Decimal
 from timeit import default_timer
 
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.models import Group
 from django.core.exceptions import PermissionDenied
-from django.shortcuts import render, redirect, reverse
-from django.http import HttpResponse, HttpRequest, HttpResponseRedirect, JsonResponse
+from django.shortcuts import render, redirect, reverse, get_object_or_404
+from django.db import transaction
+from django.db.models import Prefetch, Sum
+from django.http import HttpResponse, HttpRequest, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.urls import reverse_lazy
 from django.views import View
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
+from rest_framework import status
+from rest_framework.exceptions import PermissionDenied as APIPermissionDenied
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_framework.decorators import action
 from rest_framework.viewsets import ModelViewSet
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.filters import OrderingFilter
 from django_filters.rest_framework import DjangoFilterBackend
 from drf_spectacular.utils import extend_schema, OpenApiResponse
 
+from accounts.mixins import ObjectPermissionMixin
+from requestdataapp import querybudget
+from . import analytics
+from .autocomplete import product_index
+from .bulk import create_orders
+from .cache import CataloguePageCacheMixin
+from .conditional import ConditionalRequestMixin
+from .facets import product_facets
+from .exporters import iter_orders_data, stream_json, stream_ndjson, stream_csv
 from .forms import OrderForm, GroupForm, ProductForm
-from shopapp.models import Product, Order, ProductImage
-from .serializers import ProductSerializer, OrderSerializer
+from .pagination import CursorOrPageNumberPagination
+from . import resumable
+from .search import ProductSearchFilter
+from shopapp.models import Product, Order, ProductImage, ProductSalesDaily, UploadSession, UserSpendDaily
+from .serializers import (
+    ProductSerializer,
+    OrderSerializer,
+    OrderExpandedSerializer,
+    ProductSummarySerializer,
+    UploadSessionSerializer,
+    FinalizeUploadsSerializer,
+    BulkOrdersSerializer,
+    ProductImageSerializer,
+    AnalyticsQuerySerializer,
+    AutocompleteQuerySerializer,
+    FacetsQuerySerializer,
+    ProductSalesSerializer,
+    SalesDaySerializer,
+    UserSpendSerializer,
+)
 
 
 @extend_schema(description="Product views CRUD")
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(ConditionalRequestMixin, ModelViewSet):
     """
     Набор представлений для действий над Product
     Полный CRUD для сущностей товара
     """
+    # PUT / PATCH: сессия и пользователь (2), savepoint (2), блокировка строки
+    # и ETag до (2), товар (1), счётчик картинок и обложка (1, Product.save),
+    # UPDATE (1), ETag после (1)
+    query_budget = 10
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    pagination_class = CursorOrPageNumberPagination
     filter_backends = [
-        SearchFilter,
+        ProductSearchFilter,
         DjangoFilterBackend,
         OrderingFilter,
     ]
@@ -41,19 +83,54 @@ class ProductViewSet(ModelViewSet):
         "name",
         "description",
     ]
-    filterset_fields = [
-        "name",
-        "description",
-        "price",
-        "discount",
-        "archived",
-    ]
+    filterset_fields = {
+        "name": ["exact"],
+        "description": ["exact"],
+        "price": ["exact", "gte", "lte", "lt"],
+        "discount": ["exact", "gte", "lte", "lt"],
+        "archived": ["exact"],
+    }
     ordering_fields = [
         "name",
         "price",
         "discount",
     ]
 
+    @extend_schema(parameters=[FacetsQuerySerializer])
+    def list(self, request, *args, **kwargs):
+        """С ``?facets=1`` рядом с результатами отдаются счётчики фасетов (shopapp.facets)"""
+        # параметры проверяются до запросов списка
+        serializer = FacetsQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        response = super().list(request, *args, **kwargs)
+        if serializer.validated_data["facets"] and response.status_code == status.HTTP_200_OK:
+            facets = product_facets(self.filter_queryset(self.get_queryset()))
+            if isinstance(response.data, dict):
+                response.data["facets"] = facets
+            else:
+                response.data = {"results": response.data, "facets": facets}
+        return response
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        # подсветка поиска — только для товаров страницы
+        if page is not None:
+            ProductSearchFilter().add_highlights(self.request, page)
+        return page
+
+    @extend_schema(
+        parameters=[AutocompleteQuerySerializer],
+        responses={200: OpenApiResponse(description="Up to `limit` products as {pk, name}")},
+    )
+    @action(detail=False, methods=["get"])
+    @querybudget.query_budget(3)
+    def autocomplete(self, request):
+        """Подсказки по началу слова в названии из индекса в памяти (shopapp.autocomplete)"""
+        serializer = AutocompleteQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        results = product_index.search(serializer.validated_data["q"], serializer.validated_data["limit"])
+        return Response([{"pk": pk, "name": name} for pk, name in results])
+
     @extend_schema(
         summary="Get one product by ID",
         description="Retrieves **product**, returns 404 if not found",
@@ -65,10 +142,25 @@ class ProductViewSet(ModelViewSet):
     def retrieve(self, *args, **kwargs):
         return super().retrieve(*args, **kwargs)
 
+    # удаление: вместо UPDATE и ETag после — каскад по картинкам, строкам заказов,
+    # сессиям загрузки и агрегатам продаж (5), DELETE товара (1), вычет трат
+    # покупателей по всем строкам товара разом (4) и версия его заказов (1)
+    @querybudget.query_budget(17)
+    def destroy(self, request, *args, **kwargs):
+        return super().destroy(request, *args, **kwargs)
+
+
+class OrderViewSet(ConditionalRequestMixin, ModelViewSet):
+    """
+    Набор представлений для действий над Order
 
-class OrderViewSet(ModelViewSet):
+    Товары заказов страницы загружаются одним запросом (только id,
+    либо краткие данные при ``?expand=products``).
+    """
+    query_budget = 7
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
+    pagination_class = CursorOrPageNumberPagination
     filter_backends = [
         DjangoFilterBackend,
         OrderingFilter,
@@ -78,9 +170,275 @@ class OrderViewSet(ModelViewSet):
         "user",
         "products",
     ]
+    ordering_fields = [
+        "created_at",
+    ]
+    ordering = [
+        "created_at",
+        "pk",
+    ]
+
+    def expand_products(self) -> bool:
+        expand = self.request.query_params.get("expand", "") if self.request else ""
+        return "products" in expand.split(",")
+
+    def get_queryset(self):
+        if self.expand_products():
+            products = Product.objects.only(*ProductSummarySerializer.Meta.fields)
+        else:
+            products = Product.objects.only("pk")
+        return super().get_queryset().prefetch_related(
+            # порядок товаров в ответе — как у модели (Product.Meta.ordering)
+            Prefetch("products", queryset=products),
+        )
+
+    def get_conditional_querysets(self, queryset, include_related=True):
+        querysets = [queryset]
+        if include_related and self.expand_products():
+            querysets.append(Product.objects.filter(orders__in=queryset.values("pk")).distinct())
+        return querysets
+
+    def get_serializer_class(self):
+        if self.request.method == "GET" and self.expand_products():
+            return OrderExpandedSerializer
+        return super().get_serializer_class()
+
+    # снимок цен в строках и обновление агрегатов аналитики (shopapp.analytics)
+    @querybudget.query_budget(18)
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
+    # смена покупателя и всех товаров: блокировка и ETag до и после (4), заказ (3),
+    # товары (2), удаление и вставка строк со снимком цен (9), агрегаты (5)
+    @querybudget.query_budget(28)
+    def update(self, request, *args, **kwargs):
+        return super().update(request, *args, **kwargs)
+
+    @querybudget.query_budget(28)
+    def partial_update(self, request, *args, **kwargs):
+        return super().partial_update(request, *args, **kwargs)
+
+    # строки заказа читаются для вычета из агрегатов, агрегаты — 4 запроса
+    @querybudget.query_budget(16)
+    def destroy(self, request, *args, **kwargs):
+        return super().destroy(request, *args, **kwargs)
+
+    # смена покупателя и товаров пишет агрегаты одним набором запросов
+    def perform_create(self, serializer):
+        with transaction.atomic(savepoint=False), analytics.batch():
+            serializer.save()
+
+    def perform_update(self, serializer):
+        with transaction.atomic(savepoint=False), analytics.batch():
+            serializer.save()
+
+    def perform_destroy(self, instance):
+        with transaction.atomic(savepoint=False), analytics.batch():
+            instance.delete()
+
+    @extend_schema(
+        request=BulkOrdersSerializer,
+        responses={200: OpenApiResponse(description="Created orders and per-item errors")},
+    )
+    @action(detail=False, methods=["post"], url_path="bulk")
+    @querybudget.query_budget(14)
+    def bulk_create(self, request):
+        """
+        Создание многих заказов одним запросом (см. ``shopapp.bulk``)
+
+        Без прав ``is_staff`` заказы создаются только на себя.
+        """
+        if not request.user.has_perm("shopapp.add_order"):
+            raise APIPermissionDenied
+        serializer = BulkOrdersSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        created, errors = create_orders(
+            serializer.validated_data["orders"],
+            default_user_id=request.user.pk,
+            only_default_user=not request.user.is_staff,
+            atomic=serializer.validated_data["atomic"],
+        )
+        return Response(
+            {
+                "created": [{"index": index, "pk": order.pk} for index, order in created],
+                "errors": [{"index": index, "errors": item_errors} for index, item_errors in errors.items()],
+            },
+            status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST,
+        )
+
+
+def can_change_product(user, product: Product) -> bool:
+    return user.is_superuser or (
+            user.has_perm('shopapp.change_product') and product.created_by == user)
+
+
+def upload_error_response(error: resumable.UploadError) -> Response:
+    return Response({"detail": str(error)}, status=error.status)
+
+
+class ProductUploadsView(APIView):
+    """
+    Создание загрузки картинки товара по частям
+
+    Дальше данные дописываются через ``UploadSessionView`` (см. ``shopapp.resumable``).
+    """
+    query_budget = 8
+    permission_classes = [IsAuthenticated]
+
+    def get_product(self, pk) -> Product:
+        product = get_object_or_404(Product, pk=pk)
+        if not can_change_product(self.request.user, product):
+            raise APIPermissionDenied
+        return product
+
+    def post(self, request, pk):
+        product = self.get_product(pk)
+        serializer = UploadSessionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        session = resumable.start_upload(product=product, user=request.user, **serializer.validated_data)
+        response = Response(UploadSessionSerializer(session).data, status=status.HTTP_201_CREATED)
+        response["Location"] = reverse("shopapp:upload_session", kwargs={"pk": session.pk})
+        response["Upload-Offset"] = session.offset
+        response["Upload-Length"] = session.size
+        return response
 
 
-class ShopIndexView(View):
+class FinalizeProductUploadsView(ProductUploadsView):
+    """Создание ProductImage из всех переданных загрузок одной транзакцией"""
+    query_budget = 14
+
+    def post(self, request, pk):
+        product = self.get_product(pk)
+        serializer = FinalizeUploadsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            images = resumable.finalize_uploads(product, request.user, serializer.validated_data["uploads"])
+        except resumable.UploadError as error:
+            return upload_error_response(error)
+        return Response(ProductImageSerializer(images, many=True).data, status=status.HTTP_201_CREATED)
+
+
+class UploadSessionView(APIView):
+    """
+    Состояние (HEAD / GET), дозагрузка (PATCH) и отмена (DELETE) загрузки по частям
+    """
+    query_budget = 5
+    permission_classes = [IsAuthenticated]
+
+    def get_session(self, pk) -> UploadSession:
+        return get_object_or_404(UploadSession, pk=pk, created_by=self.request.user)
+
+    @staticmethod
+    def set_upload_headers(response, session: UploadSession):
+        response["Upload-Offset"] = session.offset
+        response["Upload-Length"] = session.size
+        response["Cache-Control"] = "no-store"
+        return response
+
+    def get(self, request, pk):
+        session = self.get_session(pk)
+        return self.set_upload_headers(Response(UploadSessionSerializer(session).data), session)
+
+    def head(self, request, pk):
+        return self.set_upload_headers(Response(status=status.HTTP_200_OK), self.get_session(pk))
+
+    def patch(self, request, pk):
+        session = self.get_session(pk)
+        if request.content_type.split(";")[0].strip() != resumable.CONTENT_TYPE:
+            return Response(
+                {"detail": f"Content-Type must be {resumable.CONTENT_TYPE}."},
+                status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            )
+        try:
+            offset = int(request.headers["Upload-Offset"])
+        except (KeyError, ValueError):
+            return Response({"detail": "Upload-Offset header is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            resumable.append_chunk(session, offset, request.stream)
+        except resumable.UploadError as error:
+            return upload_error_response(error)
+        return self.set_upload_headers(Response(status=status.HTTP_204_NO_CONTENT), session)
+
+    def delete(self, request, pk):
+        resumable.abort_upload(self.get_session(pk))
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class SalesAnalyticsView(APIView):
+    """
+    Основа отчётов по дневным агрегатам ``shopapp.analytics``:
+    запросы читают только агрегаты за период, а не заказы.
+    """
+    query_budget = 3
+    permission_classes = [IsAdminUser]
+    rollup = ProductSalesDaily
+
+    def get_params(self) -> dict:
+        serializer = AnalyticsQuerySerializer(data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
+    def get_rollups(self, params: dict):
+        queryset = self.rollup.objects.all()
+        if "since" in params:
+            queryset = queryset.filter(day__gte=params["since"])
+        if "until" in params:
+            queryset = queryset.filter(day__lte=params["until"])
+        return queryset
+
+
+class TopProductsView(SalesAnalyticsView):
+    """Самые продаваемые товары за период (``?order_by=revenue|units&limit=``)"""
+
+    def get(self, request: Request) -> Response:
+        params = self.get_params()
+        rows = (
+            self.get_rollups(params)
+            .values("product_id", "product__name")
+            .annotate(units=Sum("units"), revenue=Sum("revenue"))
+            .order_by(f"-{params['order_by']}", "product_id")[:params["limit"]]
+        )
+        return Response(ProductSalesSerializer(rows, many=True).data)
+
+
+class RevenueSeriesView(SalesAnalyticsView):
+    """Выручка по дням, по всем товарам или по одному (``?product=``)"""
+
+    def get(self, request: Request) -> Response:
+        params = self.get_params()
+        rows = self.get_rollups(params)
+        if "product" in params:
+            rows = rows.filter(product_id=params["product"])
+        rows = rows.values("day").annotate(units=Sum("units"), revenue=Sum("revenue")).order_by("day")
+        return Response(SalesDaySerializer(rows, many=True).data)
+
+
+class UserSpendView(SalesAnalyticsView):
+    """Заказы и траты покупателя по дням; доступно ему самому и персоналу"""
+    permission_classes = [IsAuthenticated]
+    rollup = UserSpendDaily
+
+    def get(self, request: Request, pk: int) -> Response:
+        if not (request.user.is_staff or request.user.pk == pk):
+            raise APIPermissionDenied
+        rows = list(
+            self.get_rollups(self.get_params())
+            .filter(user_id=pk)
+            .values("day", "orders", "spend")
+            .order_by("day")
+        )
+        return Response(UserSpendSerializer({
+            "user": pk,
+            "orders": sum(row["orders"] for row in rows),
+            "spend": sum((row["spend"] for row in rows), Decimal(0)),
+            "days": rows,
+        }).data)
+
+
+class ShopIndexView(CataloguePageCacheMixin, View):
+    query_budget = 3
+
     def get(self, request: HttpRequest) -> HttpResponse:
         products = Product.objects.all()
         context = {
@@ -92,6 +450,8 @@ class ShopIndexView(View):
 
 
 class GroupsListView(View):
+    query_budget = 4
+
     def get(self, request: HttpRequest) -> HttpResponse:
         context = {
             'form': GroupForm(),
@@ -107,21 +467,24 @@ class GroupsListView(View):
         return redirect(request.path)
 
 
-class ProductDetailsView(DetailView):
+class ProductDetailsView(CataloguePageCacheMixin, DetailView):
+    query_budget = 4
     template_name = 'shopapp/products-details.html'
     # model = Product
     queryset = Product.objects.prefetch_related("images")
     context_object_name = "product"
 
 
-class ProductsListView(ListView):
+class ProductsListView(CataloguePageCacheMixin, ListView):
+    query_budget = 3
     template_name = 'shopapp/products-list.html'
     # model = Product
     context_object_name = "products"
-    queryset = Product.objects.filter(archived=False)
+    queryset = Product.objects.filter(archived=False).select_related("cover_image")
 
 
 class ProductCreateView(UserPassesTestMixin, CreateView):
+    query_budget = 6
     model = Product
     fields = "name", "price", "description", "discount", "preview"
     success_url = reverse_lazy("shopapp:products_list")
@@ -139,7 +502,8 @@ class ProductCreateView(UserPassesTestMixin, CreateView):
         return super().form_valid(form)
 
 
-class ProductUpdateView(UserPassesTestMixin, UpdateView):
+class ProductUpdateView(UserPassesTestMixin, ObjectPermissionMixin, UpdateView):
+    query_budget = 16
     model = Product
     # fields = "name", "price", "description", "discount", "preview"
     template_name_suffix = "_update_form"
@@ -151,7 +515,7 @@ class ProductUpdateView(UserPassesTestMixin, UpdateView):
     def test_func(self):
         product = self.get_object()
         return self.request.user.is_superuser or (
-                self.request.user.has_perm('shopapp.change_product') and product.created_by == self.request.user)
+                self.request.user.has_perm('shopapp.change_product') and product.created_by_id == self.request.user.pk)
 
     def form_valid(self, form):
         response = super().form_valid(form)
@@ -164,6 +528,7 @@ class ProductUpdateView(UserPassesTestMixin, UpdateView):
 
 
 class ProductDeleteView(DeleteView):
+    query_budget = 4
     model = Product
     success_url = reverse_lazy("shopapp:products_list")
 
@@ -175,6 +540,7 @@ class ProductDeleteView(DeleteView):
 
 
 class OrdersListView(LoginRequiredMixin, ListView):
+    query_budget = 4
     queryset = (
         Order.objects
         .select_related("user")
@@ -182,14 +548,16 @@ class OrdersListView(LoginRequiredMixin, ListView):
     )
 
 
-class OrderDetailView(LoginRequiredMixin, PermissionRequiredMixin, DetailView):
+class OrderDetailView(LoginRequiredMixin, PermissionRequiredMixin, ObjectPermissionMixin, DetailView):
+    query_budget = 6
     model = Order
+    object_select_related = ("user",)
     template_name = 'shopapp/order_detail.html'
     context_object_name = 'order'
     permission_required = 'shopapp.view_order'
 
     def has_permission(self):
-        return super().has_permission() and self.get_object().user == self.request.user
+        return super().has_permission() and self.get_object().user_id == self.request.user.pk
 
     # def get_context_data(self, **kwargs):
     #     context = super().get_context_data(**kwargs)
@@ -201,18 +569,39 @@ class OrderDetailView(LoginRequiredMixin, PermissionRequiredMixin, DetailView):
     #     return reverse_lazy('shopapp:order_list')
 
 
-class OrderCreateView(CreateView):
+class OrderFormMixin:
+    """
+    Форма заказа знает, кто её открыл (поиск пользователей — только для персонала),
+    а сохранение заказа и его товаров пишет агрегаты аналитики одним набором запросов.
+    """
+
+    def get_form_kwargs(self):
+        return {**super().get_form_kwargs(), "user": self.request.user}
+
+    def form_valid(self, form):
+        with transaction.atomic(savepoint=False), analytics.batch():
+            return super().form_valid(form)
+
+
+class OrderCreateView(LoginRequiredMixin, OrderFormMixin, CreateView):
+    query_budget = 8
     model = Order
     form_class = OrderForm
     success_url = reverse_lazy('shopapp:order_list')
     template_name = 'shopapp/order_create.html'
 
 
-class OrderUpdateView(UpdateView):
+class OrderUpdateView(LoginRequiredMixin, OrderFormMixin, UpdateView):
+    query_budget = 10
     model = Order
-    fields = "delivery_address", "promo_code", "user", "products"
+    form_class = OrderForm
     template_name_suffix = "_update_form"
 
+    # замена товаров: снимок цен и обновление агрегатов аналитики (shopapp.analytics)
+    @querybudget.query_budget(20)
+    def post(self, request, *args, **kwargs):
+        return super().post(request, *args, **kwargs)
+
     def get_success_url(self):
         return reverse(
             "shopapp:order_detail",
@@ -221,6 +610,7 @@ class OrderUpdateView(UpdateView):
 
 
 class OrderDeleteView(DeleteView):
+    query_budget = 6
     model = Order
     success_url = reverse_lazy('shopapp:order_list')
     template_name = 'shopapp/order_delete.html'
@@ -228,7 +618,18 @@ class OrderDeleteView(DeleteView):
 
 
 class OrdersExportView(PermissionRequiredMixin, UserPassesTestMixin, View):
+    """
+    Выгрузка заказов.
+
+    По умолчанию отдаёт JSON одним ответом, параметр ``?format=``
+    включает потоковую выгрузку: ``stream`` (тот же JSON), ``ndjson`` или ``csv``.
+    """
     permission_required = 'shopapp.view_order'
+    stream_formats = {
+        'stream': (stream_json, 'application/json', 'json'),
+        'ndjson': (stream_ndjson, 'application/x-ndjson', 'ndjson'),
+        'csv': (stream_csv, 'text/csv', 'csv'),
+    }
 
     def test_func(self):
         return self.request.user.is_staff
@@ -237,15 +638,13 @@ class OrdersExportView(PermissionRequiredMixin, UserPassesTestMixin, View):
         if not self.has_permission() or not self.test_func():
             raise PermissionDenied
 
-        orders = Order.objects.all()
-        orders_data = []
-        for order in orders:
-            order_data = {
-                'order_id': order.id,
-                'address': order.delivery_address,
-                'promo_code': order.promo_code,
-                'user_id': order.user.id,
-                'product_ids': [product.id for product in order.products.all()]
-            }
-            orders_data.append(order_data)
-        return JsonResponse({'orders': orders_data})
+        export_format = request.GET.get('format', 'json')
+        if export_format == 'json':
+            return JsonResponse({'orders': list(iter_orders_data())})
+        if export_format not in self.stream_formats:
+            return HttpResponse(f"Unknown export format {export_format!r}", status=400)
+
+        renderer, content_type, extension = self.stream_formats[export_format]
+        response = StreamingHttpResponse(renderer(iter_orders_data()), content_type=content_type)
+        response['Content-Disposition'] = f"attachment; filename=orders-export.{extension}"
+        return response
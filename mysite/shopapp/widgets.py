@@ -0,0 +1,61 @@
+from django import forms
+from django.urls import reverse_lazy
+
+
+class AutocompleteSelectMixin:
+    """
+    Select2 с подсказками из API вместо ``<select>`` со всеми объектами.
+
+    В HTML попадают только выбранные значения (один запрос ``pk__in``),
+    остальное подгружается скриптом ``shopapp/js/autocomplete.js`` по адресу
+    ``url`` — он должен принимать ``?q=`` и отдавать ``[{pk, name}]`` или
+    страницу DRF с ``results``.
+    """
+    url = None
+
+    def __init__(self, attrs=None, choices=(), url=None):
+        super().__init__(attrs, choices)
+        if url is not None:
+            self.url = url
+
+    def build_attrs(self, base_attrs, extra_attrs=None):
+        attrs = super().build_attrs(base_attrs, extra_attrs)
+        attrs["class"] = f"{attrs.get('class', '')} shopapp-autocomplete".strip()
+        attrs["data-autocomplete-url"] = str(self.url)
+        return attrs
+
+    def optgroups(self, name, value, attrs=None):
+        queryset = getattr(self.choices, "queryset", None)
+        if queryset is None:
+            return super().optgroups(name, value, attrs)
+        selected = [pk for pk in value if pk not in ("", None)]
+        options = [] if self.allow_multiple_selected else [self.create_option(name, "", "", False, 0)]
+        for obj in queryset.filter(pk__in=selected) if selected else ():
+            option_value = self.choices.choice(obj)[0]
+            label = self.choices.field.label_from_instance(obj)
+            options.append(self.create_option(name, option_value, label, True, len(options)))
+        return [(None, options, 0)]
+
+    @property
+    def media(self):
+        return forms.Media(
+            js=(
+                "admin/js/vendor/jquery/jquery.js",
+                "admin/js/vendor/select2/select2.full.js",
+                "admin/js/jquery.init.js",
+                "shopapp/js/autocomplete.js",
+            ),
+            css={"screen": ("admin/css/vendor/select2/select2.css",)},
+        )
+
+
+class UserAutocompleteSelect(AutocompleteSelectMixin, forms.Select):
+    url = reverse_lazy("myapiapp:users_autocomplete")
+
+
+class ProductAutocompleteSelect(AutocompleteSelectMixin, forms.Select):
+    url = reverse_lazy("shopapp:product-autocomplete")
+
+
+class ProductAutocompleteSelectMultiple(AutocompleteSelectMixin, forms.SelectMultiple):
+    url = reverse_lazy("shopapp:product-autocomplete")